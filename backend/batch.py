@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Batch configuration (overridable through the environment)
+MAX_BATCH_ITEMS = int(os.environ.get("LTK_BATCH_MAX_ITEMS", "100"))
+# URLs of one batch scraped at the same time; they share the Chrome pool and the HTTP client
+DEFAULT_CONCURRENCY = int(os.environ.get("LTK_BATCH_CONCURRENCY", "2"))
+
+# Written at the root of a combined archive; lists every URL's files by archive name
+MANIFEST_NAME = "manifest.json"
+
+ARCHIVE_MODES = ("combined", "per_url")
+
+def plan_items(items):
+    """
+    Merge repeated URLs of a batch
+
+    The same URL listed twice (with the same type) is scraped once, with the
+    largest count asked for.
+
+    Args:
+        items (list): Dicts with "url", "count" and "urlType"
+
+    Returns:
+        list: The merged items in first-seen order, each with an "index" and
+              the name of its directory in the task's temp dir
+    """
+    planned = {}
+    for item in items:
+        key = (item["url"], item["urlType"])
+        if key in planned:
+            planned[key]["count"] = max(planned[key]["count"], item["count"])
+        else:
+            planned[key] = dict(item)
+
+    merged = list(planned.values())
+    for index, item in enumerate(merged):
+        item["index"] = index
+        item["dir"] = item_dir_name(index, item["url"])
+        item["status"] = "queued"
+        item["files"] = 0
+    if len(merged) < len(items):
+        logger.info(f"Merged {len(items) - len(merged)} repeated URLs in batch")
+    return merged
+
+def item_dir_name(index, url):
+    """Directory name of a batch item: its position and a slug of the URL path"""
+    parts = urlsplit(url)
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", parts.path.strip("/")) or parts.netloc
+    return f"{index + 1:03d}_{slug[:60]}"
+
+def run_batch(items, temp_dir, download, on_item, cancel_event=None, concurrency=None):
+    """
+    Download every item of a batch into its own subdirectory of temp_dir
+
+    Items run on a small thread pool, in the caller's context so progress
+    bindings carry over. A failing item is recorded and the others go on.
+
+    Args:
+        items (list): Items from plan_items()
+        temp_dir (str): The batch task's directory
+        download (callable): Called as download(url, count, target_dir, url_type,
+                             cancel_event=...) and returning the saved paths
+        on_item (callable): Called as on_item(item) after every status change
+        cancel_event: Event that is set when the batch is cancelled or times out
+        concurrency (int): Items in flight at once (default: LTK_BATCH_CONCURRENCY)
+
+    Returns:
+        list: The items, with their final status and file counts
+    """
+    concurrency = max(1, min(concurrency or DEFAULT_CONCURRENCY, len(items) or 1))
+
+    def run_item(item):
+        if cancel_event is not None and cancel_event.is_set():
+            item["status"] = "failed"
+            item["error"] = "cancelled"
+            on_item(item)
+            return
+        item["status"] = "downloading"
+        on_item(item)
+        try:
+            files = download(item["url"], item["count"], os.path.join(temp_dir, item["dir"]),
+                             item["urlType"], cancel_event=cancel_event)
+            item["files"] = len(files)
+            item["status"] = "completed" if files else "failed"
+            if not files:
+                item["error"] = "No files were downloaded"
+        except Exception as e:
+            logger.error(f"Batch item {item['url']} failed: {e}")
+            item["status"] = "failed"
+            item["error"] = str(e)
+        on_item(item)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-item") as executor:
+        # One context copy per item: a Context can only be entered by one thread at a time
+        futures = [executor.submit(contextvars.copy_context().run, run_item, item) for item in items]
+        for future in futures:
+            future.result()
+    return items
+
+def iter_batch_entries(temp_dir, items, list_files):
+    """
+    (path, arcname) pairs of a combined batch archive
+
+    Each item's files sit under its directory. A file that another item already
+    contributed (a post reached from two profiles is materialized from the media
+    cache as a hardlink of the same object) is stored once; the manifest at the
+    archive root maps every URL to the archive names of all its files.
+
+    Args:
+        temp_dir (str): The batch task's directory
+        items (list): The batch's items
+        list_files (callable): zip_stream.list_files
+
+    Yields:
+        tuple: (path, arcname) pairs, then the manifest
+    """
+    seen = {}
+    manifest = []
+    for item in items:
+        item_dir = os.path.join(temp_dir, item["dir"])
+        archived = []
+        for path, arcname in list_files(item_dir) if os.path.isdir(item_dir) else []:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            identity = (stat.st_dev, stat.st_ino)
+            name = f"{item['dir']}/{arcname}"
+            if identity in seen:
+                archived.append(seen[identity])
+                continue
+            seen[identity] = name
+            archived.append(name)
+            yield path, name
+        manifest.append({"url": item["url"], "urlType": item["urlType"], "status": item["status"],
+                         "error": item.get("error"), "files": archived})
+
+    manifest_path = os.path.join(temp_dir, MANIFEST_NAME)
+    with open(manifest_path, "w") as f:
+        json.dump({"items": manifest}, f, indent=2)
+    yield manifest_path, MANIFEST_NAME
+
+class ItemTracker:
+    """
+    Serializes updates of a batch's item list from its worker threads
+
+    Args:
+        items (list): The batch's items
+        publish (callable): Called as publish(items, item) with the lock held,
+                            so the stored list never goes backwards
+    """
+
+    def __init__(self, items, publish):
+        self.items = items
+        self._publish = publish
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        with self._lock:
+            self._publish(self.items, item)
+
+def summarize(items):
+    """Aggregate counts of a batch's items"""
+    summary = {"total": len(items), "completed": 0, "failed": 0, "files": 0}
+    for item in items:
+        if item["status"] in ("completed", "failed"):
+            summary[item["status"]] += 1
+        summary["files"] += item.get("files", 0)
+    return summary
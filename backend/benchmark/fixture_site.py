@@ -0,0 +1,390 @@
+import os
+import re
+import json
+import random
+import logging
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from selenium.common.exceptions import NoSuchElementException
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cards per "page" of the feed; more are appended each time the page is scrolled to the bottom
+FEED_PAGE_SIZE = 12
+
+PROFILE_PATH = "/benchmark_creator"
+
+# Feed page. The markup mirrors what download_video_from_url reads from shopltk.com:
+# cards are links with data-test-id="post-feed-item/card", images sit in .ltk-img
+# with a srcset, and video posts carry a button.play-icon.
+_PROFILE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>Benchmark creator</title></head>
+<body>
+<div id="feed"></div>
+<script>
+var posts = __POSTS__;
+var shown = 0;
+function card(post) {
+    var a = document.createElement('a');
+    a.setAttribute('data-test-id', 'post-feed-item/card');
+    a.href = '/p/' + post.id;
+    var wrapper = document.createElement('div');
+    wrapper.className = 'ltk-img';
+    var img = document.createElement('img');
+    img.srcset = '/img/' + post.id + '/300.jpg 300w, /img/' + post.id + '/1080.jpg 1080w';
+    img.src = '/img/' + post.id + '/300.jpg';
+    img.width = 300;
+    img.height = 400;
+    wrapper.appendChild(img);
+    a.appendChild(wrapper);
+    if (post.video) {
+        var button = document.createElement('button');
+        button.className = 'play-icon';
+        a.appendChild(button);
+    }
+    return a;
+}
+function more() {
+    var feed = document.getElementById('feed');
+    var end = Math.min(shown + __PAGE_SIZE__, posts.length);
+    for (; shown < end; shown++) {
+        feed.appendChild(card(posts[shown]));
+    }
+}
+// Render the first page after a delay, like the real feed's client-side rendering
+setTimeout(more, __RENDER_DELAY__);
+window.addEventListener('scroll', function () {
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 10) {
+        setTimeout(more, __RENDER_DELAY__);
+    }
+});
+</script>
+</body>
+</html>
+"""
+
+# Post page: the player requests its Mux-style playlist, with a per-view token, once the page loads
+_POST_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>Post __ID__</title></head>
+<body>
+<video controls muted playsinline width="540" height="960"></video>
+<script>
+setTimeout(function () {
+    fetch('/stream/__ID__.m3u8?token=' + Math.random().toString(36).slice(2));
+}, __RENDER_DELAY__);
+</script>
+</body>
+</html>
+"""
+
+class FixtureSite:
+    """
+    Local stand-in for an LTK profile, its posts, images and Mux HLS streams
+
+    Everything is generated from a seed, so every run serves the same bytes:
+    a feed of `posts` cards (every `video_every`-th one a video post), an
+    image per card at two widths, and per video a master playlist with two
+    variants of `segments` fMP4 segments each.
+
+    Args:
+        posts (int): Number of posts in the feed
+        video_every (int): Every n-th post is a video post (0 for none)
+        image_bytes (int): Size of the full-width images
+        segments (int): Segments per video variant
+        segment_bytes (int): Size of the top variant's segments
+        render_delay_ms (int): Delay before the feed and the player render
+        latency_ms (int): Added before every response, to model a remote origin
+        seed (int): Seed for the generated bytes
+    """
+
+    def __init__(self, posts=36, video_every=4, image_bytes=250_000, segments=10,
+                 segment_bytes=500_000, render_delay_ms=300, latency_ms=20, seed=1):
+        self.posts = [
+            {"id": f"post{i:04d}", "video": bool(video_every) and i % video_every == video_every - 1}
+            for i in range(posts)
+        ]
+        self.image_bytes = image_bytes
+        self.segments = segments
+        self.segment_bytes = segment_bytes
+        self.render_delay_ms = render_delay_ms
+        self.latency = latency_ms / 1000
+        self.seed = seed
+        self.bytes_served = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def video_posts(self):
+        return sum(1 for post in self.posts if post["video"])
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve on a background thread; returns the base URL"""
+        site = self
+
+        class Handler(_Handler):
+            fixture = site
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fixture-site", daemon=True).start()
+        logger.info(f"Fixture site serving {len(self.posts)} posts at {self.base_url}")
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def profile_url(self):
+        return self.base_url + PROFILE_PATH
+
+    def blob(self, name, size):
+        """Deterministic bytes for a named resource"""
+        return random.Random(f"{self.seed}:{name}").randbytes(size)
+
+    def render(self, path):
+        """
+        Build the response for a path
+
+        Returns:
+            tuple: (status, content type, body bytes)
+        """
+        if path == PROFILE_PATH:
+            page = (_PROFILE_TEMPLATE
+                    .replace("__POSTS__", json.dumps(self.posts))
+                    .replace("__PAGE_SIZE__", str(FEED_PAGE_SIZE))
+                    .replace("__RENDER_DELAY__", str(self.render_delay_ms)))
+            return 200, "text/html", page.encode()
+
+        match = re.fullmatch(r"/p/(post\d+)", path)
+        if match:
+            page = _POST_TEMPLATE.replace("__ID__", match.group(1)).replace("__RENDER_DELAY__", str(self.render_delay_ms))
+            return 200, "text/html", page.encode()
+
+        match = re.fullmatch(r"/img/(post\d+)/(\d+)\.jpg", path)
+        if match:
+            width = int(match.group(2))
+            size = max(1024, self.image_bytes * width // 1080)
+            return 200, "image/jpeg", self.blob(path, size)
+
+        match = re.fullmatch(r"/stream/(post\d+)\.m3u8", path)
+        if match:
+            video_id = match.group(1)
+            playlist = "#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-INDEPENDENT-SEGMENTS\n"
+            for height, bandwidth in ((1080, 4_000_000), (480, 1_000_000)):
+                playlist += (f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={height * 9 // 16}x{height},'
+                             f'CODECS="avc1.640028,mp4a.40.2"\n/stream/{video_id}/{height}.m3u8\n')
+            return 200, "application/vnd.apple.mpegurl", playlist.encode()
+
+        match = re.fullmatch(r"/stream/(post\d+)/(\d+)\.m3u8", path)
+        if match:
+            video_id, height = match.groups()
+            playlist = ("#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-TARGETDURATION:4\n#EXT-X-PLAYLIST-TYPE:VOD\n"
+                        f'#EXT-X-MAP:URI="/stream/{video_id}/{height}/init.mp4"\n')
+            for i in range(self.segments):
+                playlist += f"#EXTINF:4.0,\n/stream/{video_id}/{height}/{i}.m4s\n"
+            playlist += "#EXT-X-ENDLIST\n"
+            return 200, "application/vnd.apple.mpegurl", playlist.encode()
+
+        match = re.fullmatch(r"/stream/(post\d+)/(\d+)/(init\.mp4|\d+\.m4s)", path)
+        if match:
+            height = int(match.group(2))
+            size = 2048 if match.group(3) == "init.mp4" else max(1024, self.segment_bytes * height // 1080)
+            return 200, "video/mp4", self.blob(path, size)
+
+        return 404, "text/plain", b"Not found"
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fixture = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        status, content_type, body = self.fixture.render(path)
+        if self.fixture.latency:
+            threading.Event().wait(self.fixture.latency)
+
+        start, end = 0, len(body) - 1
+        byte_range = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if status == 200 and byte_range:
+            start = int(byte_range.group(1))
+            end = min(int(byte_range.group(2) or end), end)
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{self.fixture.seed}-{len(body)}"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(body[start:end + 1])
+
+        with self.fixture._lock:
+            self.fixture.requests += 1
+            self.fixture.bytes_served += end - start + 1
+
+class _Element:
+    """An element the FixtureDriver reports as found (it has no attributes)"""
+
+    def get_attribute(self, name):
+        return None
+
+    def find_elements(self, by, value):
+        return []
+
+    def click(self):
+        pass
+
+class _SwitchTo:
+    def __init__(self, driver):
+        self._driver = driver
+
+    def window(self, handle):
+        if handle not in self._driver._tabs:
+            raise RuntimeError(f"No such window: {handle}")
+        self._driver.current_window_handle = handle
+
+class FixtureDriver:
+    """
+    Scripted stand-in for a Chrome WebDriver on a FixtureSite, for runs without a browser
+
+    It answers the calls the pipeline makes the way Chrome would on the
+    fixture pages: the feed's cards (a page of them more per scroll) through
+    find_elements and the feed extractor script, a video element on post
+    pages, and the player's playlist request in the performance log. Scripts
+    it doesn't know return None, and DevTools commands are accepted and
+    ignored.
+
+    Args:
+        site (FixtureSite): The running site to browse
+    """
+
+    def __init__(self, site):
+        self.site = site
+        self.caps = {}
+        self.switch_to = _SwitchTo(self)
+        self._handles = itertools.count(1)
+        self._tabs = {}
+        self.current_window_handle = self._open_tab()
+
+    def _open_tab(self):
+        handle = f"tab-{next(self._handles)}"
+        self._tabs[handle] = {"path": None, "shown": 0, "log": []}
+        return handle
+
+    @property
+    def _tab(self):
+        return self._tabs[self.current_window_handle]
+
+    @property
+    def window_handles(self):
+        return list(self._tabs)
+
+    @property
+    def page_source(self):
+        return self.site.render(self._tab["path"] or "")[2].decode(errors="replace")
+
+    def get(self, url):
+        tab = self._tab
+        tab["path"] = urlsplit(url).path if url.startswith(self.site.base_url) else None
+        tab["shown"] = min(FEED_PAGE_SIZE, len(self.site.posts)) if tab["path"] == PROFILE_PATH else 0
+        match = re.fullmatch(r"/p/(post\d+)", tab["path"] or "")
+        if match:
+            # The player's playlist request, as Chrome logs it
+            request_id = str(len(tab["log"]) + 1)
+            stream_url = f"{self.site.base_url}/stream/{match.group(1)}.m3u8?token={request_id}"
+            tab["log"] += [
+                _log_entry("Network.requestWillBeSent", requestId=request_id, request={"url": stream_url}),
+                _log_entry("Network.loadingFinished", requestId=request_id),
+            ]
+
+    def execute_script(self, script, *args):
+        tab = self._tab
+        if script.startswith("window.open("):
+            self.current_window_handle = self._open_tab()
+        elif script.startswith("window.scrollTo("):
+            tab["shown"] = min(tab["shown"] + FEED_PAGE_SIZE, len(self.site.posts))
+        elif "querySelectorAll(arguments[0]).length" in script:
+            return tab["shown"]
+        elif "video_srcs" in script:
+            # The feed extractor: (selector, debug, start)
+            start = args[2] if len(args) > 2 else 0
+            posts = [self._card(position) for position in range(start, tab["shown"])]
+            return {"total": tab["shown"], "posts": posts}
+        elif script.strip() == "return 1;":
+            return 1
+        return None
+
+    def _card(self, position):
+        post = self.site.posts[position]
+        return {
+            "position": position,
+            "href": f"/p/{post['id']}",
+            "is_video": post["video"],
+            "images": [{"srcset": f"/img/{post['id']}/300.jpg 300w, /img/{post['id']}/1080.jpg 1080w",
+                        "src": f"{self.site.base_url}/img/{post['id']}/300.jpg"}],
+            "video_srcs": [],
+        }
+
+    def find_elements(self, by, value):
+        path = self._tab["path"] or ""
+        if path == PROFILE_PATH and "post-feed-item/card" in value:
+            return [_Element() for _ in range(self._tab["shown"])]
+        if path.startswith("/p/") and value in ("video", "video, img"):
+            return [_Element()]
+        return []
+
+    def find_element(self, by, value):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(value)
+        return elements[0]
+
+    def get_log(self, log_type):
+        entries, self._tab["log"] = self._tab["log"], []
+        return entries
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {}
+
+    def _get_cdp_details(self):
+        return None, None
+
+    def close(self):
+        del self._tabs[self.current_window_handle]
+
+    def delete_all_cookies(self):
+        pass
+
+    def quit(self):
+        self._tabs.clear()
+
+def _log_entry(method, **params):
+    """A performance log entry in the format Chrome's logging preference produces"""
+    return {"message": json.dumps({"message": {"method": method, "params": params}})}
+
+# Run standalone to browse the fixture site
+if __name__ == "__main__":
+    site = FixtureSite()
+    site.start(port=int(os.environ.get("LTK_FIXTURE_PORT", "8090")))
+    print(f"Profile: {site.profile_url}")
+    threading.Event().wait()
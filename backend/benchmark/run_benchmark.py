@@ -0,0 +1,541 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import datetime
+import tempfile
+import threading
+import functools
+import statistics
+import subprocess
+import contextlib
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Make "backend" importable when run as a script
+current_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(os.path.dirname(current_dir))
+if repo_dir not in sys.path:
+    sys.path.append(repo_dir)
+
+try:
+    from backend.benchmark.fixture_site import FixtureDriver, FixtureSite
+except ImportError:
+    from fixture_site import FixtureDriver, FixtureSite
+
+# Process names of the browser and its driver
+CHROME_PROCESS_NAMES = ("chrome", "chromium", "chromedriver", "headless_shell")
+
+SAMPLE_INTERVAL = 0.2
+
+# Smoke mode: a small fixture, scraped with FixtureDriver instead of Chrome, and
+# waits shortened to match (the stand-in driver renders instantly)
+SMOKE_FIXTURE = {"posts": 30, "video_every": 4, "image_bytes": 40_000, "segments": 3,
+                 "segment_bytes": 60_000, "render_delay_ms": 0, "latency_ms": 0}
+# More than the fixture's first page of cards, so the feed has to be scrolled
+SMOKE_ITEMS = 14
+SMOKE_ENVIRONMENT = {"LTK_WAIT_SETTLE": "0.2", "LTK_NETWORK_IDLE": "0.5", "LTK_SCROLL_TIMEOUT": "1",
+                     "LTK_CDP_CAPTURE": "0", "LTK_MEDIA_CACHE": "1"}
+
+def load_pipeline():
+    """
+    Import the download pipeline
+
+    Done after the command line is parsed, because the pipeline modules read
+    their LTK_* settings when they are imported.
+
+    Returns:
+        dict: The modules, by short name
+    """
+    from backend.download_script import (
+        download_video_from_url, driver_pool, http_client, ltk_m3u8_downloader, ltk_network_capture, page_waits,
+        progress, resume
+    )
+    from backend.zip_stream import iter_zip, list_files
+    return {
+        "download_video_from_url": download_video_from_url,
+        "driver_pool": driver_pool,
+        "http_client": http_client,
+        "resume": resume,
+        "ltk_m3u8_downloader": ltk_m3u8_downloader,
+        "ltk_network_capture": ltk_network_capture,
+        "page_waits": page_waits,
+        "progress": progress,
+        "iter_zip": iter_zip,
+        "list_files": list_files,
+    }
+
+class StageTimer:
+    """
+    Time spent per pipeline stage
+
+    Module functions are wrapped in place, so every call made through the
+    module (from any thread) is counted. busy_s adds up the calls, and can
+    exceed the wall time when a stage runs on several workers; span_s runs
+    from the first call's start to the last call's end.
+    """
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.stages = {}
+        self._patched = []
+        self._lock = threading.Lock()
+
+    def wrap(self, module, name, stage):
+        original = getattr(module, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, start, time.monotonic())
+
+        setattr(module, name, timed)
+        self._patched.append((module, name, original))
+
+    def restore(self):
+        for module, name, original in reversed(self._patched):
+            setattr(module, name, original)
+        self._patched = []
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, start, time.monotonic())
+
+    def record(self, stage, start, end):
+        with self._lock:
+            stats = self.stages.setdefault(stage, {"calls": 0, "busy_s": 0.0, "first": start, "last": end})
+            stats["calls"] += 1
+            stats["busy_s"] += end - start
+            stats["first"] = min(stats["first"], start)
+            stats["last"] = max(stats["last"], end)
+
+    def report(self):
+        return {
+            stage: {
+                "calls": stats["calls"],
+                "busy_s": round(stats["busy_s"], 3),
+                "span_s": round(stats["last"] - stats["first"], 3),
+                "start_s": round(stats["first"] - self.origin, 3),
+            }
+            for stage, stats in self.stages.items()
+        }
+
+def _read_proc(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def _rss_bytes(pid):
+    for line in _read_proc(f"/proc/{pid}/status").splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+def _descendants(root_pid):
+    """Process ids below root_pid, from /proc (Linux only; empty elsewhere)"""
+    children = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        stat = _read_proc(f"/proc/{entry}/stat")
+        # The command name is in parentheses and may contain spaces
+        fields = stat[stat.rfind(")") + 2:].split()
+        if len(fields) > 1:
+            children.setdefault(int(fields[1]), []).append(int(entry))
+
+    found = []
+    pending = [root_pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+def write_bytes():
+    """Bytes this process has caused to be written to storage, or None if unknown"""
+    for line in _read_proc("/proc/self/io").splitlines():
+        if line.startswith("write_bytes:"):
+            return int(line.split()[1])
+    return None
+
+class ResourceMonitor:
+    """Sample this process's RSS and its Chrome processes in the background, keeping the peaks"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_chrome_processes = 0
+        self.peak_chrome_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="benchmark-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, _rss_bytes("self"))
+        chrome = [
+            pid for pid in _descendants(os.getpid())
+            if any(name in _read_proc(f"/proc/{pid}/comm").strip().lower() for name in CHROME_PROCESS_NAMES)
+        ]
+        self.peak_chrome_processes = max(self.peak_chrome_processes, len(chrome))
+        self.peak_chrome_rss = max(self.peak_chrome_rss, sum(_rss_bytes(pid) for pid in chrome))
+
+def fixture_pool(pipeline, site, size=None):
+    """A driver pool whose drivers are FixtureDrivers on site, for runs without Chrome"""
+    driver_pool = pipeline["driver_pool"]
+
+    class FixtureDriverPool(driver_pool.DriverPool):
+        def _launch(self):
+            return driver_pool.PooledDriver(FixtureDriver(site), None)
+
+    return FixtureDriverPool(size=size)
+
+def run_once(pipeline, site, max_items, keep_output=False, make_pool=None):
+    """
+    Run the whole pipeline once against the fixture site
+
+    A fresh driver pool is started for the run (its launch is the
+    browser_start stage), the profile is downloaded (feed, capture, hls,
+    http and range stages), and the result is zipped (zip stage).
+
+    Args:
+        make_pool (callable): Returns the driver pool to run with (default: a Chrome pool)
+
+    Returns:
+        dict: Metrics of the run
+    """
+    dv = pipeline["download_video_from_url"]
+    driver_pool = pipeline["driver_pool"]
+    output_dir = tempfile.mkdtemp(prefix="ltk_benchmark_")
+    zip_path = output_dir + ".zip"
+
+    origin = time.monotonic()
+    timer = StageTimer(origin)
+    timer.wrap(pipeline["page_waits"], "wait_for_stable_count", "feed")
+    timer.wrap(pipeline["page_waits"], "wait_for_count_above", "feed")
+    timer.wrap(dv, "extract_feed_posts", "feed")
+    timer.wrap(pipeline["ltk_network_capture"], "capture_video_urls_in_session", "capture")
+    timer.wrap(pipeline["ltk_m3u8_downloader"], "download_m3u8_to_mp4", "hls")
+    timer.wrap(dv, "download_file", "http")
+    timer.wrap(pipeline["http_client"], "download_segmented", "range")
+    timer.wrap(dv, "download_blob_url", "blob")
+
+    events = {}
+
+    def count_event(event_type, data):
+        events[event_type] = events.get(event_type, 0) + 1
+
+    monitor = ResourceMonitor()
+    requests_before, served_before = site.requests, site.bytes_served
+    written_before = write_bytes()
+    monitor.start()
+    try:
+        driver_pool.shutdown_pool()
+        pool = driver_pool.install_pool(make_pool()) if make_pool else driver_pool.get_pool()
+        with timer.stage("browser_start"):
+            pool.start(block=True)
+
+        with timer.stage("download"):
+            with pipeline["progress"].bind(count_event):
+                dv.download_video_from_url(site.profile_url, output_dir, max_items=max_items)
+
+        files = pipeline["list_files"](output_dir)
+        with timer.stage("zip"):
+            with open(zip_path, "wb") as f:
+                for chunk in pipeline["iter_zip"](files):
+                    f.write(chunk)
+        wall = time.monotonic() - origin
+    finally:
+        monitor.stop()
+        timer.restore()
+        driver_pool.shutdown_pool()
+
+    written_after = write_bytes()
+    result = {
+        "wall_s": round(wall, 3),
+        "stages": timer.report(),
+        "items_finished": events.get("item_finished", 0),
+        "items_failed": events.get("item_failed", 0),
+        "files": len(files),
+        "output_bytes": sum(os.path.getsize(path) for path, _ in files),
+        "zip_bytes": os.path.getsize(zip_path),
+        "disk_write_bytes": written_after - written_before if written_before is not None else None,
+        "peak_rss_bytes": monitor.peak_rss,
+        "peak_chrome_processes": monitor.peak_chrome_processes,
+        "peak_chrome_rss_bytes": monitor.peak_chrome_rss,
+        "origin_requests": site.requests - requests_before,
+        "origin_bytes": site.bytes_served - served_before,
+    }
+
+    if keep_output:
+        result["output_dir"] = output_dir
+        result["zip_path"] = zip_path
+    else:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.remove(zip_path)
+    return result
+
+def smoke_check(results, name, passed, detail):
+    results.append({"check": name, "passed": bool(passed), "detail": detail})
+    print(f"{'ok  ' if passed else 'FAIL'} {name}: {detail}")
+
+def rendition_bytes(site, video_id):
+    """The bytes a complete download of each of a fixture video's renditions has"""
+    renditions = []
+    for height in (1080, 480):
+        body = site.render(f"/stream/{video_id}/{height}/init.mp4")[2]
+        for i in range(site.segments):
+            body += site.render(f"/stream/{video_id}/{height}/{i}.m4s")[2]
+        renditions.append(body)
+    return renditions
+
+def check_output(results, name, pipeline, site, run, max_items):
+    """Check a pipeline run's files: one per post, videos matching a rendition, a valid zip"""
+    smoke_check(results, f"{name}: files", run["files"] == max_items and not run["items_failed"],
+                f"{run['files']} files for {max_items} posts, {run['items_failed']} failed")
+
+    # Video files are named by post index; feed positions start after the skipped cards
+    skipped = pipeline["download_video_from_url"].FEED_SKIP
+    found = 0
+    mismatched = []
+    for filename in sorted(os.listdir(run["output_dir"])):
+        match = re.fullmatch(r"video_(\d+)_\d+\.mp4", filename)
+        if not match:
+            continue
+        found += 1
+        with open(os.path.join(run["output_dir"], filename), "rb") as f:
+            data = f.read()
+        video_id = site.posts[int(match.group(1)) + skipped]["id"]
+        if data not in rendition_bytes(site, video_id):
+            mismatched.append(filename)
+    videos = sum(1 for post in site.posts[skipped:skipped + max_items] if post["video"])
+    smoke_check(results, f"{name}: hls", videos and found == videos and not mismatched,
+                f"{found} of {videos} videos saved, mismatched: {mismatched or 'none'}")
+
+    with zipfile.ZipFile(run["zip_path"]) as archive:
+        bad = archive.testzip()
+        entries = len(archive.infolist())
+    smoke_check(results, f"{name}: zip", bad is None and entries == run["files"], f"{entries} entries, bad entry: {bad}")
+
+def check_ranges(results, pipeline, site):
+    """Fetch a fixture image over parallel ranges, then resume a half-written one"""
+    http_client = pipeline["http_client"]
+    resume = pipeline["resume"]
+    work_dir = tempfile.mkdtemp(prefix="ltk_smoke_ranges_")
+    try:
+        path = "/img/post0000/1080.jpg"
+        expected = site.render(path)[2]
+        target = os.path.join(work_dir, "segmented.jpg")
+        http_client.download_segmented(site.base_url + path, target, connections=4, min_size=1)
+        with open(target, "rb") as f:
+            smoke_check(results, "range: segmented", f.read() == expected, f"{len(expected)} bytes over 4 ranges")
+
+        # A partial file left by an attempt that saw the same ETag resumes where it stopped
+        target = os.path.join(work_dir, "resumed.jpg")
+        half = len(expected) // 2
+        with open(resume.part_path(target), "wb") as f:
+            f.write(expected[:half])
+        resume.save_state(target, {"url": site.base_url + path, "etag": f'"{site.seed}-{len(expected)}"',
+                                   "last_modified": None})
+        served_before = site.bytes_served
+        http_client.download_to_file(site.base_url + path, target)
+        with open(target, "rb") as f:
+            resumed = f.read() == expected
+        served = site.bytes_served - served_before
+        smoke_check(results, "range: resume", resumed and served == len(expected) - half,
+                    f"{served} of {len(expected)} bytes fetched to finish the file")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def cleanup_run(run):
+    shutil.rmtree(run["output_dir"], ignore_errors=True)
+    os.remove(run["zip_path"])
+
+def smoke(args):
+    """
+    Check the pipeline end to end without Chrome (for CI)
+
+    FixtureDrivers stand in for the browser, so the scrape runs through the
+    real feed, capture, hls, http and zip code against the fixture site. The
+    profile is downloaded twice with the media cache on: the second download
+    must be answered from the profile manifest without reading the feed.
+    Parallel range and resumed downloads are checked on their own as well.
+
+    Returns:
+        dict: The report; its "passed" is False if any check failed
+    """
+    cache_dir = tempfile.mkdtemp(prefix="ltk_smoke_cache_")
+    os.environ.update(SMOKE_ENVIRONMENT)
+    os.environ["LTK_MEDIA_CACHE_DIR"] = cache_dir
+    pipeline = load_pipeline()
+    make_pool = lambda: fixture_pool(pipeline, site)
+
+    site = FixtureSite(**SMOKE_FIXTURE)
+    site.start()
+    results = []
+    runs = []
+    try:
+        runs.append(run_once(pipeline, site, SMOKE_ITEMS, keep_output=True, make_pool=make_pool))
+        check_output(results, "scrape", pipeline, site, runs[-1], SMOKE_ITEMS)
+        cleanup_run(runs[-1])
+
+        runs.append(run_once(pipeline, site, SMOKE_ITEMS, keep_output=True, make_pool=make_pool))
+        feed_calls = runs[-1]["stages"].get("feed", {}).get("calls", 0)
+        smoke_check(results, "manifest: feed skipped", feed_calls == 0, f"{feed_calls} feed reads")
+        check_output(results, "manifest", pipeline, site, runs[-1], SMOKE_ITEMS)
+        cleanup_run(runs[-1])
+
+        check_ranges(results, pipeline, site)
+    finally:
+        site.stop()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    passed = all(result["passed"] for result in results)
+    print(f"Smoke test {'passed' if passed else 'FAILED'}: {sum(r['passed'] for r in results)} of {len(results)} checks")
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "fixture": SMOKE_FIXTURE,
+        "passed": passed,
+        "checks": results,
+        "runs": runs,
+    }
+
+def flatten(result):
+    """Numeric metrics of a run as flat "name" / "stages.<stage>.<field>" keys"""
+    metrics = {key: value for key, value in result.items() if isinstance(value, (int, float))}
+    for stage, stats in result.get("stages", {}).items():
+        for field in ("busy_s", "span_s", "calls"):
+            metrics[f"stages.{stage}.{field}"] = stats[field]
+    return metrics
+
+def summarize(runs):
+    """Median, min and max of every metric across runs"""
+    values = {}
+    for run in runs:
+        for key, value in flatten(run).items():
+            values.setdefault(key, []).append(value)
+    return {
+        key: {"median": statistics.median(series), "min": min(series), "max": max(series)}
+        for key, series in sorted(values.items())
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline, current):
+    """Print the change of each summarized median from a baseline report"""
+    print(f"{'metric':<36}{'baseline':>16}{'current':>16}{'change':>10}")
+    for key, stats in current["summary"].items():
+        before = baseline.get("summary", {}).get(key, {}).get("median")
+        after = stats["median"]
+        if before is None:
+            continue
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+        print(f"{key:<36}{before:>16}{after:>16}{change:>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the download pipeline against a local fixture site")
+    parser.add_argument("--runs", type=int, default=3, help="Pipeline runs to measure")
+    parser.add_argument("--items", type=int, default=20, help="max_items requested from the profile")
+    parser.add_argument("--posts", type=int, default=36, help="Posts in the fixture feed")
+    parser.add_argument("--video-every", type=int, default=4, help="Every n-th post is a video (0 for none)")
+    parser.add_argument("--segments", type=int, default=10, help="HLS segments per video variant")
+    parser.add_argument("--segment-bytes", type=int, default=500_000, help="Size of the top variant's segments")
+    parser.add_argument("--image-bytes", type=int, default=250_000, help="Size of the full-width images")
+    parser.add_argument("--latency-ms", type=int, default=20, help="Delay added to every fixture response")
+    parser.add_argument("--use-cache", action="store_true", help="Keep the media cache on (it is disabled by default)")
+    parser.add_argument("--keep-output", action="store_true", help="Keep each run's files and zip")
+    parser.add_argument("--output", help="JSON report path (default: benchmark-<timestamp>.json)")
+    parser.add_argument("--compare", help="Earlier JSON report to compare the medians with")
+    parser.add_argument("--smoke", action="store_true",
+                        help="Check the pipeline end to end with stand-in drivers instead of Chrome, then exit")
+    args = parser.parse_args(argv)
+
+    if args.smoke:
+        report = smoke(args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        if not report["passed"]:
+            sys.exit(1)
+        return report
+
+    # Measure downloads, not cache hits
+    if not args.use_cache:
+        os.environ["LTK_MEDIA_CACHE"] = "0"
+    pipeline = load_pipeline()
+
+    site = FixtureSite(
+        posts=args.posts, video_every=args.video_every, image_bytes=args.image_bytes,
+        segments=args.segments, segment_bytes=args.segment_bytes, latency_ms=args.latency_ms
+    )
+    site.start()
+    runs = []
+    try:
+        for i in range(args.runs):
+            logger.info(f"Benchmark run {i + 1} of {args.runs}")
+            runs.append(run_once(pipeline, site, args.items, keep_output=args.keep_output))
+            logger.info(f"Run {i + 1}: {runs[-1]['wall_s']}s")
+    finally:
+        site.stop()
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "arguments": vars(args),
+        "environment": {key: value for key, value in os.environ.items() if key.startswith("LTK_")},
+        "fixture": {"posts": len(site.posts), "video_posts": site.video_posts},
+        "runs": runs,
+        "summary": summarize(runs),
+    }
+
+    output = args.output or f"benchmark-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return report
+
+# Run from the repository root: python -m backend.benchmark.run_benchmark --runs 3
+# (or with --smoke, which needs no browser, in CI)
+if __name__ == "__main__":
+    main()
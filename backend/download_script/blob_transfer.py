@@ -0,0 +1,131 @@
+import os
+import base64
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bytes of a blob read per WebDriver round trip (overridable through the environment).
+# WebDriver only carries JSON, so each chunk still crosses as base64, but only one
+# chunk at a time is ever held in the browser's string heap or in Python.
+CHUNK_SIZE = int(os.environ.get("LTK_BLOB_CHUNK_SIZE", str(4 * 1024 * 1024)))
+
+# Both scripts run through execute_async_script: WebDriver wraps them in a plain
+# (non-async) function and passes a callback as the last argument, which must be
+# called with the result. The async work happens in an inner async function.
+
+# Keeps the Blob behind a blob: URL reachable between calls, keyed by an id
+_OPEN_SCRIPT = """
+var blobUrl = arguments[0];
+var done = arguments[arguments.length - 1];
+(async function () {
+    const response = await fetch(blobUrl);
+    const blob = await response.blob();
+    window.__ltkBlobs = window.__ltkBlobs || {};
+    const id = Date.now().toString(36) + Math.random().toString(36).slice(2);
+    window.__ltkBlobs[id] = blob;
+    return {id: id, size: blob.size, type: blob.type};
+})().then(done, function (e) {
+    done({error: String(e && e.message || e)});
+});
+"""
+
+# Reads one slice; readAsDataURL does the base64 encoding natively
+_READ_SCRIPT = """
+var blob = window.__ltkBlobs && window.__ltkBlobs[arguments[0]];
+var start = arguments[1];
+var end = arguments[2];
+var done = arguments[arguments.length - 1];
+if (!blob) {
+    done({error: 'blob released'});
+} else {
+    var reader = new FileReader();
+    reader.onloadend = function () {
+        if (reader.error) {
+            done({error: String(reader.error)});
+            return;
+        }
+        var result = reader.result || '';
+        done({data: result.slice(result.indexOf(',') + 1)});
+    };
+    reader.readAsDataURL(blob.slice(start, end));
+}
+"""
+
+_RELEASE_SCRIPT = """
+if (window.__ltkBlobs) {
+    delete window.__ltkBlobs[arguments[0]];
+}
+"""
+
+# Playlist requests the page made, from its Resource Timing buffer
+_PLAYLIST_SCRIPT = """
+return performance.getEntriesByType('resource')
+    .map((entry) => entry.name)
+    .filter((name) => name.indexOf(arguments[0]) !== -1);
+"""
+
+class BlobUnavailable(Exception):
+    """The blob behind a blob: URL can't be read (revoked, or a MediaSource stream)"""
+
+def save_blob(driver, blob_url, path, chunk_size=None):
+    """
+    Copy the blob behind a blob: URL into a file, one slice at a time
+
+    The blob is fetched once in the page and then read in chunk_size slices,
+    each decoded and appended to path as soon as it arrives, so peak memory
+    is one chunk rather than a few copies of the whole video.
+
+    Args:
+        driver: Selenium WebDriver instance on the page that created the blob
+        blob_url (str): The blob: URL
+        path (str): File to write (truncated first)
+        chunk_size (int): Bytes per slice (default: LTK_BLOB_CHUNK_SIZE)
+
+    Returns:
+        int: Bytes written
+
+    Raises:
+        BlobUnavailable: If the page can't fetch or read the blob
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    opened = driver.execute_async_script(_OPEN_SCRIPT, blob_url) or {}
+    if "error" in opened or "id" not in opened:
+        # Object URLs of a MediaSource can't be fetched; their media came from a playlist
+        raise BlobUnavailable(opened.get("error", "no blob returned"))
+
+    blob_id = opened["id"]
+    size = opened["size"]
+    logger.info(f"Reading {size} bytes ({opened.get('type') or 'unknown type'}) from {blob_url}")
+    try:
+        with open(path, 'wb') as f:
+            for start in range(0, size, chunk_size):
+                end = min(start + chunk_size, size)
+                chunk = driver.execute_async_script(_READ_SCRIPT, blob_id, start, end) or {}
+                if "error" in chunk:
+                    raise BlobUnavailable(chunk["error"])
+                f.write(base64.b64decode(chunk["data"]))
+    finally:
+        try:
+            driver.execute_script(_RELEASE_SCRIPT, blob_id)
+        except Exception as e:
+            logger.debug(f"Error releasing blob {blob_id}: {str(e)}")
+    return size
+
+def media_source_urls(driver, marker=".m3u8"):
+    """
+    Playlist URLs behind the page's MediaSource players
+
+    A <video> fed through Media Source Extensions only exposes a blob: URL; the
+    stream it plays was loaded from playlists, which show up in the page's
+    resource timing entries.
+
+    Returns:
+        list: Matching request URLs in load order (the master playlist first)
+    """
+    urls = []
+    for url in driver.execute_script(_PLAYLIST_SCRIPT, marker) or []:
+        if url not in urls:
+            urls.append(url)
+    return urls
@@ -0,0 +1,192 @@
+import os
+import json
+import queue
+import logging
+import threading
+
+# trio and trio-websocket ship with selenium; without them capture falls back to the performance log
+try:
+    import trio
+    from trio_websocket import open_websocket_url
+    CDP_AVAILABLE = True
+except ImportError:
+    CDP_AVAILABLE = False
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set LTK_CDP_CAPTURE=0 to always read requests from the performance log instead
+CDP_CAPTURE_ENABLED = CDP_AVAILABLE and os.environ.get("LTK_CDP_CAPTURE", "1") != "0"
+
+# Chrome only records a performance log (an entry per network event, buffered
+# until read) when it is needed as the source of request URLs
+PERFORMANCE_LOG_ENABLED = not CDP_CAPTURE_ENABLED
+
+CONNECT_TIMEOUT = 5
+MAX_MESSAGE_SIZE = 2 ** 24
+STOP_POLL_INTERVAL = 0.1
+
+_ATTACH_ID = 1
+_ENABLE_ID = 2
+
+def browser_websocket_url(driver):
+    """
+    DevTools websocket URL of the browser behind a Chrome WebDriver session
+
+    Returns:
+        str: The URL, or None if the session doesn't expose one
+    """
+    ws_url = driver.caps.get("se:cdp")
+    if ws_url:
+        return ws_url
+    # Asks the local debuggerAddress, the same way WebDriver.bidi_connection() does
+    return driver._get_cdp_details()[1]
+
+class RequestCapture:
+    """
+    Stream the URLs of one tab's requests into a queue as they are sent
+
+    Opens a separate DevTools Protocol connection to the browser, attaches to
+    the WebDriver's current tab (window handles are DevTools target ids) and
+    enables the Network domain. Only Network.requestWillBeSent messages whose
+    raw text contains `marker` are JSON-decoded; every other event is dropped
+    unparsed.
+
+    Use as a context manager, or call start() and stop().
+    """
+
+    def __init__(self, driver, marker=".m3u8"):
+        self.driver = driver
+        self.marker = marker
+        self._urls = []
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._stopping = threading.Event()
+        self._error = None
+        self._thread = None
+
+    def start(self, timeout=CONNECT_TIMEOUT):
+        """
+        Attach to the current tab
+
+        Returns:
+            bool: True once requests are being captured, False if CDP is unavailable
+        """
+        if not CDP_AVAILABLE:
+            return False
+        try:
+            ws_url = browser_websocket_url(self.driver)
+            target_id = self.driver.current_window_handle
+        except Exception as e:
+            logger.warning(f"CDP capture unavailable: {str(e)}")
+            return False
+        if not ws_url:
+            return False
+
+        self._thread = threading.Thread(
+            target=self._run, args=(ws_url, target_id), name="cdp-capture", daemon=True
+        )
+        self._thread.start()
+
+        if not self._ready.wait(timeout) or self._error is not None:
+            logger.warning(f"CDP capture could not attach: {self._error or 'timed out'}")
+            self.stop()
+            return False
+        return True
+
+    def stop(self):
+        """Detach and close the connection"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(CONNECT_TIMEOUT)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def wait_for_url(self, timeout):
+        """
+        Wait for the next matching request
+
+        Returns:
+            str: Its URL, or None on timeout (or once the connection is gone)
+        """
+        try:
+            url = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if url is not None:
+            self._urls.append(url)
+        return url
+
+    def urls(self):
+        """All matching request URLs seen so far, in order"""
+        while True:
+            try:
+                url = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if url is not None:
+                self._urls.append(url)
+        return list(self._urls)
+
+    def _run(self, ws_url, target_id):
+        try:
+            trio.run(self._listen, ws_url, target_id)
+        except Exception as e:
+            self._error = e
+            if self._ready.is_set():
+                logger.warning(f"CDP capture stopped: {str(e)}")
+        finally:
+            # Unblock start() and any waiter if the connection failed or closed
+            self._ready.set()
+            self._queue.put(None)
+
+    async def _listen(self, ws_url, target_id):
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self._watch_stop, nursery.cancel_scope)
+            async with open_websocket_url(ws_url, max_message_size=MAX_MESSAGE_SIZE) as ws:
+                await ws.send_message(json.dumps({
+                    "id": _ATTACH_ID,
+                    "method": "Target.attachToTarget",
+                    "params": {"targetId": target_id, "flatten": True},
+                }))
+                await self._subscribe(ws)
+                self._ready.set()
+
+                while True:
+                    message = await ws.get_message()
+                    # Cheap text checks first: most traffic is other Network events
+                    if "Network.requestWillBeSent" not in message or self.marker not in message:
+                        continue
+                    data = json.loads(message)
+                    if data.get("method") != "Network.requestWillBeSent":
+                        continue
+                    url = data.get("params", {}).get("request", {}).get("url", "")
+                    if self.marker in url:
+                        self._queue.put(url)
+
+    async def _subscribe(self, ws):
+        """Finish attaching and enable Network events on the tab's session"""
+        while True:
+            data = json.loads(await ws.get_message())
+            if "error" in data:
+                raise RuntimeError(data["error"].get("message", "DevTools error"))
+            if data.get("id") == _ATTACH_ID:
+                await ws.send_message(json.dumps({
+                    "id": _ENABLE_ID,
+                    "sessionId": data["result"]["sessionId"],
+                    "method": "Network.enable",
+                    "params": {},
+                }))
+            elif data.get("id") == _ENABLE_ID:
+                return
+
+    async def _watch_stop(self, cancel_scope):
+        while not self._stopping.is_set():
+            await trio.sleep(STOP_POLL_INTERVAL)
+        cancel_scope.cancel()
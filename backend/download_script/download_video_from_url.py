@@ -1,17 +1,13 @@
-import requests
 import os
 import time
 import re
-import base64
 import subprocess
 import sys
-import tempfile
-import shutil
 import logging
-from selenium import webdriver
+import contextvars
+import httpx
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
@@ -19,6 +15,30 @@ from selenium.webdriver.support import expected_conditions as EC
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Import the shared Chrome driver pool, HTTP client and media cache
+try:
+    from . import blob_transfer
+    from . import driver_pool
+    from . import hls_downloader
+    from . import http_client
+    from . import media_cache
+    from . import metrics
+    from . import page_waits
+    from . import progress
+    from . import resource_blocking
+    from . import resume
+except ImportError:
+    import blob_transfer
+    import driver_pool
+    import hls_downloader
+    import http_client
+    import media_cache
+    import metrics
+    import page_waits
+    import progress
+    import resource_blocking
+    import resume
+
 # Import the other modules
 try:
     from . import ltk_network_capture
@@ -29,7 +49,36 @@ except ImportError:
     print("Warning: ltk_network_capture.py or ltk_m3u8_downloader.py not found in the current directory.")
     print("Video downloading will be limited to direct downloads only.")
 
-def download_video_from_url(video_url, output_dir="downloaded_videos", max_items=10, is_direct_post=False):
+FEED_CARD_SELECTOR = "[data-test-id='post-feed-item/card']"
+
+# The first cards of a profile feed are skipped
+FEED_SKIP = 2
+
+# Infinite scroll: how long to wait for new cards after scrolling, and how many
+# scrolls in a row may bring nothing new before the feed counts as exhausted
+SCROLL_TIMEOUT = float(os.environ.get("LTK_SCROLL_TIMEOUT", "5"))
+SCROLL_MAX_IDLE = int(os.environ.get("LTK_SCROLL_MAX_IDLE", "2"))
+
+# Set LTK_DEBUG_POSTS=1 to dump each feed card's markup, buttons and play elements
+DEBUG_POSTS = os.environ.get("LTK_DEBUG_POSTS", "0") == "1"
+
+# Posts of a feed are downloaded concurrently: image posts only need HTTP, while each
+# video post holds a Chrome driver from the pool, so video concurrency is capped by its size
+IMAGE_WORKERS = int(os.environ.get("LTK_IMAGE_WORKERS", "8"))
+VIDEO_WORKERS = int(os.environ.get("LTK_VIDEO_WORKERS", "2"))
+
+# Profile manifests (the posts last scraped from a feed, kept in the media cache):
+# younger than PROFILE_FRESH seconds they are served without opening the feed at all;
+# otherwise the feed is only scrolled until PROFILE_OVERLAP posts in a row match
+# the manifest. Posts first seen more than PROFILE_MAX_AGE seconds ago are dropped.
+PROFILE_FRESH = float(os.environ.get("LTK_PROFILE_FRESH", "600"))
+PROFILE_OVERLAP = int(os.environ.get("LTK_PROFILE_OVERLAP", "3"))
+PROFILE_MAX_AGE = float(os.environ.get("LTK_PROFILE_MAX_AGE", str(7 * 24 * 3600)))
+
+# What a manifest keeps of each post: enough to process it again without its card
+MANIFEST_FIELDS = ("key", "href", "is_video", "images", "video_srcs", "seen_at")
+
+def download_video_from_url(video_url, output_dir="downloaded_videos", max_items=10, is_direct_post=False, cancel_event=None):
     """
     Script to download a video from a page containing a video tag,
     including support for blob URLs
@@ -39,204 +88,556 @@ def download_video_from_url(video_url, output_dir="downloaded_videos", max_items
         output_dir (str): Directory to save videos
         max_items (int): Maximum number of items to download (default: 10)
         is_direct_post (bool): Whether the URL is a direct post URL (default: False)
+        cancel_event (threading.Event): Stops the download between posts once set (default: None)
     """
     # Create output directory
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    # Create a unique temporary directory for Chrome user data
-    temp_dir = tempfile.mkdtemp(prefix="chrome_user_data_")
-    logger.info(f"Created temporary user data directory: {temp_dir}")
-    
-    # Make sure the directory has the right permissions
-    os.chmod(temp_dir, 0o755)
-    
-    # Setup Chrome
-    chrome_options = Options()
-    # Uncomment to run in background
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument(f"--remote-debugging-port={9222 + os.getpid() % 1000}")  # Use a dynamic port
-    chrome_options.add_argument(f"--user-data-dir={temp_dir}")
-    chrome_options.add_argument("--disable-extensions")
-    chrome_options.add_argument("--disable-plugins")
-    chrome_options.add_argument("--incognito")
-    # Add additional stability options
-    chrome_options.add_argument("--disable-web-security")
-    chrome_options.add_argument("--disable-features=IsolateOrigins,site-per-process")
-    chrome_options.add_argument("--disable-site-isolation-trials")
-    chrome_options.add_argument("--disable-application-cache")
-    
     # Track successful downloads
     successful_downloads = 0
     max_retries = 3
     retry_count = 0
+    # Posts whose files are all on disk from an earlier attempt are skipped, and
+    # posts retried keep their index so their partial files are resumed
+    item_log = resume.ItemLog(output_dir)
+    # Keys (href, or position for cards without a link) of posts already handed to workers
+    processed_posts = item_log.completed()
+    if processed_posts:
+        print(f"{len(processed_posts)} items already downloaded to {output_dir}")
+    # Keys of posts whose download failed in this pass; they are taken out of
+    # processed_posts afterwards, so the next pass collects them again
+    failed_posts = set()
     
-    while successful_downloads < max_items and retry_count < max_retries:
+    # Chrome drivers are borrowed from the shared warm pool instead of being launched per call
+    pool = driver_pool.get_pool()
+    
+    # Posts scraped from this feed by earlier downloads
+    cached_posts, cached_at = ([], None) if is_direct_post else load_profile_manifest(video_url)
+    
+    while len(processed_posts) < max_items and retry_count < max_retries:
+        if is_cancelled(cancel_event):
+            print("Download cancelled")
+            break
+        
         driver = None
+        driver_failed = False
         
         try:
-            # Check if chromedriver is in PATH
-            chrome_path = os.environ.get('CHROME_PATH', None)
-            chromedriver_path = os.environ.get('CHROMEDRIVER_PATH', None)
-            
-            if chrome_path:
-                logger.info(f"Using Chrome binary from: {chrome_path}")
-                chrome_options.binary_location = chrome_path
+            # A fresh manifest with enough posts answers the request without opening the feed
+            unseen = [post for post in cached_posts if post["key"] not in processed_posts]
+            if cached_at and time.time() - cached_at < PROFILE_FRESH and len(unseen) >= max_items - len(processed_posts):
+                print(f"Serving {max_items - len(processed_posts)} posts from the profile manifest cached {time.time() - cached_at:.0f}s ago")
+                serving = unseen[:max_items - len(processed_posts)]
+                processed_posts.update(post["key"] for post in serving)
+                # Every post is known up front, so the total is reported at once
+                progress.emit("posts_discovered", count=len(processed_posts))
+                
+                image_count, video_count, succeeded = process_posts(
+                    assign_indexes(iter(serving), item_log), output_dir, video_url, pool, cancel_event, item_log,
+                    failed=failed_posts
+                )
+                successful_downloads += succeeded
+                print(f"Processing complete. Found {image_count} images and {video_count} videos.")
+                if not failed_posts:
+                    break
+                retry_count += 1
+                print(f"{len(failed_posts)} posts failed, retrying them... (Attempt {retry_count} of {max_retries})")
+                continue
             
-            if chromedriver_path:
-                logger.info(f"Using ChromeDriver from: {chromedriver_path}")
-                service = Service(executable_path=chromedriver_path)
-                driver = webdriver.Chrome(service=service, options=chrome_options)
-                logger.info("Chrome driver initialized with explicit service path")
-            else:
-                driver = webdriver.Chrome(options=chrome_options)
-                logger.info("Chrome driver initialized successfully")
+            # Other tasks may hold every driver for a while; wait as long as this job may
+            driver = pool.acquire(cancel_event=cancel_event)
             
             # Navigate to the video page
             print(f"Opening URL: {video_url}")
-            driver.get(video_url)
+            with metrics.span("page_load", url=video_url):
+                driver.get(video_url)
+                
+                # Wait (at most 5 seconds) for the media to render: the feed cards to
+                # stop multiplying, or the post's video/images to appear
+                page_waits.wait_for_stable_count(driver, "video, img" if is_direct_post else FEED_CARD_SELECTOR, 5)
             
-            # Wait for page to load
-            time.sleep(5)
+            # Record what the page cost to load under the resource blocking profile (debugging only)
+            if resource_blocking.MEASURE_PAGES:
+                try:
+                    logger.info(f"Page load ({resource_blocking.PROFILE} profile): {resource_blocking.measure_page(driver)}")
+                except Exception as e:
+                    logger.warning(f"Error measuring page load: {str(e)}")
             
             # If this is a direct post URL, handle it differently
             if is_direct_post:
                 print("Processing as direct post URL")
-                process_direct_post(driver, output_dir, video_url)
+                progress.emit("posts_discovered", count=1)
+                with progress.item("post", 0, url=video_url):
+                    process_direct_post(driver, output_dir, video_url)
                 successful_downloads += 1
                 break  # Exit the retry loop after processing the direct post
             
-            # Process each post/item on the page
-            post_items = driver.find_elements(By.CSS_SELECTOR, "[data-test-id='post-feed-item/card']")
-            print(f"Found {len(post_items)} post items on the page")
-            
-            # Skip the first 2 items as requested
-            if len(post_items) > 2:
-                print("Skipping the first 2 media items as requested")
-                post_items = post_items[2:]
-                print(f"Processing {len(post_items)} remaining items")
-            else:
-                print("Warning: Less than 3 items found, processing all available items")
-            
-            # Limit the number of items to process based on max_items
-            remaining_items = max_items - successful_downloads
-            if len(post_items) > remaining_items:
-                print(f"Limiting to {remaining_items} items as requested")
-                post_items = post_items[:remaining_items]
-                print(f"Processing {len(post_items)} items")
+            # Stream posts to the workers as the feed loads, scrolling for more until
+            # max_items unique posts have been collected (across retries too), or
+            # until the feed reaches posts the manifest already lists
+            remaining_items = max_items - len(processed_posts)
+            listed = []
             
-            image_count = 0
-            video_count = 0
+            def collect_posts():
+                nonlocal driver
+                collected = 0
+                with metrics.span("post_discovery", url=video_url):
+                    for post in iter_profile_posts(driver, video_url, processed_posts, cached_posts, remaining_items):
+                        collected += 1
+                        listed.append(post)
+                        progress.emit("posts_discovered", count=len(processed_posts))
+                        yield post
+                        if collected >= remaining_items:
+                            print(f"Collected the {max_items} requested items")
+                            break
+                        if is_cancelled(cancel_event):
+                            break
+                
+                # Hand the feed driver back so the video workers can lease it
+                pool.release(driver)
+                driver = None
             
-            for i, post in enumerate(post_items):
-                try:
-                    print(f"\n{'='*50}")
-                    print(f"DEBUGGING POST #{i+3}")  # +3 because we skipped 2
-                    print(f"{'='*50}")
-                    
-                    # Debug: Print the HTML structure of the post
-                    post_html = post.get_attribute('outerHTML')
-                    print(f"Post HTML snippet (first 200 chars): {post_html[:200]}...")
-                    
-                    # Debug: Check for all buttons in the post
-                    all_buttons = post.find_elements(By.TAG_NAME, "button")
-                    print(f"Found {len(all_buttons)} buttons in post")
-                    for j, btn in enumerate(all_buttons):
-                        btn_class = btn.get_attribute("class")
-                        print(f"  Button #{j+1} class: {btn_class}")
-                    
-                    # Debug: Check for elements with 'play' in their class or id
-                    play_elements = post.find_elements(By.CSS_SELECTOR, "[class*='play'], [id*='play']")
-                    print(f"Found {len(play_elements)} elements with 'play' in class/id")
-                    for j, elem in enumerate(play_elements):
-                        elem_tag = elem.tag_name
-                        elem_class = elem.get_attribute("class")
-                        print(f"  Play element #{j+1}: Tag={elem_tag}, Class={elem_class}")
-                    
-                    # More specific check for play buttons
-                    play_button = post.find_elements(By.CSS_SELECTOR, "button.play-icon, button.v-btn--fab i.capsule-consumer-play-outline-16")
-                    
-                    if play_button:
-                        print(f"Post #{i+3}: Found specific play button. Processing as video.")
-                        video_count += 1
-                        process_video_post(driver, post, output_dir, video_url, i)
-                        successful_downloads += 1
-                    else:
-                        print(f"Post #{i+3}: No play button found. Processing as image.")
-                        image_count += 1
-                        process_image_post(driver, post, output_dir, video_url, i)
-                        successful_downloads += 1
-                except Exception as e:
-                    print(f"Error processing post #{i+3}: {e}")
-                    # Continue with the next post instead of breaking the entire loop
-                    continue
+            image_count, video_count, succeeded = process_posts(
+                assign_indexes(collect_posts(), item_log), output_dir, video_url, pool, cancel_event, item_log,
+                failed=failed_posts
+            )
+            cached_posts = store_profile_manifest(video_url, listed, cached_posts)
+            successful_downloads += succeeded
             
             print(f"Processing complete. Found {image_count} images and {video_count} videos.")
             print(f"Successfully downloaded {successful_downloads} items out of requested {max_items}.")
             
-            # If we've downloaded enough items, break out of the retry loop
-            if successful_downloads >= max_items:
+            # The feed was read to its end (or to max_items); only errors warrant another pass
+            if not failed_posts:
                 break
+            retry_count += 1
+            print(f"{len(failed_posts)} posts failed, retrying them... (Attempt {retry_count} of {max_retries})")
                 
         except Exception as e:
             print(f"Error: {e}")
             logger.error(f"Error in download_video_from_url: {str(e)}")
+            # Don't hand a possibly crashed browser back to the pool
+            driver_failed = True
             retry_count += 1
             print(f"Retrying... (Attempt {retry_count} of {max_retries})")
             time.sleep(2)  # Wait before retrying
         finally:
-            # Clean up the driver
+            # Return the driver to the pool
             if driver:
-                try:
-                    driver.quit()
-                    logger.info("Chrome driver closed successfully")
-                except Exception as e:
-                    print(f"Error closing driver: {e}")
-                    logger.error(f"Error closing driver: {str(e)}")
+                pool.release(driver, discard=driver_failed)
+            processed_posts -= failed_posts
+            failed_posts.clear()
+
+def assign_indexes(posts, item_log):
+    """
+    Give each post its index (and so its file names), reusing the one an earlier
+    attempt recorded in the item log, and describe it once it has one
+    """
+    next_index = item_log.next_index()
+    for post in posts:
+        post["index"] = item_log.index_for(post["key"])
+        if post["index"] is None:
+            post["index"] = next_index
+            next_index += 1
+            item_log.assign(post["key"], post["index"])
+        describe_post(post)
+        yield post
+
+def load_profile_manifest(profile_url):
+    """
+    Posts recorded for a profile's feed by earlier downloads
+
+    Returns:
+        tuple: (post dicts in feed order, time the manifest was stored or None)
+    """
+    cache = media_cache.get_cache()
+    if not cache:
+        return [], None
+    try:
+        posts, updated_at = cache.load_profile(media_cache.media_key("profile", profile_url))
+    except Exception as e:
+        logger.warning(f"Error reading profile manifest: {str(e)}")
+        return [], None
     
-    # Clean up the temporary user data directory
-    if 'temp_dir' in locals() and temp_dir and os.path.exists(temp_dir):
+    oldest = time.time() - PROFILE_MAX_AGE
+    posts = [post for post in posts if post.get("seen_at", 0) >= oldest]
+    if posts:
+        print(f"Profile manifest lists {len(posts)} posts")
+    return posts, updated_at if posts else None
+
+def store_profile_manifest(profile_url, listed, cached_posts):
+    """
+    Record the posts of a feed after a download
+
+    The posts listed this time come first, in the order they were listed. When
+    they overlap the previous manifest, its other posts follow them (in their
+    old order), so the manifest keeps covering the feed beyond what was needed.
+
+    Returns:
+        list: The new manifest's posts
+    """
+    now = time.time()
+    posts = []
+    for post in listed:
+        # Cards without a link are only known by their position, which shifts as the feed grows
+        if not post.get("href"):
+            continue
+        entry = {field: post[field] for field in MANIFEST_FIELDS if field in post}
+        entry.setdefault("seen_at", now)
+        posts.append(entry)
+    
+    keys = {post["key"] for post in posts}
+    if any(post["key"] in keys for post in cached_posts):
+        posts += [post for post in cached_posts if post["key"] not in keys]
+    
+    cache = media_cache.get_cache()
+    if cache and posts:
         try:
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            logger.info(f"Removed temporary user data directory: {temp_dir}")
+            cache.store_profile(media_cache.media_key("profile", profile_url), posts)
         except Exception as e:
-            logger.error(f"Error removing temporary directory {temp_dir}: {str(e)}")
+            logger.warning(f"Error storing profile manifest: {str(e)}")
+    return posts
 
-def process_video_post(driver, post_element, output_dir, referer_url, index):
-    """Process and download video content from a post"""
-    try:
-        # First try to get the post URL to navigate to the individual post page
-        post_url = post_element.get_attribute("href")
-        if post_url and not post_url.startswith("http"):
-            # Handle relative URLs
-            base_url = "/".join(referer_url.split("/")[:3])  # Get domain part
-            post_url = base_url + post_url
+def is_cancelled(cancel_event):
+    """Check whether the scheduler asked this download to stop"""
+    return cancel_event is not None and cancel_event.is_set()
+
+# Reads every feed card in one execute_script call. The selectors match the
+# ones the per-element lookups used: play buttons mark video posts, and images
+# come from the LTK image wrapper (falling back to any img in the card).
+_FEED_EXTRACTOR_SCRIPT = """
+var selector = arguments[0];
+var debug = arguments[1];
+var start = arguments[2];
+var cards = document.querySelectorAll(selector);
+var posts = [];
+for (var i = start; i < cards.length; i++) {
+    var card = cards[i];
+    var images = card.querySelectorAll('.ltk-img img, img.c-image');
+    if (images.length === 0) {
+        images = card.querySelectorAll('img');
+    }
+    var imageData = [];
+    for (var j = 0; j < images.length; j++) {
+        imageData.push({srcset: images[j].getAttribute('srcset'), src: images[j].src || null});
+    }
+    var videoSrcs = [];
+    var videos = card.querySelectorAll('video');
+    for (var j = 0; j < videos.length; j++) {
+        if (videos[j].src) {
+            videoSrcs.push(videos[j].src);
+        }
+        var sources = videos[j].querySelectorAll('source');
+        for (var k = 0; k < sources.length; k++) {
+            if (sources[k].src) {
+                videoSrcs.push(sources[k].src);
+            }
+        }
+    }
+    var post = {
+        position: i,
+        href: card.href || card.getAttribute('href'),
+        is_video: card.querySelector('button.play-icon, button.v-btn--fab i.capsule-consumer-play-outline-16') !== null,
+        images: imageData,
+        video_srcs: videoSrcs
+    };
+    if (debug) {
+        var buttons = card.querySelectorAll('button');
+        var playElements = card.querySelectorAll("[class*='play'], [id*='play']");
+        post.debug = {
+            html: card.outerHTML.substring(0, 200),
+            button_classes: Array.prototype.map.call(buttons, function (b) { return b.className; }),
+            play_elements: Array.prototype.map.call(playElements, function (e) {
+                return {tag: e.tagName.toLowerCase(), cls: typeof e.className === 'string' ? e.className : ''};
+            })
+        };
+    }
+    posts.push(post);
+}
+return {total: cards.length, posts: posts};
+"""
+
+def extract_feed_posts(driver, referer_url, start=0):
+    """
+    Read what's needed to download the posts of a feed page in one browser call
+
+    Args:
+        driver: Selenium WebDriver instance on the feed page
+        referer_url (str): URL of the feed page
+        start (int): Position of the first card to read (default: 0)
+
+    Returns:
+        tuple: (total number of cards on the page, list of posts). Each post is a
+        dict with position, href (absolute), is_video, images (srcset/src pairs)
+        and video_srcs, plus debug details when DEBUG_POSTS is set
+    """
+    result = driver.execute_script(_FEED_EXTRACTOR_SCRIPT, FEED_CARD_SELECTOR, DEBUG_POSTS, start) or {}
+    posts = result.get("posts", [])
+    base_url = "/".join(referer_url.split("/")[:3])  # Get domain part
+    for post in posts:
+        # Handle relative URLs
+        if post["href"] and not post["href"].startswith("http"):
+            post["href"] = base_url + post["href"]
+    return result.get("total", 0), posts
+
+def iter_feed_posts(driver, referer_url, seen_keys, skip=FEED_SKIP):
+    """
+    Yield the posts of a feed as they load, scrolling down for more
+
+    The first `skip` cards are left out (unless the feed has no more than that),
+    and a post whose key (its href, or its position when it has no link) is in
+    seen_keys is never yielded; yielded keys are added to it. Iteration ends
+    once SCROLL_MAX_IDLE scrolls in a row brought no new posts, or when the
+    caller stops consuming.
+
+    Args:
+        driver: Selenium WebDriver instance on the feed page
+        referer_url (str): URL of the feed page
+        seen_keys (set): Keys of posts already collected
+        skip (int): Number of leading cards to skip
+
+    Yields:
+        dict: Posts as returned by extract_feed_posts, with their "key" added
+    """
+    read = 0
+    idle_rounds = 0
+    first_round = True
+
+    while True:
+        total, posts = extract_feed_posts(driver, referer_url, start=read)
+        if first_round:
+            print(f"Found {total} post items on the page")
+            if total > skip:
+                print(f"Skipping the first {skip} media items as requested")
+            else:
+                print(f"Warning: Less than {skip + 1} items found, processing all available items")
+                skip = 0
+            first_round = False
+
+        new_posts = 0
+        for post in posts:
+            if post["position"] < skip:
+                continue
+            key = post["href"] or f"#{post['position']}"
+            if key in seen_keys:
+                continue
+            seen_keys.add(key)
+            post["key"] = key
+            new_posts += 1
+            yield post
+        read = max(read, total)
+
+        idle_rounds = 0 if new_posts else idle_rounds + 1
+        if idle_rounds > SCROLL_MAX_IDLE:
+            print(f"Reached the end of the feed after {total} items")
+            return
+
+        # Scroll to the bottom and wait (at most SCROLL_TIMEOUT) for the feed to append cards
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        count = page_waits.wait_for_count_above(driver, FEED_CARD_SELECTOR, read, SCROLL_TIMEOUT)
+        if count < read:
+            # The feed recycles its cards (virtualized list): read them all again, seen_keys dedupes
+            read = 0
+
+def iter_profile_posts(driver, referer_url, seen_keys, cached_posts, wanted):
+    """
+    Yield a feed's posts, scrolling only as far as the posts not yet in the manifest
+
+    Feeds list the newest posts first, so once PROFILE_OVERLAP posts in a row
+    (or the whole manifest, if it is shorter) match the manifest, the posts
+    after them are the ones the manifest lists next, and those are yielded
+    from it instead of being scraped. If the manifest can't supply `wanted`
+    posts that way, the feed is scrolled as usual.
+
+    Args:
+        driver: Selenium WebDriver instance on the feed page
+        referer_url (str): URL of the feed page
+        seen_keys (set): Keys of posts already collected; yielded keys are added
+        cached_posts (list): Manifest posts in feed order
+        wanted (int): Number of posts the caller will take
+
+    Yields:
+        dict: Scraped posts as yielded by iter_feed_posts, then manifest posts
+    """
+    positions = {post["key"]: i for i, post in enumerate(cached_posts)}
+    overlap_needed = min(PROFILE_OVERLAP, len(cached_posts))
+    overlap = 0
+    yielded = 0
+    
+    for post in iter_feed_posts(driver, referer_url, seen_keys):
+        yield post
+        yielded += 1
+        if not overlap_needed:
+            continue
+        
+        position = positions.get(post["key"])
+        overlap = overlap + 1 if position is not None else 0
+        if overlap < overlap_needed:
+            continue
+        
+        rest = [cached for cached in cached_posts[position + 1:] if cached["key"] not in seen_keys]
+        if yielded + len(rest) < wanted:
+            # Not enough left in the manifest: keep scrolling
+            overlap_needed = 0
+            continue
         
+        print(f"Reached posts already in the profile manifest; taking the next {wanted - yielded} from it")
+        for cached in rest:
+            seen_keys.add(cached["key"])
+            yield dict(cached)
+        return
+
+def describe_post(post):
+    """Print how a post will be processed (and its markup when DEBUG_POSTS is set)"""
+    index = post["index"]
+    debug = post.get("debug")
+    if debug:
+        print(f"\n{'='*50}")
+        print(f"DEBUGGING POST #{index+3}")  # +3 because we skipped 2
+        print(f"{'='*50}")
+        print(f"Post HTML snippet (first 200 chars): {debug['html']}...")
+        print(f"Found {len(debug['button_classes'])} buttons in post")
+        for j, btn_class in enumerate(debug['button_classes']):
+            print(f"  Button #{j+1} class: {btn_class}")
+        print(f"Found {len(debug['play_elements'])} elements with 'play' in class/id")
+        for j, elem in enumerate(debug['play_elements']):
+            print(f"  Play element #{j+1}: Tag={elem['tag']}, Class={elem['cls']}")
+
+    if post["is_video"]:
+        print(f"Post #{index+3}: Found specific play button. Processing as video.")
+    else:
+        print(f"Post #{index+3}: No play button found. Processing as image.")
+
+def process_posts(posts, output_dir, referer_url, pool, cancel_event=None, item_log=None, failed=None):
+    """
+    Download feed posts concurrently, starting each as soon as it is discovered
+
+    Image posts run on a thread pool of IMAGE_WORKERS. Each video post leases
+    its own driver, so at most min(VIDEO_WORKERS, pool size) of them run at once,
+    and fewer while the pool's drivers are busy (this task's feed driver, other
+    tasks' posts): workers beyond the free drivers wait for one, for as long as
+    the job may run, rather than giving up on their post after a fixed timeout.
+
+    Args:
+        posts (iterable): Post dicts from extract_feed_posts; may be a generator
+            that is still discovering posts
+        output_dir (str): Directory to save media
+        referer_url (str): URL of the feed page
+        pool (DriverPool): Pool to lease drivers for video posts from
+        cancel_event (threading.Event): Stops posts that haven't started yet (default: None)
+        item_log (resume.ItemLog): Records the files of each finished post (default: None)
+        failed (set): Receives the keys of the posts that raised, also when
+            discovering posts fails half-way (default: None)
+
+    Returns:
+        tuple: (image post count, video post count, number of posts processed without error)
+    """
+    image_count = 0
+    video_count = 0
+    successful = 0
+    with ThreadPoolExecutor(max_workers=max(1, IMAGE_WORKERS), thread_name_prefix="ltk-image") as image_executor, \
+            ThreadPoolExecutor(max_workers=max(1, min(VIDEO_WORKERS, pool.size)), thread_name_prefix="ltk-video") as video_executor:
+        futures = {}
+        try:
+            for post in posts:
+                if post["is_video"]:
+                    video_count += 1
+                    executor = video_executor
+                else:
+                    image_count += 1
+                    executor = image_executor
+                # Each task runs in its own copy of the context so progress events reach this task's reporter
+                future = executor.submit(contextvars.copy_context().run, process_post, post, output_dir, referer_url, pool, cancel_event, item_log)
+                futures[future] = post
+        finally:
+            # Posts already started finish (and are accounted for) even if discovery failed
+            for future in as_completed(futures):
+                post = futures[future]
+                try:
+                    if future.result():
+                        successful += 1
+                except Exception as e:
+                    # Continue with the other posts instead of failing the whole download
+                    print(f"Error processing post #{post['index']+3}: {e}")
+                    if failed is not None:
+                        failed.add(post["key"])
+
+    return image_count, video_count, successful
+
+def process_post(post, output_dir, referer_url, pool, cancel_event=None, item_log=None):
+    """
+    Download one post on a worker thread
+
+    Returns:
+        bool: False if the download was cancelled before the post started
+    """
+    if is_cancelled(cancel_event):
+        return False
+
+    index = post["index"]
+    if post["is_video"]:
+        with progress.item("video", index + 3) as stats, metrics.span("video_post"):
+            with pool.lease(cancel_event=cancel_event) as driver:
+                process_video_post(driver, post, output_dir, referer_url, index)
+    else:
+        with progress.item("image", index + 3) as stats, metrics.span("image_fetch"):
+            process_image_post(post, output_dir, referer_url, index)
+    if item_log is not None and stats["paths"]:
+        item_log.record(post["key"], stats["paths"])
+    return True
+
+def process_video_post(driver, post, output_dir, referer_url, index):
+    """Process and download video content from a post (a dict from extract_feed_posts)"""
+    try:
+        # First try to navigate to the individual post page
+        post_url = post["href"]
+
         if post_url:
+            # Reuse the videos of a post we've already downloaded for another task
+            # (at the same rendition policy)
+            cache = media_cache.get_cache()
+            post_key = media_cache.media_key("post", post_url) + hls_downloader.policy_key()
+            if cache:
+                cached_files = cache.materialize_manifest(
+                    post_key,
+                    lambda n: [os.path.join(output_dir, f"video_{index}_{i}.mp4") for i in range(n)]
+                )
+                if cached_files:
+                    print(f"Served {len(cached_files)} videos for {post_url} from media cache")
+                    for cached_file in cached_files:
+                        progress.file_saved(cached_file)
+                    return
+            
             print(f"Navigating to individual post: {post_url}")
             
-            # If we have the ltk_network_capture module, use it to get the M3U8 URL
+            # Capture the M3U8 URL inside this driver session: the post is opened in a
+            # new tab and its performance log is read, so no second Chrome is launched
             if MODULES_IMPORTED:
                 try:
-                    print("Using ltk_network_capture to get M3U8 URL...")
-                    m3u8_urls = ltk_network_capture.capture_video_urls(post_url)
+                    print("Using ltk_network_capture to get M3U8 URL from the current session...")
+                    m3u8_urls = ltk_network_capture.capture_video_urls_in_session(driver, post_url)
                     
                     if m3u8_urls:
                         print(f"Found {len(m3u8_urls)} M3U8 URLs")
+                        output_files = []
                         for i, m3u8_url in enumerate(m3u8_urls):
                             print(f"Processing M3U8 URL #{i+1}: {m3u8_url}")
                             output_file = os.path.join(output_dir, f"video_{index}_{i}.mp4")
                             
                             # Use ltk_m3u8_downloader to download the video
                             print(f"Downloading video using ltk_m3u8_downloader...")
-                            ltk_m3u8_downloader.download_m3u8_to_mp4(m3u8_url, output_file)
+                            if ltk_m3u8_downloader.download_m3u8_to_mp4(m3u8_url, output_file):
+                                output_files.append(output_file)
                             print(f"Video saved to {output_file}")
                         
-                        # Return early since we've handled the video download
+                        # Remember which videos this post produced
+                        if cache and len(output_files) == len(m3u8_urls):
+                            cache.store_manifest(post_key, output_files)
+                        
+                        # Close the post tab and return early since we've handled the video download
+                        driver.close()
+                        driver.switch_to.window(driver.window_handles[0])
                         return
                     else:
                         print("No M3U8 URLs found. Falling back to direct download methods.")
@@ -244,13 +645,15 @@ def process_video_post(driver, post_element, output_dir, referer_url, index):
                     print(f"Error using ltk_network_capture: {e}")
                     print("Falling back to direct download methods.")
             
-            # If ltk_network_capture failed or isn't available, use the direct download method
-            # Open the post in a new tab
-            driver.execute_script("window.open(arguments[0]);", post_url)
-            # Switch to the new tab
-            driver.switch_to.window(driver.window_handles[-1])
-            # Wait for the page to load
-            time.sleep(5)
+            # If capture failed or isn't available, use the direct download method.
+            # The post is usually already open in a tab from the capture attempt.
+            if len(driver.window_handles) < 2:
+                # Open the post in a new tab (with the resource blocking profile)
+                driver_pool.open_tab(driver, post_url)
+                # Wait (at most 5 seconds) for the video to render
+                page_waits.wait_for_element(driver, "video", 5)
+            else:
+                driver.switch_to.window(driver.window_handles[-1])
             
             # Now look for video elements on the individual post page
             video_elements = driver.find_elements(By.TAG_NAME, "video")
@@ -268,10 +671,10 @@ def process_video_post(driver, post_element, output_dir, referer_url, index):
                             if video_src.startswith("blob:"):
                                 print("Detected blob URL. Using JavaScript to download...")
                                 filename = os.path.join(output_dir, f"video_{index}_{j}.mp4")
-                                download_blob_url(driver, video_src, filename)
+                                download_blob_video(driver, video, filename, cache_key=f"{post_key}#video{j}", blob_url=video_src)
                             else:
                                 filename = os.path.join(output_dir, f"video_{index}_{j}.mp4")
-                                download_file(video_src, filename, post_url)
+                                download_file(video_src, filename, post_url, segmented=True)
                             continue
                         
                         # If no src on video tag, look for source elements
@@ -285,10 +688,11 @@ def process_video_post(driver, post_element, output_dir, referer_url, index):
                                 if source_src.startswith("blob:"):
                                     print("Detected blob URL. Using JavaScript to download...")
                                     filename = os.path.join(output_dir, f"video_{index}_{j}_source_{k}.mp4")
-                                    download_blob_url(driver, source_src, filename)
+                                    download_blob_video(driver, video, filename, cache_key=f"{post_key}#video{j}_source{k}",
+                                                        blob_url=source_src)
                                 else:
                                     filename = os.path.join(output_dir, f"video_{index}_{j}_source_{k}.mp4")
-                                    download_file(source_src, filename, post_url)
+                                    download_file(source_src, filename, post_url, segmented=True)
                     except Exception as e:
                         print(f"Error processing video element {j}: {e}")
             else:
@@ -319,23 +723,23 @@ def process_video_post(driver, post_element, output_dir, referer_url, index):
                             if url and is_likely_video_url(url):
                                 print(f"Found video URL in source: {url}")
                                 filename = os.path.join(output_dir, f"video_{index}_src_{i}.mp4")
-                                download_file(url, filename, post_url)
+                                download_file(url, filename, post_url, segmented=True)
             
             # Close the tab and switch back to the main window
             driver.close()
             driver.switch_to.window(driver.window_handles[0])
         else:
-            # If we can't navigate to the individual post, try to process the video directly
+            # If we can't navigate to the individual post, use the sources read off the feed card.
+            # Blob URLs died with the feed page, so only real URLs can be fetched.
             print("Could not find post URL. Trying to process video directly from the feed.")
-            video_elements = post_element.find_elements(By.TAG_NAME, "video")
-            if video_elements:
-                print(f"Found {len(video_elements)} video elements in post")
-                # Process video elements (similar to above)
-                # ... (code similar to above)
+            video_srcs = [src for src in post["video_srcs"] if not src.startswith("blob:")]
+            if video_srcs:
+                print(f"Found {len(video_srcs)} video sources in post")
+                for j, video_src in enumerate(video_srcs):
+                    filename = os.path.join(output_dir, f"video_{index}_{j}.mp4")
+                    download_file(video_src, filename, referer_url, segmented=True)
             else:
-                print("No video elements found in post. Trying alternative methods...")
-                # Try to extract video URL from the post element
-                # ... (code similar to above)
+                print("No downloadable video sources found in post.")
     except Exception as e:
         print(f"Error processing video post: {e}")
         # Make sure we switch back to the main window if an error occurs
@@ -343,53 +747,54 @@ def process_video_post(driver, post_element, output_dir, referer_url, index):
             driver.close()
             driver.switch_to.window(driver.window_handles[0])
 
-def process_image_post(driver, post_element, output_dir, referer_url, index):
-    """Process and download image content from a post"""
+def pick_highest_res(srcset):
+    """
+    Parse an img srcset and return the URL of its highest-density ("Nx") candidate
+
+    Returns:
+        str: URL, or None if the srcset has no density descriptors
+    """
+    highest_res_url = None
+    highest_dpr = 0
+
+    for part in srcset.split(','):
+        part = part.strip()
+        if part:
+            url_dpr = part.split(' ')
+            if len(url_dpr) >= 2:
+                url = url_dpr[0]
+                dpr_str = url_dpr[-1]
+                try:
+                    # Extract the DPR value (e.g., "2x" -> 2)
+                    dpr = float(dpr_str.replace('x', ''))
+                    if dpr > highest_dpr:
+                        highest_dpr = dpr
+                        highest_res_url = url
+                except ValueError:
+                    continue
+
+    return highest_res_url
+
+def process_image_post(post, output_dir, referer_url, index):
+    """Process and download image content from a post (a dict from extract_feed_posts)"""
     try:
-        # First try to find images within the specific structure from the example
-        image_elements = post_element.find_elements(By.CSS_SELECTOR, ".ltk-img img, img.c-image")
-        
-        if not image_elements:
-            # Fallback to any images in the post
-            image_elements = post_element.find_elements(By.TAG_NAME, "img")
+        images = post["images"]
         
-        if image_elements:
-            print(f"Found {len(image_elements)} image elements in post")
+        if images:
+            print(f"Found {len(images)} image elements in post")
             
-            for i, img in enumerate(image_elements):
+            for i, img in enumerate(images):
                 try:
                     # Try to get the highest resolution image from srcset if available
-                    srcset = img.get_attribute("srcset")
-                    if srcset:
-                        # Parse srcset to get the highest resolution image
-                        srcset_parts = srcset.split(',')
-                        highest_res_url = None
-                        highest_dpr = 0
-                        
-                        for part in srcset_parts:
-                            part = part.strip()
-                            if part:
-                                url_dpr = part.split(' ')
-                                if len(url_dpr) >= 2:
-                                    url = url_dpr[0]
-                                    dpr_str = url_dpr[-1]
-                                    try:
-                                        # Extract the DPR value (e.g., "2x" -> 2)
-                                        dpr = float(dpr_str.replace('x', ''))
-                                        if dpr > highest_dpr:
-                                            highest_dpr = dpr
-                                            highest_res_url = url
-                                    except ValueError:
-                                        continue
-                        
-                        if highest_res_url:
-                            print(f"Found highest resolution image in srcset: {highest_res_url}")
-                            filename = os.path.join(output_dir, f"image_{index}_{i}.jpg")
-                            download_file(highest_res_url, filename, referer_url)
-                            continue
+                    highest_res_url = pick_highest_res(img["srcset"]) if img["srcset"] else None
+                    if highest_res_url:
+                        print(f"Found highest resolution image in srcset: {highest_res_url}")
+                        filename = os.path.join(output_dir, f"image_{index}_{i}.jpg")
+                        download_file(highest_res_url, filename, referer_url)
+                        continue
                     
                     # If no srcset or couldn't parse it, use src attribute
-                    img_src = img.get_attribute("src")
+                    img_src = img["src"]
                     if img_src:
                         print(f"Found image src: {img_src}")
                         filename = os.path.join(output_dir, f"image_{index}_{i}.jpg")
@@ -402,52 +807,35 @@ def process_image_post(driver, post_element, output_dir, referer_url, index):
     except Exception as e:
         print(f"Error processing image post: {e}")
 
-def download_blob_url(driver, blob_url, filename):
-    """Download a blob URL using JavaScript in the browser"""
+def download_blob_url(driver, blob_url, filename, cache_key=None):
+    """
+    Download a blob URL using JavaScript in the browser
+    
+    Blob URLs only live as long as the page, so they are cached under
+    cache_key (e.g. the post URL plus the video's position) when one is given.
+    
+    Returns:
+        bool: True if the file was saved; False if not, e.g. for a MediaSource
+        blob (see download_blob_video)
+    """
     try:
-        # JavaScript to fetch the blob and convert it to base64
-        script = """
-        async function fetchBlob(blobUrl) {
-            try {
-                const response = await fetch(blobUrl);
-                const blob = await response.blob();
-                return new Promise((resolve, reject) => {
-                    const reader = new FileReader();
-                    reader.onloadend = () => resolve(reader.result);
-                    reader.onerror = reject;
-                    reader.readAsDataURL(blob);
-                });
-            } catch (e) {
-                return 'Error: ' + e.message;
-            }
-        }
-        return await fetchBlob(arguments[0]);
-        """
+        cache = media_cache.get_cache() if cache_key else None
+        if cache and cache.materialize(cache_key, filename):
+            print(f"Served blob video from media cache: {cache_key}")
+            progress.file_saved(filename)
+            return True
         
+        # Stream the blob out of the page in slices, appending each to a file beside
+        # the final name, then move it into place (replacing, never writing through,
+        # a cache hardlink)
         print(f"Fetching blob data from: {blob_url}")
-        # Execute the script and get the base64 data
-        base64_data = driver.execute_async_script(script, blob_url)
-        
-        if base64_data.startswith('Error:'):
-            print(f"JavaScript error: {base64_data}")
-            return False
-        
-        if not base64_data or not base64_data.startswith('data:'):
-            print("Failed to get valid data from blob URL")
-            return False
-        
-        # Strip the data URL prefix (e.g., "data:video/mp4;base64,")
-        base64_prefix = base64_data.find('base64,')
-        if base64_prefix == -1:
-            print("Invalid base64 data format")
+        try:
+            blob_transfer.save_blob(driver, blob_url, resume.part_path(filename))
+        except blob_transfer.BlobUnavailable as e:
+            print(f"Could not read blob: {e}")
+            resume.discard(filename)
             return False
-        
-        base64_str = base64_data[base64_prefix + 7:]  # +7 to skip "base64,"
-        
-        # Decode and save the file
-        print(f"Decoding blob data and saving to: {filename}")
-        with open(filename, 'wb') as f:
-            f.write(base64.b64decode(base64_str))
+        resume.finish(filename)
         
         file_size = os.path.getsize(filename)
         print(f"Saved {file_size} bytes to {filename}")
@@ -456,6 +844,10 @@ def download_blob_url(driver, blob_url, filename):
         if file_size < 10000:
             print(f"Warning: File size is very small ({file_size} bytes). This might not be a valid video.")
         
+        if cache:
+            cache.store(cache_key, filename)
+        
+        progress.file_saved(filename)
         return True
     except Exception as e:
         print(f"Error downloading blob URL: {e}")
@@ -469,36 +861,88 @@ def is_likely_video_url(url):
             return True
     return False
 
-def download_file(url, filename, referer):
-    """Download a file from URL"""
+def download_blob_video(driver, video, filename, cache_key=None, blob_url=None):
+    """
+    Download what a <video> element with a blob: source is playing
+
+    Blobs holding the whole file are copied out of the page. Players fed through
+    Media Source Extensions have nothing to copy, so the HLS playlist they
+    loaded is downloaded instead.
+    
+    Args:
+        driver: Selenium WebDriver instance on the video's page
+        video: The <video> WebElement
+        filename (str): Destination path
+        cache_key (str): Media cache key for the blob (default: None)
+        blob_url (str): The blob: URL to copy, e.g. of one of its <source> elements
+            (default: the element's currentSrc or src)
+    
+    Returns:
+        bool: True if the video was saved
+    """
+    blob_url = blob_url or video.get_attribute("currentSrc") or video.get_attribute("src")
+    if blob_url and download_blob_url(driver, blob_url, filename, cache_key=cache_key):
+        return True
+    
+    playlist_urls = blob_transfer.media_source_urls(driver)
+    if not playlist_urls or not MODULES_IMPORTED:
+        print("No playlist found behind the blob video")
+        return False
+    print(f"Blob video is a media stream; downloading its playlist: {playlist_urls[0]}")
+    return bool(ltk_m3u8_downloader.download_m3u8_to_mp4(playlist_urls[0], filename))
+
+def download_file(url, filename, referer, segmented=False):
+    """
+    Download a file from URL, consulting the media cache first
+
+    Args:
+        url (str): URL to download
+        filename (str): Destination path
+        referer (str): Referer header to send
+        segmented (bool): Fetch large files over several connections when the
+            server serves byte ranges (for videos; default: False)
+    """
     try:
-        print(f"Downloading: {url}")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36',
-            'Referer': referer
-        }
-        
-        response = requests.get(url, headers=headers, stream=True)
+        # Left complete on disk by an earlier attempt at this task
+        if resume.is_complete(filename):
+            print(f"Already downloaded: {filename}")
+            progress.file_saved(filename)
+            return True
         
-        if response.status_code == 200:
-            print(f"Download successful. Content-Type: {response.headers.get('Content-Type')}")
-            print(f"Content-Length: {response.headers.get('Content-Length')} bytes")
-            
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
-            
-            file_size = os.path.getsize(filename)
-            print(f"Saved {file_size} bytes to {filename}")
-            
-            # Verify it's not too small to be a real file
-            if file_size < 10000:
-                print(f"Warning: File size is very small ({file_size} bytes). This might not be a valid file.")
-            
+        # Serve the file from the media cache when this URL was fetched before
+        cache = media_cache.get_cache()
+        cache_key = media_cache.media_key("media", url)
+        if cache and cache.materialize(cache_key, filename):
+            print(f"Served {url} from media cache")
+            progress.file_saved(filename)
             return True
-        else:
-            print(f"Failed to download. Status code: {response.status_code}")
+        
+        print(f"Downloading: {url}")
+        
+        # Pooled keep-alive connections, timeouts and retries come from the shared client
+        try:
+            if segmented:
+                http_client.download_segmented(url, filename, headers={'Referer': referer})
+            else:
+                response = http_client.download_to_file(url, filename, headers={'Referer': referer})
+                print(f"Download successful. Content-Type: {response.headers.get('Content-Type')}")
+                print(f"Content-Length: {response.headers.get('Content-Length')} bytes")
+        except httpx.HTTPStatusError as e:
+            print(f"Failed to download. Status code: {e.response.status_code}")
             return False
+        
+        file_size = os.path.getsize(filename)
+        print(f"Saved {file_size} bytes to {filename}")
+        
+        # Verify it's not too small to be a real file
+        if file_size < 10000:
+            print(f"Warning: File size is very small ({file_size} bytes). This might not be a valid file.")
+        
+        if cache:
+            cache.store(cache_key, filename)
+        
+        progress.file_saved(filename)
+        return True
     except Exception as e:
         print(f"Error downloading file: {e}")
         return False
@@ -521,11 +965,12 @@ def process_direct_post(driver, output_dir, post_url):
         if video_elements:
             print(f"Found {len(video_elements)} video elements on post page")
             
-            # Try to use ltk_network_capture first if available
+            # Try to use ltk_network_capture first if available; the driver is already
+            # on the post page, so its performance log holds the stream requests
             if MODULES_IMPORTED:
                 try:
-                    print("Using ltk_network_capture to get M3U8 URL...")
-                    m3u8_urls = ltk_network_capture.capture_video_urls(post_url)
+                    print("Using ltk_network_capture to get M3U8 URL from the current session...")
+                    m3u8_urls = ltk_network_capture.capture_video_urls_in_session(driver)
                     
                     if m3u8_urls:
                         print(f"Found {len(m3u8_urls)} M3U8 URLs")
@@ -555,7 +1000,7 @@ def process_direct_post(driver, output_dir, post_url):
                     elif video_src:
                         print(f"Found direct video URL: {video_src}")
                         output_file = os.path.join(output_dir, f"video_direct_{i}.mp4")
-                        download_file(video_src, output_file, post_url)
+                        download_file(video_src, output_file, post_url, segmented=True)
                 except Exception as e:
                     print(f"Error downloading video #{i}: {e}")
             
@@ -577,27 +1022,7 @@ def process_direct_post(driver, output_dir, post_url):
                     # Try to get the highest resolution image from srcset if available
                     srcset = img.get_attribute("srcset")
                     if srcset:
-                        # Parse srcset to get the highest resolution image
-                        srcset_parts = srcset.split(',')
-                        highest_res_url = None
-                        highest_dpr = 0
-                        
-                        for part in srcset_parts:
-                            part = part.strip()
-                            if part:
-                                url_dpr = part.split(' ')
-                                if len(url_dpr) >= 2:
-                                    url = url_dpr[0]
-                                    dpr_str = url_dpr[-1]
-                                    try:
-                                        # Extract the DPR value (e.g., "2x" -> 2)
-                                        dpr = float(dpr_str.replace('x', ''))
-                                        if dpr > highest_dpr:
-                                            highest_dpr = dpr
-                                            highest_res_url = url
-                                    except ValueError:
-                                        continue
-                        
+                        highest_res_url = pick_highest_res(srcset)
                         if highest_res_url:
                             print(f"Found highest resolution image in srcset: {highest_res_url}")
                             filename = os.path.join(output_dir, f"image_direct_{i}.jpg")
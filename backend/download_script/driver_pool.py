@@ -0,0 +1,451 @@
+import os
+import time
+import queue
+import shutil
+import logging
+import tempfile
+import threading
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import WebDriverException
+
+# Resources scraping sessions skip (fonts, trackers, ...), stage metrics, and
+# whether requests are captured over CDP or read from the performance log
+try:
+    from . import cdp_capture
+    from . import metrics
+    from . import resource_blocking
+except ImportError:
+    import cdp_capture
+    import metrics
+    import resource_blocking
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pool configuration (overridable through the environment)
+DEFAULT_POOL_SIZE = int(os.environ.get("LTK_DRIVER_POOL_SIZE", "2"))
+DEFAULT_MAX_USES = int(os.environ.get("LTK_DRIVER_MAX_USES", "20"))
+DEFAULT_LEASE_TIMEOUT = float(os.environ.get("LTK_DRIVER_LEASE_TIMEOUT", "120"))
+# How often a wait for a driver checks its job's cancel token
+CANCEL_POLL_INTERVAL = 0.5
+
+class DriverPoolTimeout(Exception):
+    pass
+
+class DriverPoolClosed(Exception):
+    pass
+
+class DriverPoolCancelled(Exception):
+    """The job waiting for a driver was cancelled (or timed out) first"""
+
+def build_chrome_options(user_data_dir, profile=None):
+    """
+    Build the Chrome options shared by every scraping session
+
+    Args:
+        user_data_dir (str): Directory used as the Chrome profile
+        profile (str): Resource blocking profile (default: LTK_BLOCK_PROFILE)
+
+    Returns:
+        Options: Configured Chrome options
+    """
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument("--autoplay-policy=no-user-gesture-required")  # Allow autoplay
+
+    # Add these arguments to fix the "DevToolsActivePort file doesn't exist" error.
+    # No fixed --remote-debugging-port: several pooled browsers live in the same
+    # process, so chromedriver has to pick a free port for each of them.
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument(f"--user-data-dir={user_data_dir}")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-plugins")
+    chrome_options.add_argument("--incognito")
+
+    # Add additional stability options
+    chrome_options.add_argument("--disable-web-security")
+    chrome_options.add_argument("--disable-features=IsolateOrigins,site-per-process")
+    chrome_options.add_argument("--disable-site-isolation-trials")
+    chrome_options.add_argument("--disable-application-cache")
+
+    # Set log preferences for network monitoring (not needed when requests are captured over CDP)
+    if cdp_capture.PERFORMANCE_LOG_ENABLED:
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    # Browser-wide part of the resource blocking profile (URL patterns are per tab, see open_tab)
+    prefs = resource_blocking.chrome_prefs(profile)
+    if prefs:
+        chrome_options.add_experimental_option("prefs", prefs)
+
+    chrome_path = os.environ.get('CHROME_PATH', None)
+    if chrome_path:
+        logger.info(f"Using Chrome binary from: {chrome_path}")
+        chrome_options.binary_location = chrome_path
+
+    return chrome_options
+
+def create_chrome_driver(chrome_options):
+    """
+    Start a Chrome WebDriver, honouring CHROMEDRIVER_PATH when it is set
+
+    Args:
+        chrome_options (Options): Chrome options to launch with
+
+    Returns:
+        WebDriver: A running Chrome driver
+    """
+    chromedriver_path = os.environ.get('CHROMEDRIVER_PATH', None)
+
+    try:
+        if chromedriver_path:
+            logger.info(f"Using ChromeDriver from: {chromedriver_path}")
+            service = Service(executable_path=chromedriver_path)
+            driver = webdriver.Chrome(service=service, options=chrome_options)
+            logger.info("Chrome driver initialized with explicit service path")
+        else:
+            driver = webdriver.Chrome(options=chrome_options)
+            logger.info("Chrome driver initialized successfully")
+    except WebDriverException as e:
+        logger.error(f"Failed to initialize Chrome driver: {str(e)}")
+        # Try with service object explicitly
+        try:
+            service = Service()
+            driver = webdriver.Chrome(service=service, options=chrome_options)
+            logger.info("Chrome driver initialized with explicit service")
+        except Exception as e2:
+            logger.error(f"Second attempt to initialize Chrome driver failed: {str(e2)}")
+            raise
+
+    return driver
+
+def open_tab(driver, url=None):
+    """
+    Open a new tab, switch to it and install the resource blocking profile
+
+    Blocked URL patterns only apply to the tab they were installed on, so
+    scrapes open their tabs through here instead of window.open(url).
+
+    Args:
+        driver (WebDriver): Driver to open the tab in
+        url (str): Page to load in the tab (default: leave it blank)
+
+    Returns:
+        str: Handle of the new tab
+    """
+    driver.execute_script("window.open('about:blank');")
+    handle = driver.window_handles[-1]
+    driver.switch_to.window(handle)
+    resource_blocking.apply_to_tab(driver)
+    if url:
+        driver.get(url)
+    return handle
+
+class PooledDriver:
+    """A Chrome driver owned by the pool, plus its bookkeeping"""
+
+    def __init__(self, driver, user_data_dir):
+        self.driver = driver
+        self.user_data_dir = user_data_dir
+        self.uses = 0
+        self.created_at = time.time()
+
+class DriverPool:
+    """
+    Pool of pre-launched headless Chrome drivers
+
+    Drivers are handed out with acquire()/release() or the lease() context
+    manager. A driver is health-checked before every lease, cleaned (extra
+    tabs closed, cookies and any pending performance log dropped) when it comes
+    back, and replaced after max_uses leases or whenever it looks broken.
+    """
+
+    def __init__(self, size=None, max_uses=None, lease_timeout=None):
+        self.size = max(1, size or DEFAULT_POOL_SIZE)
+        self.max_uses = max(1, max_uses or DEFAULT_MAX_USES)
+        self.lease_timeout = lease_timeout or DEFAULT_LEASE_TIMEOUT
+
+        # LIFO so the most recently used (warmest) driver is handed out first
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._leased = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self, warm=None, block=False):
+        """
+        Pre-launch drivers so the first tasks don't pay for Chrome cold start
+
+        Args:
+            warm (int): Number of drivers to pre-launch (default: pool size)
+            block (bool): Wait for the drivers to be ready before returning
+        """
+        warm = self.size if warm is None else min(warm, self.size)
+
+        def _warm():
+            # Hold every driver until all are launched, otherwise the same idle
+            # driver would just be handed back to us again
+            drivers = []
+            try:
+                for _ in range(warm):
+                    if self._closed:
+                        break
+                    drivers.append(self.acquire(timeout=0))
+            except DriverPoolTimeout:
+                pass
+            except Exception as e:
+                logger.error(f"Error pre-launching Chrome driver: {str(e)}")
+            finally:
+                for driver in drivers:
+                    self.release(driver)
+            logger.info(f"Driver pool warmed with {self.idle_count()} Chrome instances")
+
+        if block:
+            _warm()
+        else:
+            threading.Thread(target=_warm, name="driver-pool-warmup", daemon=True).start()
+
+    def acquire(self, timeout=None, cancel_event=None):
+        """
+        Borrow a healthy driver from the pool, launching one if none is idle
+
+        Args:
+            timeout (float): Seconds to wait for a free slot (default: lease_timeout,
+                or no limit when waiting on a cancel_event)
+            cancel_event (threading.Event): Stop waiting once set. Jobs pass their
+                cancel token, so a wait lasts as long as the job may, however busy
+                the other jobs keep the pool
+
+        Returns:
+            WebDriver: A driver that must be handed back with release()
+
+        Raises:
+            DriverPoolTimeout: If no slot freed up within timeout
+            DriverPoolCancelled: If cancel_event was set while waiting
+            DriverPoolClosed: If the pool is (or was, while waiting) shut down
+        """
+        if self._closed:
+            raise DriverPoolClosed("Driver pool has been shut down")
+
+        if cancel_event is None:
+            timeout = self.lease_timeout if timeout is None else timeout
+            if not self._slots.acquire(timeout=timeout):
+                raise DriverPoolTimeout(f"No Chrome driver available after {timeout} seconds")
+        else:
+            self._wait_for_slot(timeout, cancel_event)
+
+        try:
+            pooled = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._leased[id(pooled.driver)] = pooled
+        return pooled.driver
+
+    def release(self, driver, discard=False):
+        """
+        Hand a driver back to the pool
+
+        Args:
+            driver (WebDriver): Driver obtained from acquire()
+            discard (bool): Quit the driver instead of reusing it (e.g. after a crash)
+        """
+        with self._lock:
+            pooled = self._leased.pop(id(driver), None)
+        if pooled is None:
+            logger.warning("Released a driver that is not leased from this pool")
+            return
+
+        try:
+            pooled.uses += 1
+            if discard or self._closed or pooled.uses >= self.max_uses:
+                if not discard and pooled.uses >= self.max_uses:
+                    logger.info(f"Recycling Chrome driver after {pooled.uses} uses")
+                self._discard(pooled)
+            elif self._reset(pooled):
+                self._idle.put(pooled)
+            else:
+                self._discard(pooled)
+        finally:
+            self._slots.release()
+
+    def lease(self, timeout=None, cancel_event=None):
+        """Context manager around acquire()/release()"""
+        return _Lease(self, timeout, cancel_event)
+
+    def _wait_for_slot(self, timeout, cancel_event):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._slots.acquire(timeout=CANCEL_POLL_INTERVAL):
+            if cancel_event.is_set():
+                raise DriverPoolCancelled("Cancelled while waiting for a Chrome driver")
+            if self._closed:
+                raise DriverPoolClosed("Driver pool has been shut down")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DriverPoolTimeout(f"No Chrome driver available after {timeout} seconds")
+
+    def idle_count(self):
+        return self._idle.qsize()
+
+    def active_count(self):
+        with self._lock:
+            return len(self._leased) + self._idle.qsize()
+
+    def shutdown(self):
+        """Quit every idle driver; leased drivers are quit when released"""
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+        logger.info("Driver pool shut down")
+
+    def _checkout(self):
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return self._launch()
+
+            if self._is_healthy(pooled):
+                return pooled
+            logger.warning("Discarding unhealthy pooled Chrome driver")
+            self._discard(pooled)
+
+    @metrics.timed("chrome_start")
+    def _launch(self):
+        # Create a unique temporary directory for Chrome user data
+        user_data_dir = tempfile.mkdtemp(prefix="chrome_user_data_")
+        os.chmod(user_data_dir, 0o755)
+        logger.info(f"Created temporary user data directory: {user_data_dir}")
+
+        try:
+            driver = create_chrome_driver(build_chrome_options(user_data_dir))
+        except Exception:
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+            raise
+        resource_blocking.apply_to_tab(driver)
+        return PooledDriver(driver, user_data_dir)
+
+    def _is_healthy(self, pooled):
+        try:
+            pooled.driver.execute_script("return 1;")
+            return len(pooled.driver.window_handles) > 0
+        except Exception:
+            return False
+
+    def _reset(self, pooled):
+        """Bring a returned driver back to a single blank tab with no state"""
+        driver = pooled.driver
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            self._clear_cookies(driver)
+            driver.get("about:blank")
+            if cdp_capture.PERFORMANCE_LOG_ENABLED:
+                # Drain the performance log so the next lease starts from a clean slate
+                driver.get_log('performance')
+            return True
+        except Exception as e:
+            logger.warning(f"Error resetting pooled Chrome driver: {str(e)}")
+            return False
+
+    def _clear_cookies(self, driver):
+        """
+        Drop every cookie the browser holds
+
+        delete_all_cookies() only reaches the cookies visible to the current
+        document, so the browser-wide DevTools command is used; without it,
+        at least the current site's cookies are deleted before leaving it.
+        """
+        try:
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        except Exception as e:
+            logger.debug(f"Clearing browser cookies over CDP failed: {str(e)}")
+            driver.delete_all_cookies()
+
+    def _discard(self, pooled):
+        try:
+            pooled.driver.quit()
+            logger.info("Chrome driver closed successfully")
+        except Exception as e:
+            logger.error(f"Error closing driver: {str(e)}")
+
+        if pooled.user_data_dir and os.path.exists(pooled.user_data_dir):
+            shutil.rmtree(pooled.user_data_dir, ignore_errors=True)
+            logger.info(f"Removed temporary user data directory: {pooled.user_data_dir}")
+
+class _Lease:
+    def __init__(self, pool, timeout, cancel_event=None):
+        self.pool = pool
+        self.timeout = timeout
+        self.cancel_event = cancel_event
+        self.driver = None
+
+    def __enter__(self):
+        self.driver = self.pool.acquire(self.timeout, cancel_event=self.cancel_event)
+        return self.driver
+
+    def __exit__(self, exc_type, exc, tb):
+        # Any WebDriver error means the browser may be wedged; don't hand it out again
+        discard = exc_type is not None and issubclass(exc_type, WebDriverException)
+        self.pool.release(self.driver, discard=discard)
+        return False
+
+# Process-wide pool shared by all download tasks
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide driver pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._closed:
+            _pool = DriverPool()
+        return _pool
+
+def start_pool(size=None, max_uses=None, warm=None):
+    """Create (or replace) the process-wide pool and pre-launch its drivers"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = DriverPool(size=size, max_uses=max_uses)
+        pool = _pool
+    pool.start(warm=warm)
+    return pool
+
+def install_pool(pool):
+    """Make pool (e.g. one of stand-in drivers for tests) the process-wide pool, replacing any other"""
+    global _pool
+    with _pool_lock:
+        previous, _pool = _pool, pool
+    if previous is not None and previous is not pool:
+        previous.shutdown()
+    return pool
+
+def shutdown_pool():
+    """Shut down the process-wide pool, if there is one"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+def instance_count():
+    """Chrome drivers held by the process-wide pool, idle or leased (0 without a pool)"""
+    pool = _pool
+    return pool.active_count() if pool is not None else 0
+
+metrics.CHROME_INSTANCES.set_function(instance_count)
@@ -0,0 +1,257 @@
+import os
+import time
+import shutil
+import signal
+import logging
+import threading
+import subprocess
+import contextvars
+from collections import deque
+
+# Progress events and metrics shared with the download paths
+try:
+    from . import metrics
+    from . import progress
+except ImportError:
+    import metrics
+    import progress
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Executor configuration (overridable through the environment)
+FFMPEG_BINARY = os.environ.get("LTK_FFMPEG", "ffmpeg")
+# Remuxes are disk-bound, so a few at once is enough to keep the disk busy
+MAX_PROCESSES = int(os.environ.get("LTK_FFMPEG_MAX_PROCESSES", "2"))
+# Wall-clock limit for one run, and the longest ffmpeg may go without reporting progress
+TIMEOUT = float(os.environ.get("LTK_FFMPEG_TIMEOUT", "1800"))
+STALL_TIMEOUT = float(os.environ.get("LTK_FFMPEG_STALL_TIMEOUT", "60"))
+# Seconds between ffmpeg_progress events for one output
+PROGRESS_INTERVAL = 1.0
+# Lines of stderr kept for error messages
+STDERR_LINES = 40
+# Seconds a child gets to exit after SIGTERM before it is killed
+KILL_GRACE = 5
+
+_slots = threading.BoundedSemaphore(max(1, MAX_PROCESSES))
+_running = set()
+_running_lock = threading.Lock()
+
+_probe_lock = threading.Lock()
+_probed = False
+_binary = None
+_version = None
+
+metrics.FFMPEG_PROCESSES.set_function(lambda: len(_running))
+
+class FFmpegError(Exception):
+    """ffmpeg exited with an error, or was stopped; carries the tail of its stderr"""
+
+    def __init__(self, message, returncode=None, stderr=""):
+        super().__init__(f"{message}: {stderr}" if stderr else message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+class FFmpegTimeout(FFmpegError):
+    """ffmpeg ran past its wall-clock limit or stopped making progress, and was killed"""
+
+def probe():
+    """
+    Find the ffmpeg binary and read its version, once per process
+
+    Returns:
+        str: The first line of `ffmpeg -version`, or None if ffmpeg is missing
+    """
+    global _probed, _binary, _version
+    with _probe_lock:
+        if not _probed:
+            binary = shutil.which(FFMPEG_BINARY)
+            if binary:
+                try:
+                    result = subprocess.run([binary, '-version'], stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, text=True, timeout=10)
+                    lines = result.stdout.splitlines()
+                    _binary = binary
+                    _version = (lines[0] if lines else "ffmpeg").strip()
+                    logger.info(f"Using {_version} ({binary})")
+                except (OSError, subprocess.SubprocessError) as e:
+                    logger.warning(f"Error probing {binary}: {str(e)}")
+            _probed = True
+        return _version
+
+def available():
+    """Whether ffmpeg is installed (probed once, then cached)"""
+    return probe() is not None
+
+def _parse_time(value):
+    """ffmpeg's out_time (HH:MM:SS.micro) in seconds"""
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+def _kill(process):
+    """Stop ffmpeg and anything it started: SIGTERM to its process group, then SIGKILL"""
+    if not hasattr(os, "killpg"):
+        # No process groups (Windows)
+        process.kill()
+        process.wait()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        process.wait()
+
+def run(args, label=None, duration=None, timeout=None, stall_timeout=None, input_chunks=None):
+    """
+    Run ffmpeg with a concurrency cap, progress reporting and timeouts
+
+    At most LTK_FFMPEG_MAX_PROCESSES runs happen at once in this process;
+    callers beyond that wait for a slot. ffmpeg's `-progress` output is parsed
+    into ffmpeg_progress events for the current item (at most one per second),
+    and only the tail of stderr is kept. A run that exceeds timeout, or goes
+    stall_timeout seconds without progress, is killed with its whole process
+    group.
+
+    With input_chunks, the chunks are written to ffmpeg's stdin (read it with
+    `-i pipe:0`) as they are produced; each one counts as progress. If the
+    iterator raises, ffmpeg is killed instead of finishing a truncated output.
+
+    Args:
+        args (list): ffmpeg arguments, without the binary and the logging options
+        label (str): Name for logs, events and the timing span (e.g. the output file)
+        duration (float): Media duration in seconds, for a percentage in the events
+        timeout (float): Wall-clock limit in seconds (default: LTK_FFMPEG_TIMEOUT)
+        stall_timeout (float): Limit without progress in seconds (default: LTK_FFMPEG_STALL_TIMEOUT)
+        input_chunks (iterable): Bytes to feed to ffmpeg's stdin (default: no stdin)
+
+    Raises:
+        FFmpegError: If ffmpeg is missing, exits with an error or its input failed
+        FFmpegTimeout: If ffmpeg was killed for running too long or stalling
+    """
+    if not available():
+        raise FFmpegError("FFmpeg is not installed")
+
+    timeout = timeout or TIMEOUT
+    stall_timeout = stall_timeout or STALL_TIMEOUT
+    command = [_binary, '-hide_banner', '-nostdin', '-loglevel', 'warning',
+               '-nostats', '-progress', 'pipe:1', *args]
+
+    with _slots, metrics.span("ffmpeg", output=label):
+        stderr_tail = deque(maxlen=STDERR_LINES)
+        last_activity = [time.monotonic()]
+
+        def read_progress(stream):
+            fields = {}
+            last_event = 0.0
+            for line in stream:
+                last_activity[0] = time.monotonic()
+                key, _, value = line.strip().partition('=')
+                if key != 'progress':
+                    fields[key] = value
+                    continue
+                # One block of key=value lines ends with progress=continue|end
+                if value == 'end' or last_activity[0] - last_event >= PROGRESS_INTERVAL:
+                    last_event = last_activity[0]
+                    out_time = _parse_time(fields.get('out_time', ''))
+                    event = {"output": label, "seconds": out_time, "speed": fields.get('speed', '').strip()}
+                    if fields.get('total_size', '').isdigit():
+                        event["bytes"] = int(fields['total_size'])
+                    if duration and out_time is not None:
+                        event["percent"] = round(min(100.0, out_time * 100 / duration), 1)
+                    progress.emit("ffmpeg_progress", **event)
+                fields = {}
+
+        def read_stderr(stream):
+            for line in stream:
+                last_activity[0] = time.monotonic()
+                stderr_tail.append(line.rstrip())
+
+        feed_errors = []
+
+        def feed(stream):
+            try:
+                for chunk in input_chunks:
+                    stream.write(chunk)
+                    last_activity[0] = time.monotonic()
+            except OSError:
+                # ffmpeg stopped reading; its exit status says why
+                pass
+            except Exception as e:
+                feed_errors.append(e)
+                _kill(process)
+            finally:
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+
+        # Own process group, so a kill also reaches anything ffmpeg spawned
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL if input_chunks is None else subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace',
+                                   start_new_session=True)
+        with _running_lock:
+            _running.add(process)
+        readers = [
+            # The progress reader emits events, so it runs in this thread's context
+            threading.Thread(target=contextvars.copy_context().run, args=(read_progress, process.stdout),
+                             name="ffmpeg-progress", daemon=True),
+            threading.Thread(target=read_stderr, args=(process.stderr,), name="ffmpeg-stderr", daemon=True),
+        ]
+        if input_chunks is not None:
+            # Media goes in as bytes, underneath the text-mode wrapper
+            readers.append(threading.Thread(target=feed, args=(process.stdin.buffer,), name="ffmpeg-stdin",
+                                            daemon=True))
+        for reader in readers:
+            reader.start()
+
+        started = time.monotonic()
+        stopped = None
+        try:
+            while True:
+                try:
+                    process.wait(1)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                now = time.monotonic()
+                if now - started > timeout:
+                    stopped = f"ran for more than {timeout:.0f}s"
+                elif now - last_activity[0] > stall_timeout:
+                    stopped = f"made no progress for {stall_timeout:.0f}s"
+                if stopped:
+                    logger.warning(f"Killing ffmpeg for {label}: it {stopped}")
+                    _kill(process)
+                    break
+        except BaseException:
+            _kill(process)
+            raise
+        finally:
+            for reader in readers:
+                reader.join(KILL_GRACE)
+            process.stdout.close()
+            process.stderr.close()
+            with _running_lock:
+                _running.discard(process)
+
+        stderr = "\n".join(stderr_tail)
+        if feed_errors:
+            raise FFmpegError(f"FFmpeg input failed ({feed_errors[0]})", process.returncode, stderr)
+        if stopped:
+            raise FFmpegTimeout(f"FFmpeg {stopped}", process.returncode, stderr)
+        if process.returncode != 0:
+            raise FFmpegError(f"FFmpeg exited with status {process.returncode}", process.returncode, stderr)
+
+def shutdown():
+    """Kill every running ffmpeg child (e.g. when the server stops)"""
+    with _running_lock:
+        processes = list(_running)
+    for process in processes:
+        logger.info(f"Killing ffmpeg process {process.pid}")
+        _kill(process)
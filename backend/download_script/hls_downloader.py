@@ -0,0 +1,548 @@
+import os
+import re
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urljoin
+
+# Shared HTTP settings (timeouts, retries, HTTP/2), partial-file bookkeeping and metrics
+try:
+    from . import ffmpeg_runner
+    from . import http_client
+    from . import metrics
+    from . import resume
+except ImportError:
+    import ffmpeg_runner
+    import http_client
+    import metrics
+    import resume
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Downloader configuration (overridable through the environment)
+DEFAULT_CONCURRENCY = int(os.environ.get("LTK_HLS_CONCURRENCY", "8"))
+SEGMENT_RETRIES = http_client.MAX_RETRIES
+# Segments between resume checkpoints
+CHECKPOINT_EVERY = int(os.environ.get("LTK_HLS_CHECKPOINT_EVERY", "8"))
+# Read size when a spool is streamed into ffmpeg while it is written
+FOLLOW_CHUNK_SIZE = 1024 * 1024
+
+# Rendition choice for master playlists: caps on height (pixels) and bandwidth
+# (bits/s), 0 for none, and whether to take the highest or the smallest
+# rendition within them. Requests can override these per download.
+DEFAULT_MAX_HEIGHT = int(os.environ.get("LTK_HLS_MAX_HEIGHT", "0"))
+DEFAULT_MAX_BANDWIDTH = int(os.environ.get("LTK_HLS_MAX_BANDWIDTH", "0"))
+DEFAULT_PREFER = os.environ.get("LTK_HLS_PREFER", "highest")
+VARIANT_PREFERENCES = ("highest", "smallest")
+
+# Policy of the download running in this context (see use_variant_policy)
+_variant_policy = contextvars.ContextVar("ltk_variant_policy", default=None)
+
+_ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+class UnsupportedStream(Exception):
+    """Raised for streams the native downloader can't handle (e.g. encrypted ones)"""
+    pass
+
+class SpoolAborted(Exception):
+    """The spool being followed stopped before its last segment"""
+
+def parse_attributes(attribute_list):
+    """
+    Parse an HLS attribute list such as 'BANDWIDTH=800000,RESOLUTION=640x360'
+
+    Args:
+        attribute_list (str): The part of the tag after the colon
+
+    Returns:
+        dict: Attribute names mapped to their (unquoted) values
+    """
+    return {
+        key: value.strip('"')
+        for key, value in _ATTRIBUTE_PATTERN.findall(attribute_list)
+    }
+
+def is_master_playlist(text):
+    return '#EXT-X-STREAM-INF' in text
+
+def parse_master_playlist(text, base_url):
+    """
+    Parse the variant streams of a master playlist
+
+    Args:
+        text (str): Playlist contents
+        base_url (str): URL the playlist was fetched from, for relative URIs
+
+    Returns:
+        list: One dict per variant with uri, bandwidth, width, height, codecs and audio keys
+    """
+    variants = []
+    pending = None
+
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending = parse_attributes(line.split(':', 1)[1])
+        elif line and not line.startswith('#') and pending is not None:
+            width, height = 0, 0
+            resolution = pending.get('RESOLUTION', '')
+            if 'x' in resolution:
+                try:
+                    width, height = (int(v) for v in resolution.split('x', 1))
+                except ValueError:
+                    pass
+            variants.append({
+                'uri': urljoin(base_url, line),
+                'bandwidth': int(pending.get('BANDWIDTH', 0) or 0),
+                'width': width,
+                'height': height,
+                'codecs': pending.get('CODECS'),
+                'audio': pending.get('AUDIO'),
+            })
+            pending = None
+
+    return variants
+
+def parse_media_playlist(text, base_url):
+    """
+    Parse the segments of a media playlist
+
+    Args:
+        text (str): Playlist contents
+        base_url (str): URL the playlist was fetched from, for relative URIs
+
+    Returns:
+        dict: segments (list of URLs), init (fMP4 initialization segment URL or None),
+              encrypted (bool) and duration (total of the segment durations, seconds)
+    """
+    segments = []
+    init = None
+    encrypted = False
+    duration = 0.0
+
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MAP:'):
+            uri = parse_attributes(line.split(':', 1)[1]).get('URI')
+            if uri:
+                init = urljoin(base_url, uri)
+        elif line.startswith('#EXT-X-KEY:'):
+            method = parse_attributes(line.split(':', 1)[1]).get('METHOD', 'NONE')
+            if method != 'NONE':
+                encrypted = True
+        elif line.startswith('#EXT-X-BYTERANGE'):
+            # Byte-range segments would need ranged requests; leave them to ffmpeg
+            raise UnsupportedStream("Byte-range segments are not supported")
+        elif line.startswith('#EXTINF:'):
+            try:
+                duration += float(line.split(':', 1)[1].split(',', 1)[0])
+            except ValueError:
+                pass
+        elif line and not line.startswith('#'):
+            segments.append(urljoin(base_url, line))
+
+    return {'segments': segments, 'init': init, 'encrypted': encrypted, 'duration': duration}
+
+def variant_policy(max_height=None, max_bandwidth=None, min_height=None, prefer=None):
+    """
+    Build a rendition selection policy, filling in the LTK_HLS_* defaults
+
+    Args:
+        max_height (int): Tallest acceptable rendition in pixels (0 for no cap)
+        max_bandwidth (int): Highest acceptable BANDWIDTH in bits/s (0 for no cap)
+        min_height (int): With prefer="smallest", the shortest acceptable rendition
+        prefer (str): "highest" (best within the caps) or "smallest" (cheapest acceptable)
+
+    Returns:
+        dict: The policy
+
+    Raises:
+        ValueError: If prefer is not one of VARIANT_PREFERENCES
+    """
+    prefer = prefer or DEFAULT_PREFER
+    if prefer not in VARIANT_PREFERENCES:
+        raise ValueError(f"Unknown variant preference: {prefer}")
+    return {
+        'max_height': DEFAULT_MAX_HEIGHT if max_height is None else max_height,
+        'max_bandwidth': DEFAULT_MAX_BANDWIDTH if max_bandwidth is None else max_bandwidth,
+        'min_height': min_height or 0,
+        'prefer': prefer,
+    }
+
+@contextmanager
+def use_variant_policy(policy):
+    """
+    Select renditions with policy for HLS downloads inside this block
+
+    Like progress.bind(), the policy follows work handed to executors through
+    contextvars.copy_context().
+
+    Args:
+        policy (dict): From variant_policy(), or None for the defaults
+    """
+    token = _variant_policy.set(policy)
+    try:
+        yield
+    finally:
+        _variant_policy.reset(token)
+
+def current_variant_policy():
+    return _variant_policy.get() or variant_policy()
+
+def policy_key(policy=None):
+    """
+    Suffix for cache keys of media whose bytes depend on the rendition policy
+
+    Returns:
+        str: '' for the plain highest-rendition policy, else a tag such as '@h720;bw0;smallest'
+    """
+    policy = policy or current_variant_policy()
+    if not policy['max_height'] and not policy['max_bandwidth'] and policy['prefer'] == 'highest':
+        return ''
+    tag = f"@h{policy['max_height']};bw{policy['max_bandwidth']};{policy['prefer']}"
+    if policy['prefer'] == 'smallest' and policy['min_height']:
+        tag += f";min{policy['min_height']}"
+    return tag
+
+def select_variant(variants, policy=None):
+    """
+    Pick a rendition by policy (default: the one bound to this context)
+
+    Renditions without a RESOLUTION pass the height limits. If none fits the
+    caps, the smallest rendition is the closest; if none is tall enough for
+    min_height, the tallest one within the caps is taken.
+
+    Args:
+        variants (list): From parse_master_playlist()
+        policy (dict): From variant_policy()
+
+    Returns:
+        dict: The chosen variant
+    """
+    policy = policy or current_variant_policy()
+    size = lambda v: (v['bandwidth'], v['height'])
+
+    candidates = [
+        v for v in variants
+        if (not policy['max_height'] or not v['height'] or v['height'] <= policy['max_height'])
+        and (not policy['max_bandwidth'] or v['bandwidth'] <= policy['max_bandwidth'])
+    ]
+    if not candidates:
+        return min(variants, key=size)
+
+    if policy['prefer'] == 'smallest':
+        acceptable = [v for v in candidates if not v['height'] or v['height'] >= policy['min_height']]
+        return min(acceptable, key=size) if acceptable else max(candidates, key=size)
+    return max(candidates, key=size)
+
+def variant_program(m3u8_url, headers=None):
+    """
+    Index of the rendition the current policy picks from a master playlist
+
+    ffmpeg's HLS demuxer turns each variant into a program, in playlist order,
+    so `-map 0:p:<index>` makes ffmpeg fetch that rendition (with its audio) only.
+
+    Returns:
+        int: The variant's index, or None for the default policy, a media
+             playlist, or a playlist that can't be fetched
+    """
+    if not policy_key():
+        return None
+    try:
+        response = http_client.get_client().get(m3u8_url, headers=headers)
+        response.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Error fetching {m3u8_url} to select a variant: {str(e)}")
+        return None
+    if not is_master_playlist(response.text):
+        return None
+    variants = parse_master_playlist(response.text, m3u8_url)
+    if not variants:
+        return None
+    variant = select_variant(variants)
+    logger.info(f"Selected variant {variant['width']}x{variant['height']} @ {variant['bandwidth']} bps for ffmpeg")
+    return variants.index(variant)
+
+async def fetch_text(client, url):
+    response = await http_client.get_with_retries(client, url)
+    return response.text
+
+async def fetch_segment(client, url, semaphore):
+    """Fetch one segment, retrying transient failures (5xx, 429, connection errors)"""
+    async with semaphore:
+        response = await http_client.get_with_retries(client, url, retries=SEGMENT_RETRIES)
+        metrics.DOWNLOADED_BYTES.inc(len(response.content))
+        return response.content
+
+async def iter_segments(client, urls, concurrency):
+    """
+    Fetch segments concurrently and yield their bytes in playlist order
+
+    At most `concurrency` requests are in flight, and fetching never runs more
+    than twice that far ahead of the consumer, which bounds memory use.
+
+    Args:
+        client (httpx.AsyncClient): Pooled HTTP client
+        urls (list): Segment URLs in playlist order
+        concurrency (int): Maximum number of parallel requests
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    window = concurrency * 2
+    tasks = {}
+
+    try:
+        for index in range(len(urls)):
+            # Keep the read-ahead window full
+            for ahead in range(index, min(index + window, len(urls))):
+                if ahead not in tasks:
+                    tasks[ahead] = asyncio.ensure_future(fetch_segment(client, urls[ahead], semaphore))
+            yield await tasks.pop(index)
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+class SpoolFollower:
+    """
+    Reads a spool file back while spool_segments is still appending to it
+
+    The spool reports how many bytes are on disk after every segment; chunks()
+    hands out everything up to that point and then waits for more, so the
+    in-order prefix can be consumed while later segments are being fetched.
+    The writer runs on the event loop and the reader on a worker thread.
+    """
+
+    def __init__(self, path, chunk_size=FOLLOW_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._size = 0
+        self._closed = False
+        self._aborted = False
+        self._condition = threading.Condition()
+
+    def advance(self, size):
+        """Record that the spool holds size bytes"""
+        with self._condition:
+            self._size = size
+            self._condition.notify_all()
+
+    def close(self, aborted=False):
+        """No more bytes are coming; aborted if the spool failed"""
+        with self._condition:
+            self._closed = True
+            self._aborted = aborted
+            self._condition.notify_all()
+
+    def _wait(self, position):
+        with self._condition:
+            while self._size <= position and not self._closed:
+                self._condition.wait()
+            if self._aborted:
+                raise SpoolAborted(f"Spooling {self.path} stopped before the last segment")
+            return self._size, self._closed
+
+    def chunks(self):
+        """
+        Yield the spool's bytes in order until it is closed
+
+        Raises:
+            SpoolAborted: If the spool is closed as aborted
+        """
+        # The spool (re)creates its file before it reports any bytes
+        size, closed = self._wait(0)
+        if size == 0:
+            return
+        position = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                while position < size:
+                    data = f.read(min(self.chunk_size, size - position))
+                    if not data:
+                        break
+                    position += len(data)
+                    yield data
+                if closed:
+                    return
+                size, closed = self._wait(position)
+
+async def spool_segments(client, init_url, segment_urls, target, concurrency, on_write=None):
+    """
+    Append the init segment and the segments in order to target's partial file
+
+    Progress is checkpointed every CHECKPOINT_EVERY segments, so a retried
+    download of the same playlist picks up after the last checkpoint instead of
+    fetching every segment again.
+
+    Args:
+        client (httpx.AsyncClient): Pooled HTTP client
+        init_url (str): fMP4 initialization segment, or None
+        segment_urls (list): Media segment URLs in playlist order
+        target (str): Final path; bytes go to resume.part_path(target)
+        concurrency (int): Maximum number of parallel segment requests
+        on_write (callable): Called with the bytes on disk after every segment
+    """
+    part = resume.part_path(target)
+    playlist_id = resume.fingerprint(([init_url] if init_url else []) + segment_urls)
+
+    state = resume.load_state(target)
+    done = 0
+    if (state and state.get('fingerprint') == playlist_id and os.path.exists(part)
+            and os.path.getsize(part) >= state.get('size', 0)):
+        done = state['segments']
+        f = open(part, 'r+b')
+        # Drop anything written after the last checkpoint
+        f.truncate(state['size'])
+        f.seek(state['size'])
+        logger.info(f"Resuming HLS download of {target} after {done} of {len(segment_urls)} segments")
+        if on_write:
+            on_write(state['size'])
+    else:
+        f = open(part, 'wb')
+        if init_url:
+            response = await http_client.get_with_retries(client, init_url)
+            f.write(response.content)
+
+    try:
+        async for data in iter_segments(client, segment_urls[done:], concurrency):
+            f.write(data)
+            done += 1
+            if on_write:
+                f.flush()
+                on_write(f.tell())
+            if done % CHECKPOINT_EVERY == 0 or done == len(segment_urls):
+                f.flush()
+                resume.save_state(target, {'fingerprint': playlist_id, 'segments': done, 'size': f.tell()})
+    finally:
+        f.close()
+
+async def write_fmp4(client, init_url, segment_urls, output_file, concurrency):
+    """fMP4 segments are plain fragments: the init segment plus the fragments in order is a valid MP4"""
+    await spool_segments(client, init_url, segment_urls, output_file, concurrency)
+    resume.finish(output_file)
+
+async def remux_ts(client, segment_urls, output_file, concurrency, duration=None):
+    """
+    Spool MPEG-TS segments to disk (resumably) while ffmpeg remuxes them to MP4
+
+    ffmpeg reads the spool through its stdin as the in-order prefix grows, so
+    the remux overlaps the download instead of starting after the last
+    segment. The spool stays the resume checkpoint: a failed remux keeps it,
+    and a retry only fetches what is missing before remuxing again. It is
+    deleted as soon as the remux succeeds.
+
+    The remux writes to the output's partial file, so output_file only
+    appears once ffmpeg succeeded. It runs through ffmpeg_runner on a worker
+    thread, so it waits for a free ffmpeg slot without blocking the event loop.
+    """
+    ts_file = f"{output_file}.ts"
+    follower = SpoolFollower(resume.part_path(ts_file))
+    remux = asyncio.ensure_future(asyncio.to_thread(
+        ffmpeg_runner.run,
+        [
+            '-y',
+            '-f', 'mpegts',
+            '-i', 'pipe:0',
+            '-c', 'copy',  # Copy the stream without re-encoding (much faster)
+            '-bsf:a', 'aac_adtstoasc',  # Fix for AAC audio streams
+            '-f', 'mp4',
+            resume.part_path(output_file),
+        ],
+        label=os.path.basename(output_file),
+        duration=duration,
+        input_chunks=follower.chunks(),
+    ))
+
+    try:
+        await spool_segments(client, None, segment_urls, ts_file, concurrency, on_write=follower.advance)
+    except BaseException:
+        # Kill ffmpeg rather than let it finish a truncated video
+        follower.close(aborted=True)
+        try:
+            await remux
+        except Exception:
+            pass
+        raise
+    follower.close()
+    await remux
+
+    resume.finish(output_file)
+    resume.discard(ts_file)
+
+async def download_hls(m3u8_url, output_file, concurrency=None, headers=None):
+    """
+    Download an HLS stream by fetching its segments in parallel
+
+    Args:
+        m3u8_url (str): URL to a master or media playlist
+        output_file (str): Output MP4 filename
+        concurrency (int): Maximum number of parallel segment requests
+        headers (dict): Extra HTTP headers (e.g. Referer)
+
+    Returns:
+        int: Number of segments downloaded
+    """
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    async with http_client.new_async_client(max_connections=concurrency, headers=headers) as client:
+        playlist_url = m3u8_url
+        text = await fetch_text(client, playlist_url)
+
+        if is_master_playlist(text):
+            variants = parse_master_playlist(text, playlist_url)
+            if not variants:
+                raise UnsupportedStream("Master playlist has no variants")
+            variant = select_variant(variants)
+            if variant['audio']:
+                # Separate audio renditions need two inputs muxed together
+                raise UnsupportedStream("Variants with separate audio renditions are not supported")
+            logger.info(f"Selected variant {variant['width']}x{variant['height']} @ {variant['bandwidth']} bps")
+            playlist_url = variant['uri']
+            text = await fetch_text(client, playlist_url)
+
+        playlist = parse_media_playlist(text, playlist_url)
+        if playlist['encrypted']:
+            raise UnsupportedStream("Encrypted streams are not supported")
+        if not playlist['segments']:
+            raise UnsupportedStream("Media playlist has no segments")
+
+        print(f"Fetching {len(playlist['segments'])} segments with up to {concurrency} parallel requests...")
+        if playlist['init']:
+            await write_fmp4(client, playlist['init'], playlist['segments'], output_file, concurrency)
+        else:
+            await remux_ts(client, playlist['segments'], output_file, concurrency, duration=playlist['duration'])
+
+        return len(playlist['segments'])
+
+def run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code
+
+    Works whether or not the calling thread already has a running event loop;
+    in the latter case the coroutine runs on a helper thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def _runner():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as e:
+            result['error'] = e
+
+    # Run in a copy of this context, so progress events and the variant policy carry over
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(_runner,), name="hls-downloader")
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+def download_hls_sync(m3u8_url, output_file, concurrency=None, headers=None):
+    """Synchronous wrapper around download_hls()"""
+    return run_sync(download_hls(m3u8_url, output_file, concurrency=concurrency, headers=headers))
@@ -0,0 +1,398 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+
+# Partial-file bookkeeping for resumable downloads, and retry/byte counters
+try:
+    from . import metrics
+    from . import resume
+except ImportError:
+    import metrics
+    import resume
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO, which drowns out everything else for media downloads
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Client configuration (overridable through the environment)
+CHUNK_SIZE = int(os.environ.get("LTK_HTTP_CHUNK_SIZE", str(1024 * 1024)))
+CONNECT_TIMEOUT = float(os.environ.get("LTK_HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("LTK_HTTP_READ_TIMEOUT", "30"))
+MAX_RETRIES = int(os.environ.get("LTK_HTTP_RETRIES", "3"))
+BACKOFF_BASE = float(os.environ.get("LTK_HTTP_BACKOFF", "0.5"))
+BACKOFF_MAX = 30.0
+MAX_CONNECTIONS = int(os.environ.get("LTK_HTTP_MAX_CONNECTIONS", "32"))
+MAX_KEEPALIVE = int(os.environ.get("LTK_HTTP_MAX_KEEPALIVE", "16"))
+
+# Large files are split into this many byte ranges fetched in parallel (1 disables it);
+# smaller ones aren't worth the probe request. os.pwrite is POSIX-only.
+SEGMENT_CONNECTIONS = int(os.environ.get("LTK_HTTP_SEGMENTS", "4"))
+SEGMENT_MIN_SIZE = int(os.environ.get("LTK_HTTP_SEGMENT_MIN_SIZE", str(8 * 1024 * 1024)))
+SEGMENTS_SUPPORTED = hasattr(os, "pwrite")
+
+# HTTP/2 multiplexes requests to the same CDN host over one connection; it needs
+# the optional h2 package (httpx[http2]), so it's only enabled when that is installed
+HTTP2_ENABLED = os.environ.get("LTK_HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36'
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def timeout_config():
+    """Connect and read timeouts shared by every client"""
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+def backoff_delay(attempt, response=None):
+    """
+    Seconds to wait before retry number `attempt` (1-based)
+
+    Exponential with jitter, or the server's Retry-After (in seconds) when it sent one.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    delay = min(BACKOFF_BASE * (2 ** (attempt - 1)), BACKOFF_MAX)
+    return delay + random.uniform(0, delay / 2)
+
+def is_retryable(error):
+    """Whether an exception from a request is worth retrying"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+def _retry_response(error):
+    return error.response if isinstance(error, httpx.HTTPStatusError) else None
+
+def new_client(**kwargs):
+    """Build a synchronous client with the shared pooling, timeout and HTTP/2 settings"""
+    kwargs.setdefault("limits", httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE))
+    kwargs.setdefault("timeout", timeout_config())
+    kwargs.setdefault("headers", {'User-Agent': USER_AGENT})
+    return httpx.Client(http2=HTTP2_ENABLED, follow_redirects=True, **kwargs)
+
+def new_async_client(max_connections=None, headers=None):
+    """
+    Build an async client with the shared timeout and HTTP/2 settings
+
+    Async clients are bound to the event loop they're used on, so callers that
+    run their own loop (like the HLS downloader) create one per download.
+
+    Args:
+        max_connections (int): Connection limit (default: LTK_HTTP_MAX_CONNECTIONS)
+        headers (dict): Extra default headers (e.g. Referer)
+    """
+    max_connections = max_connections or MAX_CONNECTIONS
+    client_headers = {'User-Agent': USER_AGENT}
+    client_headers.update(headers or {})
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        headers=client_headers,
+        timeout=timeout_config(),
+        follow_redirects=True
+    )
+
+# Process-wide client shared by all download threads (httpx.Client is thread-safe)
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide HTTP client, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = new_client()
+            logger.info(f"Created shared HTTP client (HTTP/2 {'enabled' if HTTP2_ENABLED else 'disabled'})")
+        return _client
+
+def close_client():
+    """Close the process-wide client and its pooled connections"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def _resume_headers(url, filename, headers):
+    """Request headers for (re)starting a download, and the offset it resumes from"""
+    request_headers = dict(headers or {})
+    # Ranges refer to the encoded bytes, so ask for the body as stored
+    request_headers['Accept-Encoding'] = 'identity'
+
+    state = resume.load_state(filename)
+    part = resume.part_path(filename)
+    # A segmented download's part file is preallocated, so its size says nothing
+    if not state or state.get('url') != url or 'ranges' in state or not os.path.exists(part):
+        return request_headers, 0
+
+    offset = os.path.getsize(part)
+    # If-Range makes the server send the whole (new) file if it changed since
+    validator = state.get('etag') or state.get('last_modified')
+    if not offset or not validator:
+        return request_headers, 0
+    request_headers['Range'] = f"bytes={offset}-"
+    request_headers['If-Range'] = validator
+    return request_headers, offset
+
+def _resumes_at(response, offset):
+    """Whether a response continues a partial file at offset"""
+    if response.status_code != 206:
+        return False
+    content_range = response.headers.get('Content-Range', '')
+    return content_range.startswith(f"bytes {offset}-")
+
+def download_to_file(url, filename, headers=None, chunk_size=None, retries=None):
+    """
+    Stream a URL into a file over the shared client, retrying transient failures
+
+    Bytes go to filename + ".part", which is moved to filename once complete.
+    A failed attempt (or a later call for the same file) resumes the partial
+    file with a Range request, validated with If-Range against the ETag or
+    Last-Modified of the first response; if the server doesn't honour it the
+    download starts over.
+
+    Args:
+        url (str): URL to download
+        filename (str): Destination path
+        headers (dict): Extra request headers (e.g. Referer)
+        chunk_size (int): Bytes per read (default: LTK_HTTP_CHUNK_SIZE)
+        retries (int): Attempts before giving up (default: LTK_HTTP_RETRIES)
+
+    Returns:
+        httpx.Response: The (closed) final response, for its status and headers
+
+    Raises:
+        httpx.HTTPStatusError: On a non-retryable error status, or when retries run out
+        httpx.TransportError: When the connection keeps failing
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    retries = retries or MAX_RETRIES
+    client = get_client()
+    part = resume.part_path(filename)
+
+    for attempt in range(1, retries + 1):
+        request_headers, offset = _resume_headers(url, filename, headers)
+        try:
+            with client.stream("GET", url, headers=request_headers) as response:
+                if response.status_code == 416 and offset:
+                    # The partial file no longer fits the resource; start over
+                    resume.discard(filename)
+                    raise httpx.HTTPStatusError("Range not satisfiable", request=response.request, response=response)
+                response.raise_for_status()
+
+                if _resumes_at(response, offset):
+                    logger.info(f"Resuming {url} at byte {offset}")
+                    mode = 'ab'
+                else:
+                    mode = 'wb'
+                    resume.save_state(filename, {
+                        'url': url,
+                        'etag': _strong_etag(response.headers.get('ETag')),
+                        'last_modified': response.headers.get('Last-Modified'),
+                    })
+
+                with open(part, mode) as f:
+                    for chunk in response.iter_raw(chunk_size):
+                        f.write(chunk)
+                        metrics.DOWNLOADED_BYTES.inc(len(chunk))
+            resume.finish(filename)
+            return response
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            retryable = is_retryable(e) or (isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 416)
+            if attempt == retries or not retryable:
+                raise
+            delay = backoff_delay(attempt, _retry_response(e))
+            metrics.RETRIES.inc(operation="download")
+            logger.warning(f"Error downloading {url} (attempt {attempt}): {str(e)}. Retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def _strong_etag(etag):
+    """If-Range only accepts strong validators"""
+    if not etag or etag.startswith('W/'):
+        return None
+    return etag
+
+class RangesNotServed(Exception):
+    """The server answered a byte range request with something other than that range"""
+
+def probe_ranges(url, headers=None):
+    """
+    Ask for the first byte of a URL to learn whether it serves byte ranges
+
+    A one-byte range GET rather than a HEAD: CDNs answer it the way they
+    answer the range requests that follow, and it costs no more.
+
+    Args:
+        url (str): URL to probe
+        headers (dict): Extra request headers (e.g. Referer)
+
+    Returns:
+        tuple: (total size, If-Range validator), or (None, None) without range support
+    """
+    request_headers = dict(headers or {})
+    request_headers['Accept-Encoding'] = 'identity'
+    request_headers['Range'] = 'bytes=0-0'
+    with get_client().stream("GET", url, headers=request_headers) as response:
+        response.raise_for_status()
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        if response.status_code != 206 or not total.isdigit():
+            return None, None
+        validator = _strong_etag(response.headers.get('ETag')) or response.headers.get('Last-Modified')
+        return int(total), validator
+
+def split_ranges(size, parts):
+    """
+    Split size bytes into at most `parts` contiguous ranges
+
+    Returns:
+        list: [first byte, last byte, next byte to fetch] lists
+    """
+    step = -(-size // max(1, parts))
+    return [[start, min(start + step, size) - 1, start] for start in range(0, size, step)]
+
+def download_segmented(url, filename, headers=None, connections=None, min_size=None):
+    """
+    Download a large file over several connections, one byte range each
+
+    Probes the URL first; when it serves ranges and is at least min_size bytes,
+    its ranges are fetched in parallel straight into their place in a
+    preallocated ".part" file with os.pwrite, so nothing needs merging
+    afterwards. Progress of each range is checkpointed in the resume state, so
+    a later call picks up where the ranges stopped. Anything else (no range
+    support, a small file, a linear partial file to resume) is downloaded by
+    download_to_file over a single stream.
+
+    Args:
+        url (str): URL to download
+        filename (str): Destination path
+        headers (dict): Extra request headers (e.g. Referer)
+        connections (int): Parallel ranges (default: LTK_HTTP_SEGMENTS)
+        min_size (int): Smallest file worth splitting (default: LTK_HTTP_SEGMENT_MIN_SIZE)
+
+    Raises:
+        httpx.HTTPStatusError: On a non-retryable error status, or when retries run out
+        httpx.TransportError: When the connection keeps failing
+    """
+    connections = connections or SEGMENT_CONNECTIONS
+    min_size = SEGMENT_MIN_SIZE if min_size is None else min_size
+    state = resume.load_state(filename) or {}
+    linear_resume = state.get('url') == url and 'ranges' not in state and os.path.exists(resume.part_path(filename))
+
+    if connections > 1 and SEGMENTS_SUPPORTED and not linear_resume:
+        try:
+            size, validator = probe_ranges(url, headers)
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            logger.warning(f"Error probing {url} for range support: {str(e)}")
+            size, validator = None, None
+
+        if size and size >= min_size:
+            try:
+                _download_ranges(url, filename, headers, size, validator, connections)
+                return
+            except RangesNotServed as e:
+                logger.warning(f"{str(e)}; downloading {url} over a single connection")
+                resume.discard(filename)
+
+    download_to_file(url, filename, headers=headers)
+
+def _download_ranges(url, filename, headers, size, validator, connections):
+    part = resume.part_path(filename)
+    state = resume.load_state(filename) or {}
+    if (state.get('url') == url and state.get('size') == size and state.get('validator') == validator
+            and state.get('ranges') and os.path.exists(part) and os.path.getsize(part) == size):
+        remaining = sum(last + 1 - offset for _, last, offset in state['ranges'])
+        logger.info(f"Resuming {url} with {remaining} of {size} bytes left")
+    else:
+        state = {'url': url, 'size': size, 'validator': validator, 'ranges': split_ranges(size, connections)}
+        # Preallocate so every range can be written in place
+        with open(part, 'wb') as f:
+            f.truncate(size)
+    resume.save_state(filename, state)
+
+    pending = [segment for segment in state['ranges'] if segment[2] <= segment[1]]
+    logger.info(f"Downloading {url} ({size} bytes) in {len(pending)} ranges")
+    stop = threading.Event()
+    fd = os.open(part, os.O_WRONLY)
+    try:
+        with ThreadPoolExecutor(max_workers=len(pending) or 1, thread_name_prefix="ltk-range") as executor:
+            futures = [
+                executor.submit(_download_range, url, fd, segment, headers, validator, stop)
+                for segment in pending
+            ]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    # Stop the other ranges; their progress is checkpointed below
+                    stop.set()
+                    raise
+                resume.save_state(filename, state)
+    finally:
+        os.close(fd)
+        if stop.is_set():
+            resume.save_state(filename, state)
+    resume.finish(filename)
+
+def _download_range(url, fd, segment, headers, validator, stop, retries=None):
+    """Fetch bytes segment[2]..segment[1] into fd, advancing segment[2] as they are written"""
+    retries = retries or MAX_RETRIES
+    client = get_client()
+    for attempt in range(1, retries + 1):
+        request_headers = dict(headers or {})
+        request_headers['Accept-Encoding'] = 'identity'
+        request_headers['Range'] = f"bytes={segment[2]}-{segment[1]}"
+        if validator:
+            request_headers['If-Range'] = validator
+        try:
+            with client.stream("GET", url, headers=request_headers) as response:
+                response.raise_for_status()
+                if not _resumes_at(response, segment[2]):
+                    raise RangesNotServed(f"Got {response.status_code} for range {segment[2]}-{segment[1]} of {url}")
+                for chunk in response.iter_raw(CHUNK_SIZE):
+                    if stop.is_set():
+                        return
+                    chunk = chunk[:segment[1] + 1 - segment[2]]
+                    os.pwrite(fd, chunk, segment[2])
+                    segment[2] += len(chunk)
+                    metrics.DOWNLOADED_BYTES.inc(len(chunk))
+            if segment[2] <= segment[1]:
+                raise httpx.ReadError(f"Range ended {segment[1] + 1 - segment[2]} bytes early")
+            return
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            if attempt == retries or not is_retryable(e) or stop.is_set():
+                raise
+            delay = backoff_delay(attempt, _retry_response(e))
+            metrics.RETRIES.inc(operation="range")
+            logger.warning(f"Error downloading range of {url} (attempt {attempt}): {str(e)}. Retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+async def get_with_retries(client, url, retries=None):
+    """
+    GET a URL with an async client, retrying transient failures
+
+    Returns:
+        httpx.Response: The successful response, body read
+    """
+    retries = retries or MAX_RETRIES
+    for attempt in range(1, retries + 1):
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+            return response
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, _retry_response(e))
+            metrics.RETRIES.inc(operation="fetch")
+            logger.warning(f"Error fetching {url} (attempt {attempt}): {str(e)}. Retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
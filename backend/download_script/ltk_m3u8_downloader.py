@@ -1,16 +1,38 @@
-import subprocess
 import os
 import platform
 import sys
 
-def check_ffmpeg():
-    """Check if FFmpeg is installed"""
+# Native parallel HLS downloader; without it (or httpx) everything goes through ffmpeg
+try:
+    from . import hls_downloader
+except ImportError:
     try:
-        subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except FileNotFoundError:
-        return False
+        import hls_downloader
+    except ImportError:
+        hls_downloader = None
+
+# Content-addressed media cache and progress events shared with the other download paths
+try:
+    from . import ffmpeg_runner
+    from . import media_cache
+    from . import metrics
+    from . import progress
+    from . import resume
+except ImportError:
+    import ffmpeg_runner
+    import media_cache
+    import metrics
+    import progress
+    import resume
 
+# Set LTK_HLS_NATIVE=0 to always hand the playlist to ffmpeg
+NATIVE_HLS_ENABLED = os.environ.get("LTK_HLS_NATIVE", "1") != "0"
+
+def check_ffmpeg():
+    """Check if FFmpeg is installed (probed once per process)"""
+    return ffmpeg_runner.available()
+
+@metrics.timed("video_download")
 def download_m3u8_to_mp4(m3u8_url, output_file):
     """
     Download an m3u8 stream and convert it to an MP4 file
@@ -22,45 +44,90 @@ def download_m3u8_to_mp4(m3u8_url, output_file):
     Returns:
         bool: True if successful, False otherwise
     """
+    # Make sure the output directory exists
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # A file under its final name is complete (partial downloads live in .part files),
+    # so a retried task keeps the videos it already has
+    if resume.is_complete(output_file):
+        print(f"{output_file} is already downloaded")
+        progress.file_saved(output_file)
+        return True
+    
+    # Reuse a video we've already downloaded from the same stream
+    cache = media_cache.get_cache()
+    # The rendition (and so the bytes) depends on the variant policy
+    policy_tag = hls_downloader.policy_key() if hls_downloader is not None else ''
+    cache_key = media_cache.media_key("hls", m3u8_url) + policy_tag
+    if cache and cache.materialize(cache_key, output_file):
+        print(f"Served {m3u8_url} from media cache")
+        progress.file_saved(output_file)
+        return True
+    
+    # Fetch the segments in parallel and remux them, falling back to ffmpeg's
+    # own (sequential) HLS demuxer for streams the native downloader can't handle.
+    # fMP4 streams are written without ffmpeg, so it is only required past this point.
+    if NATIVE_HLS_ENABLED and hls_downloader is not None:
+        try:
+            print(f"Downloading video from {m3u8_url} to {output_file} with the parallel HLS downloader...")
+            with metrics.span("hls_download", output=os.path.basename(output_file)):
+                hls_downloader.download_hls_sync(m3u8_url, output_file)
+            print(f"Successfully downloaded and converted to {output_file}")
+            print(f"Output file size: {os.path.getsize(output_file) / (1024*1024):.2f} MB")
+            if cache:
+                cache.store(cache_key, output_file)
+            progress.file_saved(output_file)
+            return True
+        except hls_downloader.UnsupportedStream as e:
+            print(f"Parallel HLS download not possible ({e}). Falling back to FFmpeg.")
+        except Exception as e:
+            print(f"Error in parallel HLS download: {e}. Falling back to FFmpeg.")
+    
     # Check if FFmpeg is installed
     if not check_ffmpeg():
         print("Error: FFmpeg is not installed.")
         print_ffmpeg_instructions()
         return False
     
-    # Make sure the output directory exists
-    output_dir = os.path.dirname(output_file)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # Construct the FFmpeg command
-    command = [
-        'ffmpeg',
+    # Construct the FFmpeg arguments; it writes to the partial file, which is
+    # moved into place (replacing, never writing through, a cache hardlink) on success
+    args = [
+        '-y',  # Overwrite a partial file left by an earlier attempt
         '-i', m3u8_url,
         '-c', 'copy',  # Copy the stream without re-encoding (much faster)
         '-bsf:a', 'aac_adtstoasc',  # Fix for AAC audio streams
-        '-loglevel', 'warning',  # Reduce log output
-        output_file
+        '-f', 'mp4',
+        resume.part_path(output_file)
     ]
     
+    # Left alone, ffmpeg takes the highest rendition; map the one the variant policy picks
+    program = hls_downloader.variant_program(m3u8_url) if policy_tag else None
+    if program is not None:
+        args[3:3] = ['-map', f'0:p:{program}']
+    
     print(f"Downloading video from {m3u8_url} to {output_file}...")
     
-    # Run FFmpeg
+    # ffmpeg reuses the output's partial file, so drop the native downloader's checkpoint for it
+    resume.discard(output_file)
+    
+    # Run FFmpeg (capped, with progress events, killed if it hangs)
     try:
-        result = subprocess.run(
-            command,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        ffmpeg_runner.run(args, label=os.path.basename(output_file))
         
-        if result.returncode == 0:
-            print(f"Successfully downloaded and converted to {output_file}")
-            print(f"Output file size: {os.path.getsize(output_file) / (1024*1024):.2f} MB")
-            return True
-        else:
-            print(f"FFmpeg error: {result.stderr}")
-            return False
-            
+        resume.finish(output_file)
+        # The native downloader's checkpoints are of no use any more
+        resume.discard(f"{output_file}.ts")
+        print(f"Successfully downloaded and converted to {output_file}")
+        print(f"Output file size: {os.path.getsize(output_file) / (1024*1024):.2f} MB")
+        if cache:
+            cache.store(cache_key, output_file)
+        progress.file_saved(output_file)
+        return True
+    except ffmpeg_runner.FFmpegError as e:
+        print(f"FFmpeg error: {e}")
+        return False
     except Exception as e:
         print(f"Error running FFmpeg: {e}")
         return False
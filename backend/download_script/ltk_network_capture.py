@@ -1,23 +1,29 @@
 import json
-import time
 import re
-import os
+import time
 import signal
 import logging
-import tempfile
-import uuid
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
+import threading
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Import the shared Chrome driver pool and adaptive waits
+try:
+    from . import blob_transfer
+    from . import cdp_capture
+    from . import driver_pool
+    from . import metrics
+    from . import page_waits
+except ImportError:
+    import blob_transfer
+    import cdp_capture
+    import driver_pool
+    import metrics
+    import page_waits
+
 # Set a timeout for the entire function
 class TimeoutError(Exception):
     pass
@@ -25,6 +31,213 @@ class TimeoutError(Exception):
 def timeout_handler(signum, frame):
     raise TimeoutError("Network capture timed out")
 
+def play_videos(driver):
+    """
+    Start playback of every video on the current page so the player requests its stream
+    
+    Args:
+        driver: Selenium WebDriver instance
+    """
+    video_elements = driver.find_elements(By.TAG_NAME, "video")
+    if video_elements:
+        print(f"Network capture: Found {len(video_elements)} video elements. Trying to play...")
+        logger.info(f"Found {len(video_elements)} video elements. Trying to play...")
+        for video in video_elements:
+            try:
+                driver.execute_script("arguments[0].play();", video)
+                # Skip forward a bit to trigger video loading
+                driver.execute_script("arguments[0].currentTime = 2;", video)
+                logger.info("Successfully played video")
+            except Exception as e:
+                print("Network capture: Error playing video, continuing...")
+                logger.warning(f"Error playing video: {str(e)}, continuing...")
+    
+    # Also try clicking play buttons if videos didn't autoplay
+    try:
+        play_buttons = driver.find_elements(
+            By.CSS_SELECTOR, 
+            "[class*='play'], [id*='play'], button[class*='video']"
+        )
+        if play_buttons:
+            print(f"Network capture: Found {len(play_buttons)} play buttons. Trying to click...")
+            for button in play_buttons:
+                try:
+                    button.click()
+                    print("Network capture: Clicked play button")
+                    break
+                except:
+                    try:
+                        driver.execute_script("arguments[0].click();", button)
+                        print("Network capture: Clicked play button with JavaScript")
+                        break
+                    except:
+                        continue
+    except:
+        pass
+
+def parse_m3u8_urls(logs):
+    """
+    Find M3U8 request URLs in Chrome performance log entries
+    
+    Args:
+        logs (list): Entries returned by driver.get_log('performance')
+        
+    Returns:
+        tuple: (m3u8_urls, mux_urls), each a list in request order without duplicates
+    """
+    m3u8_urls = []
+    mux_urls = []
+    
+    for entry in logs:
+        try:
+            log_data = json.loads(entry["message"])["message"]
+            
+            # Check if this is a network request
+            if "Network.requestWillBeSent" in log_data["method"]:
+                request_data = log_data["params"]
+                url = request_data.get("request", {}).get("url", "")
+                
+                # Look for M3U8 URLs
+                if url and '.m3u8' in url and url not in m3u8_urls:
+                    m3u8_urls.append(url)
+                    
+                    # Specifically check for Mux URLs
+                    if 'stream.mux.com' in url:
+                        mux_urls.append(url)
+        except Exception as e:
+            logger.warning(f"Error processing log entry: {str(e)}")
+            continue
+    
+    return m3u8_urls, mux_urls
+
+def has_m3u8_request(logs):
+    """Whether performance log entries include a playlist request (ends a network wait)"""
+    return bool(parse_m3u8_urls(logs)[0])
+
+def drain_performance_log(driver):
+    """Drop the performance log entries read so far (Chrome only keeps one without CDP capture)"""
+    if cdp_capture.PERFORMANCE_LOG_ENABLED:
+        driver.get_log('performance')
+
+def requested_playlist_urls(driver):
+    """
+    Playlist requests the current tab has made so far
+
+    Read from the performance log when Chrome keeps one, otherwise from the
+    page's resource timing entries.
+
+    Returns:
+        tuple: (m3u8_urls, mux_urls)
+    """
+    if cdp_capture.PERFORMANCE_LOG_ENABLED:
+        return parse_m3u8_urls(driver.get_log('performance'))
+    m3u8_urls = blob_transfer.media_source_urls(driver)
+    return m3u8_urls, [url for url in m3u8_urls if 'stream.mux.com' in url]
+
+def start_request_capture(driver):
+    """
+    Start streaming the current tab's playlist requests over the DevTools Protocol
+
+    Returns:
+        RequestCapture: The running capture, or None when CDP capture is disabled or
+        unavailable (callers then read the performance log instead)
+    """
+    if not cdp_capture.CDP_CAPTURE_ENABLED:
+        return None
+    capture = cdp_capture.RequestCapture(driver, marker=".m3u8")
+    return capture if capture.start() else None
+
+def wait_for_playlist_urls(driver, capture, wait):
+    """
+    Wait (at most `wait` seconds) for the player to request its playlist
+    
+    With a CDP capture this returns as soon as the first playlist request is
+    sent. Otherwise, or if the capture saw nothing (e.g. the request was made
+    before it attached), the requests already made are read instead (see
+    requested_playlist_urls).
+    
+    Returns:
+        tuple: (m3u8_urls, mux_urls)
+    """
+    if capture is not None:
+        capture.wait_for_url(wait)
+        m3u8_urls = []
+        for url in capture.urls():
+            if url not in m3u8_urls:
+                m3u8_urls.append(url)
+        if m3u8_urls:
+            return m3u8_urls, [url for url in m3u8_urls if 'stream.mux.com' in url]
+        return requested_playlist_urls(driver)
+    
+    if cdp_capture.PERFORMANCE_LOG_ENABLED:
+        logs = page_waits.wait_for_network(driver, wait, until=has_m3u8_request)
+        return parse_m3u8_urls(logs)
+    
+    # CDP capture is on but could not attach to this tab: poll its resource timing
+    deadline = time.monotonic() + wait
+    while True:
+        m3u8_urls, mux_urls = requested_playlist_urls(driver)
+        if m3u8_urls or time.monotonic() >= deadline:
+            return m3u8_urls, mux_urls
+        time.sleep(page_waits.POLL_INTERVAL)
+
+@metrics.timed("m3u8_capture")
+def capture_video_urls_in_session(driver, post_url=None, wait=5, skip=0):
+    """
+    Capture video URLs using a browser session that is already open
+    
+    Instead of launching a separate Chrome, this listens to the requests of the
+    given driver's tab over CDP (or reads its performance log). With post_url, the post is opened in a new tab which is
+    left open and focused so the caller can fall back to direct download
+    methods on it; the caller is responsible for closing it. Without post_url,
+    the current tab is used.
+    
+    Args:
+        driver: Selenium WebDriver instance (from the pool)
+        post_url (str): URL of the post to open in a new tab (default: use current tab)
+        wait (int): Maximum seconds to wait for the player to request its stream
+        skip (int): Number of URLs to skip from the beginning
+        
+    Returns:
+        list: A list of found M3U8 URLs, empty if none found
+    """
+    if post_url:
+        # Drain the log so requests made by the feed page don't leak into this post
+        drain_performance_log(driver)
+        print(f"Network capture: Opening post in a new tab: {post_url}")
+        # Open a blank tab first so the capture is attached before the post loads
+        driver_pool.open_tab(driver)
+    
+    capture = start_request_capture(driver)
+    try:
+        if post_url:
+            driver.get(post_url)
+        
+        if not page_waits.wait_for_element(driver, "video", wait):
+            logger.warning("Video element not found, continuing anyway")
+        
+        play_videos(driver)
+        
+        # Wait for the player to request its playlist (or for the network to go idle)
+        m3u8_urls, mux_urls = wait_for_playlist_urls(driver, capture, wait)
+    finally:
+        if capture is not None:
+            capture.stop()
+    
+    # Fall back to the page source if the player didn't request a playlist
+    if not m3u8_urls:
+        for url in re.findall(r'(https?://[^"\']+\.m3u8)', driver.page_source):
+            if url not in m3u8_urls:
+                m3u8_urls.append(url)
+                if 'stream.mux.com' in url:
+                    mux_urls.append(url)
+    
+    # Return Mux URLs first if we found any
+    urls = mux_urls or m3u8_urls
+    print(f"Network capture: Found {len(urls)} M3U8 URLs in session")
+    return urls[skip:] if skip < len(urls) else []
+
+@metrics.timed("m3u8_capture")
 def capture_video_urls(video_page_url, timeout=30, skip=0):
     """
     Capture video URLs from a LikeToKnowIt video page
@@ -37,71 +250,24 @@ def capture_video_urls(video_page_url, timeout=30, skip=0):
     Returns:
         list: A list of found M3U8 URLs, empty if none found
     """
-    # Set up timeout
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(timeout)
+    # Set up timeout (signals can only be installed from the main thread; on
+    # scheduler worker threads the driver's own timeouts have to do)
+    use_alarm = threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        signal.signal(signal.SIGALRM, timeout_handler)
+        signal.alarm(timeout)
     
     driver = None
-    temp_dir = None
+    driver_failed = False
+    capture = None
+    pool = driver_pool.get_pool()
     
     try:
-        # Create a unique temporary directory for Chrome user data
-        temp_dir = tempfile.mkdtemp(prefix="chrome_user_data_")
-        logger.info(f"Created temporary user data directory: {temp_dir}")
-        
-        # Make sure the directory has the right permissions
-        os.chmod(temp_dir, 0o755)
-        
-        # Configure Chrome with network logging enabled
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")  # Run headless for reliability
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_argument("--autoplay-policy=no-user-gesture-required")  # Allow autoplay
-        
-        # Add these arguments to fix the "DevToolsActivePort file doesn't exist" error
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument(f"--remote-debugging-port={9222 + os.getpid() % 1000}")  # Use a dynamic port
-        
-        # Add a unique user data directory
-        chrome_options.add_argument(f"--user-data-dir={temp_dir}")
-        chrome_options.add_argument("--disable-extensions")
-        chrome_options.add_argument("--disable-plugins")
-        chrome_options.add_argument("--incognito")
+        # Borrow a warm Chrome driver from the shared pool
+        driver = pool.acquire()
         
-        # Set log preferences for network monitoring
-        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-        
-        logger.info(f"Starting Chrome with options: {chrome_options.arguments}")
-        
-        try:
-            # Check if chromedriver is in PATH
-            chrome_path = os.environ.get('CHROME_PATH', None)
-            chromedriver_path = os.environ.get('CHROMEDRIVER_PATH', None)
-            
-            if chrome_path:
-                logger.info(f"Using Chrome binary from: {chrome_path}")
-                chrome_options.binary_location = chrome_path
-            
-            if chromedriver_path:
-                logger.info(f"Using ChromeDriver from: {chromedriver_path}")
-                service = Service(executable_path=chromedriver_path)
-                driver = webdriver.Chrome(service=service, options=chrome_options)
-                logger.info("Chrome driver initialized with explicit service path")
-            else:
-                driver = webdriver.Chrome(options=chrome_options)
-                logger.info("Chrome driver initialized successfully")
-        except WebDriverException as e:
-            logger.error(f"Failed to initialize Chrome driver: {str(e)}")
-            # Try with service object explicitly
-            try:
-                service = Service()
-                driver = webdriver.Chrome(service=service, options=chrome_options)
-                logger.info("Chrome driver initialized with explicit service")
-            except Exception as e2:
-                logger.error(f"Second attempt to initialize Chrome driver failed: {str(e2)}")
-                raise
+        # Listen for playlist requests before the page starts loading
+        capture = start_request_capture(driver)
         
         # Navigate to the video page
         print(f"Network capture: Opening URL: {video_page_url}")
@@ -111,84 +277,19 @@ def capture_video_urls(video_page_url, timeout=30, skip=0):
         # Wait for video element to load with a shorter timeout
         print("Network capture: Waiting for video element...")
         logger.info("Waiting for video element...")
-        try:
-            WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.TAG_NAME, "video"))
-            )
+        if page_waits.wait_for_element(driver, "video", 5):
             print("Network capture: Video element found")
             logger.info("Video element found")
-        except TimeoutException:
+        else:
             print("Network capture: Video element not found, continuing anyway")
             logger.warning("Video element not found, continuing anyway")
         
-        # Try to play the video
-        video_elements = driver.find_elements(By.TAG_NAME, "video")
-        if video_elements:
-            print(f"Network capture: Found {len(video_elements)} video elements. Trying to play...")
-            logger.info(f"Found {len(video_elements)} video elements. Trying to play...")
-            for video in video_elements:
-                try:
-                    driver.execute_script("arguments[0].play();", video)
-                    # Skip forward a bit to trigger video loading
-                    driver.execute_script("arguments[0].currentTime = 2;", video)
-                    logger.info("Successfully played video")
-                except Exception as e:
-                    print("Network capture: Error playing video, continuing...")
-                    logger.warning(f"Error playing video: {str(e)}, continuing...")
-        
-        # Also try clicking play buttons if videos didn't autoplay
-        try:
-            play_buttons = driver.find_elements(
-                By.CSS_SELECTOR, 
-                "[class*='play'], [id*='play'], button[class*='video']"
-            )
-            if play_buttons:
-                print(f"Network capture: Found {len(play_buttons)} play buttons. Trying to click...")
-                for button in play_buttons:
-                    try:
-                        button.click()
-                        print("Network capture: Clicked play button")
-                        break
-                    except:
-                        try:
-                            driver.execute_script("arguments[0].click();", button)
-                            print("Network capture: Clicked play button with JavaScript")
-                            break
-                        except:
-                            continue
-        except:
-            pass
-        
-        # Wait for video to load and generate network requests (shorter wait time)
-        print("Network capture: Waiting for video to load (5 seconds)...")
-        time.sleep(5)
-        
-        # Get browser logs
-        logs = driver.get_log('performance')
-        
-        # Find M3U8 URLs in network requests
-        m3u8_urls = []
-        mux_urls = []
+        # Try to play the video (and click play buttons if it didn't autoplay)
+        play_videos(driver)
         
-        # Process network logs to find M3U8 URLs
-        for entry in logs:
-            try:
-                log_data = json.loads(entry["message"])["message"]
-                
-                # Check if this is a network request
-                if "Network.requestWillBeSent" in log_data["method"]:
-                    request_data = log_data["params"]
-                    url = request_data.get("request", {}).get("url", "")
-                    
-                    # Look for M3U8 URLs
-                    if url and '.m3u8' in url:
-                        m3u8_urls.append(url)
-                        
-                        # Specifically check for Mux URLs
-                        if 'stream.mux.com' in url:
-                            mux_urls.append(url)
-            except:
-                pass
+        # Wait (at most 5 seconds) for the player to request its playlist
+        print("Network capture: Waiting for video to load...")
+        m3u8_urls, mux_urls = wait_for_playlist_urls(driver, capture, 5)
         
         # If no Mux URLs found but we have other M3U8 URLs, that's fine
         if not mux_urls and m3u8_urls:
@@ -263,42 +364,39 @@ def capture_video_urls(video_page_url, timeout=30, skip=0):
                         
                         if post_url:
                             print(f"Network capture: Found post URL: {post_url}")
-                            # Open the post in a new tab
-                            driver.execute_script("window.open(arguments[0]);", post_url)
-                            # Switch to the new tab
-                            driver.switch_to.window(driver.window_handles[-1])
-                            # Wait for the page to load
-                            time.sleep(3)
-                            
-                            # Look for video elements
-                            video_elements = driver.find_elements(By.TAG_NAME, "video")
-                            if video_elements:
-                                print(f"Network capture: Found {len(video_elements)} video elements in post")
-                                for video in video_elements:
-                                    try:
-                                        driver.execute_script("arguments[0].play();", video)
-                                    except:
-                                        pass
-                            
-                            # Wait for video to load
-                            time.sleep(2)
+                            # Drain the log so only this post's requests are read below
+                            drain_performance_log(driver)
+                            # Open a blank tab and attach a capture to it before the post loads
+                            driver_pool.open_tab(driver)
+                            post_capture = start_request_capture(driver)
+                            try:
+                                driver.get(post_url)
+                                # Wait (at most 3 seconds) for the player to render
+                                page_waits.wait_for_element(driver, "video", 3)
+                                
+                                # Look for video elements
+                                video_elements = driver.find_elements(By.TAG_NAME, "video")
+                                if video_elements:
+                                    print(f"Network capture: Found {len(video_elements)} video elements in post")
+                                    for video in video_elements:
+                                        try:
+                                            driver.execute_script("arguments[0].play();", video)
+                                        except:
+                                            pass
+                                
+                                # Wait (at most 2 seconds) for the playlist request
+                                post_m3u8_urls, _ = wait_for_playlist_urls(driver, post_capture, 2)
+                            finally:
+                                if post_capture is not None:
+                                    post_capture.stop()
                             
                             # Check for m3u8 URLs in this post
-                            post_logs = driver.get_log('performance')
-                            for entry in post_logs:
-                                try:
-                                    log_data = json.loads(entry["message"])["message"]
-                                    if "Network.requestWillBeSent" in log_data["method"]:
-                                        request_data = log_data["params"]
-                                        url = request_data.get("request", {}).get("url", "")
-                                        if url and '.m3u8' in url:
-                                            if url not in m3u8_urls:
-                                                m3u8_urls.append(url)
-                                                print(f"Network capture: Found new M3U8 URL in post: {url}")
-                                                if 'stream.mux.com' in url:
-                                                    mux_urls.append(url)
-                                except:
-                                    pass
+                            for url in post_m3u8_urls:
+                                if url not in m3u8_urls:
+                                    m3u8_urls.append(url)
+                                    print(f"Network capture: Found new M3U8 URL in post: {url}")
+                                    if 'stream.mux.com' in url:
+                                        mux_urls.append(url)
                             
                             # Close the tab and switch back to the main tab
                             driver.close()
@@ -343,26 +441,17 @@ def capture_video_urls(video_page_url, timeout=30, skip=0):
     except Exception as e:
         print(f"Network capture: Error during network capture: {e}")
         logger.error(f"Error during network capture: {str(e)}")
+        driver_failed = True
         return []
     finally:
         # Clean up
-        signal.alarm(0)  # Cancel the alarm
+        if use_alarm:
+            signal.alarm(0)  # Cancel the alarm
+        if capture is not None:
+            capture.stop()
         if driver:
-            try:
-                driver.quit()
-                logger.info("Chrome driver closed successfully")
-            except Exception as e:
-                print(f"Network capture: Error closing driver: {e}")
-                logger.error(f"Error closing driver: {str(e)}")
-        
-        # Clean up the temporary user data directory
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                import shutil
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                logger.info(f"Removed temporary user data directory: {temp_dir}")
-            except Exception as e:
-                logger.error(f"Error removing temporary directory {temp_dir}: {str(e)}")
+            # Hand the driver back; the pool closes extra tabs and clears cookies
+            pool.release(driver, discard=driver_failed)
 
 def extract_m3u8_urls_from_logs(driver, skip=0):
     """
@@ -376,33 +465,8 @@ def extract_m3u8_urls_from_logs(driver, skip=0):
         list: A list of found M3U8 URLs
     """
     try:
-        # Get browser logs
-        logs = driver.get_log('performance')
-        
-        # Find M3U8 URLs in network requests
-        m3u8_urls = []
-        mux_urls = []
-        
-        # Process network logs to find M3U8 URLs
-        for entry in logs:
-            try:
-                log_data = json.loads(entry["message"])["message"]
-                
-                # Check if this is a network request
-                if "Network.requestWillBeSent" in log_data["method"]:
-                    request_data = log_data["params"]
-                    url = request_data.get("request", {}).get("url", "")
-                    
-                    # Look for M3U8 URLs
-                    if url and '.m3u8' in url:
-                        m3u8_urls.append(url)
-                        
-                        # Specifically check for Mux URLs
-                        if 'stream.mux.com' in url:
-                            mux_urls.append(url)
-            except Exception as e:
-                logger.warning(f"Error processing log entry: {str(e)}")
-                continue
+        # Get browser logs and find M3U8 URLs in network requests
+        m3u8_urls, mux_urls = requested_playlist_urls(driver)
         
         # If we found Mux URLs, prioritize those
         if mux_urls:
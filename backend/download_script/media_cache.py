@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import sqlite3
+import logging
+import tempfile
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Persistent disk declared in render.yaml; fall back to the temp dir elsewhere
+RENDER_STORAGE_DIR = "/app/download_storage"
+
+# Cache configuration (overridable through the environment)
+CACHE_ENABLED = os.environ.get("LTK_MEDIA_CACHE", "1") != "0"
+DEFAULT_CACHE_ROOT = os.environ.get("LTK_MEDIA_CACHE_DIR") or (
+    os.path.join(RENDER_STORAGE_DIR, "media_cache") if os.path.isdir(RENDER_STORAGE_DIR)
+    else os.path.join(tempfile.gettempdir(), "ltk_media_cache")
+)
+DEFAULT_MAX_BYTES = int(os.environ.get("LTK_MEDIA_CACHE_MAX_MB", "5120")) * 1024 * 1024
+
+# Linux ioctl for copy-on-write clones (btrfs, XFS with reflink=1, ...)
+FICLONE = 0x40049409
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def media_key(kind, url):
+    """
+    Build the cache key for a media URL
+
+    Fragments are dropped, and so are the query strings of Mux playlists: they
+    carry per-view tokens, while the playback id in the path identifies the video.
+
+    Args:
+        kind (str): Namespace such as "image", "video", "hls" or "post"
+        url (str): Source URL
+
+    Returns:
+        str: Cache key
+    """
+    parts = urlsplit(url)
+    query = '' if parts.netloc == 'stream.mux.com' else parts.query
+    return f"{kind}:{urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))}"
+
+def file_digest(path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_or_copy(source, dest):
+    """
+    Make dest a copy of source as cheaply as the filesystem allows
+
+    Tries a hardlink, then a reflink (copy-on-write clone), then a plain copy.
+    An existing dest is replaced, never written through, so a hardlinked cache
+    object can't be modified by accident.
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+
+    try:
+        os.link(source, dest)
+        return "hardlink"
+    except OSError:
+        pass
+
+    try:
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return "reflink"
+    except OSError:
+        if os.path.exists(dest):
+            os.remove(dest)
+
+    shutil.copyfile(source, dest)
+    return "copy"
+
+class MediaCache:
+    """
+    Content-addressed, size-bounded on-disk cache of downloaded media
+
+    Files are stored once under objects/<aa>/<sha256>. An SQLite index maps
+    keys (see media_key) to digests, post keys to the ordered list of
+    digests the post produced, and profile keys to the posts last scraped
+    from the profile's feed. When the total size exceeds max_bytes, the
+    least recently used objects are evicted.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or DEFAULT_CACHE_ROOT
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+        self.objects_dir = os.path.join(self.root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                " digest TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS objects_last_access ON objects (last_access)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, digest TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS manifests ("
+                " key TEXT PRIMARY KEY, digests TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS profiles ("
+                " key TEXT PRIMARY KEY, posts TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+        logger.info(f"Using media cache at {self.root} (max {self.max_bytes / (1024*1024):.0f} MB)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _touch(self, digest):
+        self._connection().execute(
+            "UPDATE objects SET last_access = ? WHERE digest = ?", (time.time(), digest)
+        )
+
+    def lookup(self, key):
+        """
+        Find the stored file for a key
+
+        Returns:
+            str: Path of the cached object, or None on a miss
+        """
+        row = self._connection().execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        path = self.object_path(row[0])
+        if not os.path.exists(path):
+            # Evicted (or removed by hand) since the entry was written
+            self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+
+        self._touch(row[0])
+        return path
+
+    def materialize(self, key, dest):
+        """
+        Place the cached file for key at dest
+
+        Returns:
+            bool: True on a cache hit
+        """
+        path = self.lookup(key)
+        if path is None:
+            return False
+        try:
+            method = link_or_copy(path, dest)
+        except OSError as e:
+            logger.warning(f"Error materializing cached {key}: {e}")
+            return False
+        logger.info(f"Media cache hit for {key} ({method})")
+        return True
+
+    def _store_object(self, path):
+        """Copy a file into the object store and return its digest"""
+        digest = file_digest(path)
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # Link into a temporary name first so a concurrent reader never sees a partial object
+            staging = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            link_or_copy(path, staging)
+            os.replace(staging, object_path)
+
+        self._connection().execute(
+            "INSERT OR REPLACE INTO objects (digest, size, last_access) VALUES (?, ?, ?)",
+            (digest, os.path.getsize(object_path), time.time())
+        )
+        return digest
+
+    def store(self, key, path):
+        """
+        Add a downloaded file to the cache under key
+
+        Returns:
+            str: The file's digest, or None if it couldn't be stored
+        """
+        try:
+            digest = self._store_object(path)
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries (key, digest, created_at) VALUES (?, ?, ?)",
+                (key, digest, time.time())
+            )
+        except OSError as e:
+            logger.warning(f"Error storing {key} in media cache: {e}")
+            return None
+
+        self.evict()
+        return digest
+
+    def store_manifest(self, key, paths):
+        """
+        Record the files a post produced, in order
+
+        Args:
+            key (str): Post key
+            paths (list): Downloaded files
+        """
+        try:
+            digests = [self._store_object(path) for path in paths]
+            self._connection().execute(
+                "INSERT OR REPLACE INTO manifests (key, digests, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(digests), time.time())
+            )
+        except OSError as e:
+            logger.warning(f"Error storing {key} in media cache: {e}")
+            return
+
+        self.evict()
+
+    def materialize_manifest(self, key, dest_paths_for):
+        """
+        Materialize every file recorded for a post
+
+        Args:
+            key (str): Post key
+            dest_paths_for (callable): Given the number of files, returns their destination paths
+
+        Returns:
+            list: Materialized paths, empty on a miss (or if any object was evicted)
+        """
+        row = self._connection().execute("SELECT digests FROM manifests WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return []
+
+        digests = json.loads(row[0])
+        if not digests or not all(os.path.exists(self.object_path(d)) for d in digests):
+            return []
+
+        dest_paths = dest_paths_for(len(digests))
+        try:
+            for digest, dest in zip(digests, dest_paths):
+                link_or_copy(self.object_path(digest), dest)
+                self._touch(digest)
+        except OSError as e:
+            logger.warning(f"Error materializing cached {key}: {e}")
+            return []
+
+        logger.info(f"Media cache hit for {key} ({len(dest_paths)} files)")
+        return dest_paths
+
+    def load_profile(self, key):
+        """
+        Read the posts last scraped from a profile's feed
+
+        Returns:
+            tuple: (posts in feed order, time they were stored), or ([], None) on a miss
+        """
+        row = self._connection().execute(
+            "SELECT posts, updated_at FROM profiles WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return [], None
+        return json.loads(row[0]), row[1]
+
+    def store_profile(self, key, posts):
+        """
+        Replace the posts recorded for a profile's feed
+
+        Args:
+            key (str): Profile key
+            posts (list): JSON-serialisable post dicts in feed order
+        """
+        self._connection().execute(
+            "INSERT OR REPLACE INTO profiles (key, posts, updated_at) VALUES (?, ?, ?)",
+            (key, json.dumps(posts), time.time())
+        )
+
+    def total_size(self):
+        row = self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()
+        return row[0]
+
+    def evict(self):
+        """Drop least recently used objects until the cache fits in max_bytes"""
+        with self._evict_lock:
+            total = self.total_size()
+            if total <= self.max_bytes:
+                return
+
+            conn = self._connection()
+            for digest, size in conn.execute("SELECT digest, size FROM objects ORDER BY last_access").fetchall():
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self.object_path(digest))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+                conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+                total -= size
+                logger.info(f"Evicted {digest} ({size} bytes) from media cache")
+
+# Process-wide cache shared by all downloads
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Return the process-wide media cache
+
+    Returns:
+        MediaCache: The cache, or None when it is disabled or can't be created
+    """
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = MediaCache()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Media cache disabled: {e}")
+                return None
+        return _cache
@@ -0,0 +1,190 @@
+import math
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Metrics live in process memory: with several uvicorn workers each one exposes
+# its own, and Prometheus aggregates them across scrape targets.
+
+# Stage durations run from fractions of a second (image fetches) to minutes (long ffmpeg remuxes)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        """(name suffix, label values, extra labels, value) tuples for the exposition"""
+        with self._lock:
+            return [("", key, (), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally per label set"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Value that goes up and down; either set directly or read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Report function() (unlabelled gauges only) whenever metrics are rendered"""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                return [("", (), (), self._function())]
+            except Exception as e:
+                logger.warning(f"Error reading gauge {self.name}: {str(e)}")
+                return []
+        return super().samples()
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, with their sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                samples.append(("_bucket", key, (("le", _format_value(bound if bound == math.inf else float(bound))),), count))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), counts[-1]))
+        return samples
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4)
+
+    Returns:
+        str: The exposition, newline-terminated
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+STAGE_SECONDS = Histogram(
+    "ltk_stage_duration_seconds", "Time spent in each pipeline stage", labels=("stage",)
+)
+STAGE_FAILURES = Counter(
+    "ltk_stage_failures_total", "Pipeline stages that ended with an exception", labels=("stage",)
+)
+DOWNLOADED_BYTES = Counter("ltk_downloaded_bytes_total", "Bytes of media received over HTTP")
+SAVED_BYTES = Counter("ltk_saved_bytes_total", "Bytes of media files saved to task directories (cache hits included)")
+ITEMS = Counter("ltk_items_total", "Posts processed, by type and outcome", labels=("kind", "outcome"))
+RETRIES = Counter("ltk_http_retries_total", "HTTP requests retried after a transient failure", labels=("operation",))
+TASKS = Counter("ltk_tasks_total", "Download tasks finished, by final status", labels=("status",))
+CHROME_INSTANCES = Gauge("ltk_chrome_instances", "Chrome drivers in the pool (idle and leased)")
+QUEUE_DEPTH = Gauge("ltk_queue_depth", "Download jobs waiting for a worker")
+RUNNING_JOBS = Gauge("ltk_running_jobs", "Download jobs being worked on")
+FFMPEG_PROCESSES = Gauge("ltk_ffmpeg_processes", "ffmpeg children running")
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Time a pipeline stage into ltk_stage_duration_seconds and log it as one structured line
+
+    Args:
+        stage (str): Stage name (the histogram's label)
+        **fields: Extra key=value context for the log line (e.g. the URL)
+    """
+    start = time.monotonic()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.monotonic() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        context = "".join(f" {key}={value}" for key, value in fields.items())
+        logger.info(f"span stage={stage} seconds={elapsed:.3f} outcome={outcome}{context}")
+
+def timed(stage):
+    """Decorator running every call of a function as a span"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def timed_iter(iterable, stage, **fields):
+    """Yield from iterable, timing the whole iteration (e.g. a streamed response) as a span"""
+    with span(stage, **fields):
+        yield from iterable
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import logging
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Wait tuning (overridable through the environment). The timeouts callers pass are
+# upper bounds; these decide how soon a wait may return before reaching them.
+POLL_INTERVAL = float(os.environ.get("LTK_WAIT_POLL", "0.2"))
+SETTLE_TIME = float(os.environ.get("LTK_WAIT_SETTLE", "1.0"))
+NETWORK_IDLE_TIME = float(os.environ.get("LTK_NETWORK_IDLE", "1.5"))
+# Like "networkidle2": a couple of long-lived requests (analytics, sockets) don't count
+NETWORK_IDLE_CONNECTIONS = 2
+
+def wait_for_element(driver, selector, timeout):
+    """
+    Wait until an element matching a CSS selector is present
+
+    Args:
+        driver: Selenium WebDriver instance
+        selector (str): CSS selector
+        timeout (float): Maximum seconds to wait
+
+    Returns:
+        bool: True if the element appeared, False on timeout
+    """
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=POLL_INTERVAL).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, selector))
+        )
+        return True
+    except TimeoutException:
+        return False
+
+def wait_for_stable_count(driver, selector, timeout, settle=None):
+    """
+    Wait until elements matching a selector have appeared and stopped multiplying
+
+    Feeds render their cards in batches, so returning on the first card would
+    miss the rest; this returns once the count has been non-zero and unchanged
+    for `settle` seconds.
+
+    Args:
+        driver: Selenium WebDriver instance
+        selector (str): CSS selector
+        timeout (float): Maximum seconds to wait
+        settle (float): Seconds the count must stay unchanged (default: LTK_WAIT_SETTLE)
+
+    Returns:
+        int: Number of matching elements when the wait ended
+    """
+    settle = SETTLE_TIME if settle is None else settle
+    start = time.monotonic()
+    deadline = start + timeout
+    count = 0
+    changed_at = start
+
+    while True:
+        current = len(driver.find_elements(By.CSS_SELECTOR, selector))
+        now = time.monotonic()
+        if current != count:
+            count = current
+            changed_at = now
+        elif count and now - changed_at >= settle:
+            logger.info(f"{count} elements matching {selector} after {now - start:.1f}s")
+            return count
+
+        if now >= deadline:
+            logger.info(f"{count} elements matching {selector} after waiting the full {timeout}s")
+            return count
+        time.sleep(min(POLL_INTERVAL, deadline - now))
+
+def wait_for_count_above(driver, selector, count, timeout):
+    """
+    Wait until more than `count` elements match a selector (e.g. after scrolling a feed)
+
+    Args:
+        driver: Selenium WebDriver instance
+        selector (str): CSS selector
+        count (int): Number of elements already seen
+        timeout (float): Maximum seconds to wait
+
+    Returns:
+        int: Number of matching elements when the wait ended
+    """
+    script = "return document.querySelectorAll(arguments[0]).length;"
+    deadline = time.monotonic() + timeout
+    while True:
+        current = driver.execute_script(script, selector)
+        now = time.monotonic()
+        if current > count or now >= deadline:
+            return current
+        time.sleep(min(POLL_INTERVAL, deadline - now))
+
+def wait_for_network(driver, timeout, until=None, idle_time=None):
+    """
+    Read the Chrome performance log until a condition holds or the network goes idle
+
+    The log is drained by reading it, so every entry read is returned for the
+    caller to parse.
+
+    Args:
+        driver: Selenium WebDriver instance with performance logging enabled
+        timeout (float): Maximum seconds to wait
+        until (callable): Called with each new batch of log entries; the wait ends when it returns True
+        idle_time (float): Seconds without network activity (and with at most
+            NETWORK_IDLE_CONNECTIONS requests in flight) that count as idle (default: LTK_NETWORK_IDLE)
+
+    Returns:
+        list: The performance log entries read
+    """
+    idle_time = NETWORK_IDLE_TIME if idle_time is None else idle_time
+    start = time.monotonic()
+    deadline = start + timeout
+    last_activity = start
+    in_flight = set()
+    entries = []
+
+    while True:
+        batch = driver.get_log('performance')
+        now = time.monotonic()
+        if batch:
+            entries.extend(batch)
+            if _track_requests(batch, in_flight):
+                last_activity = now
+            if until is not None and until(batch):
+                logger.info(f"Network condition met after {now - start:.1f}s")
+                return entries
+
+        if len(in_flight) <= NETWORK_IDLE_CONNECTIONS and now - last_activity >= idle_time:
+            logger.info(f"Network idle after {now - start:.1f}s")
+            return entries
+        if now >= deadline:
+            return entries
+        time.sleep(min(POLL_INTERVAL, deadline - now))
+
+def _track_requests(batch, in_flight):
+    """Update the set of in-flight request ids; returns True if the batch had network events"""
+    active = False
+    for entry in batch:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        method = message.get("method", "")
+        if not method.startswith("Network."):
+            continue
+        active = True
+        request_id = message.get("params", {}).get("requestId")
+        if method == "Network.requestWillBeSent":
+            in_flight.add(request_id)
+        elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+            in_flight.discard(request_id)
+    return active
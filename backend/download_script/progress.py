@@ -0,0 +1,91 @@
+import os
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Callback receiving (event_type, data) for the download running in this context.
+# Context variables (rather than thread-locals) follow work handed to executors
+# through contextvars.copy_context().
+_reporter = contextvars.ContextVar("ltk_progress_reporter", default=None)
+
+# Per-item counters, so file_saved() can attribute bytes to the post being processed
+_item_stats = contextvars.ContextVar("ltk_progress_item", default=None)
+
+@contextmanager
+def bind(callback):
+    """
+    Send progress events emitted inside this block to callback
+
+    Args:
+        callback (callable): Called as callback(event_type, data_dict)
+    """
+    token = _reporter.set(callback)
+    try:
+        yield
+    finally:
+        _reporter.reset(token)
+
+def emit(event_type, **data):
+    """
+    Report a progress event to the bound callback, if any
+
+    Errors from the callback are logged and never interrupt the download.
+    """
+    callback = _reporter.get()
+    if callback is None:
+        return
+    data.setdefault("time", time.time())
+    try:
+        callback(event_type, data)
+    except Exception as e:
+        logger.warning(f"Error reporting progress event {event_type}: {e}")
+
+@contextmanager
+def item(kind, index, **data):
+    """
+    Wrap the processing of one post: emits item_started, then item_finished
+    (with the number of files and bytes saved) or item_failed. Yields the
+    item's counters, including the paths of the files saved.
+
+    Args:
+        kind (str): "image" or "video"
+        index (int): Position of the post in the feed
+    """
+    stats = {"files": 0, "bytes": 0, "paths": []}
+    token = _item_stats.set(stats)
+    emit("item_started", kind=kind, index=index, **data)
+    try:
+        yield stats
+    except Exception as e:
+        metrics.ITEMS.inc(kind=kind, outcome="failed")
+        emit("item_failed", kind=kind, index=index, error=str(e), **data)
+        raise
+    else:
+        metrics.ITEMS.inc(kind=kind, outcome="finished")
+        emit("item_finished", kind=kind, index=index, files=stats["files"], bytes=stats["bytes"], **data)
+    finally:
+        _item_stats.reset(token)
+
+def file_saved(path):
+    """Report a finished output file and count it towards the current item"""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    metrics.SAVED_BYTES.inc(size)
+    stats = _item_stats.get()
+    if stats is not None:
+        stats["files"] += 1
+        stats["bytes"] += size
+        stats["paths"].append(path)
+    emit("file_saved", file=os.path.basename(path), bytes=size)
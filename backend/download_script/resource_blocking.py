@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Which resources scraping browsers skip (overridable through the environment):
+#   off      - load everything
+#   standard - skip web fonts and third-party trackers/ads (default)
+#   lean     - also skip stylesheets and images; only the DOM, its attributes
+#              (srcset included) and scripts/XHR (the player's m3u8 requests) load
+PROFILE = os.environ.get("LTK_BLOCK_PROFILE", "standard").strip().lower()
+
+# Extra URL patterns to block and hosts to never block, comma-separated
+EXTRA_PATTERNS = [p.strip() for p in os.environ.get("LTK_BLOCK_PATTERNS", "").split(",") if p.strip()]
+ALLOWED_HOSTS = {h.strip().lower() for h in os.environ.get("LTK_BLOCK_ALLOW", "").split(",") if h.strip()}
+
+# Set LTK_MEASURE_PAGES=1 to log measure_page() for every page a scrape loads.
+# It costs a script and two DevTools round trips per page, so it is off by default.
+MEASURE_PAGES = os.environ.get("LTK_MEASURE_PAGES", "0") != "0"
+
+FONT_PATTERNS = ["*.woff*", "*.ttf*", "*.otf*", "*.eot*", "*fonts.googleapis.com*", "*fonts.gstatic.com*"]
+STYLESHEET_PATTERNS = ["*.css", "*.css?*"]
+
+TRACKER_HOSTS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "connect.facebook.net",
+    "analytics.tiktok.com",
+    "ct.pinterest.com",
+    "bat.bing.com",
+    "clarity.ms",
+    "hotjar.com",
+    "cdn.segment.com",
+    "api.segment.io",
+    "js.hs-scripts.com",
+    "snap.licdn.com",
+]
+
+# Hosts the downloaders depend on; never blocked whatever the configuration says
+ESSENTIAL_HOSTS = {"stream.mux.com", "image.mux.com"}
+
+PROFILES = ("off", "standard", "lean")
+
+def _profile(profile=None):
+    profile = profile or PROFILE
+    if profile not in PROFILES:
+        logger.warning(f"Unknown LTK_BLOCK_PROFILE {profile!r}, using 'standard'")
+        return "standard"
+    return profile
+
+def blocked_url_patterns(profile=None):
+    """
+    URL patterns (Network.setBlockedURLs wildcards) blocked by a profile
+
+    Args:
+        profile (str): Profile name (default: LTK_BLOCK_PROFILE)
+
+    Returns:
+        list: Patterns; empty for the "off" profile
+    """
+    profile = _profile(profile)
+    if profile == "off":
+        return []
+
+    allowed = ALLOWED_HOSTS | ESSENTIAL_HOSTS
+    patterns = list(FONT_PATTERNS)
+    patterns += [f"*://*.{host}/*" for host in TRACKER_HOSTS if host not in allowed]
+    patterns += [f"*://{host}/*" for host in TRACKER_HOSTS if host not in allowed]
+    if profile == "lean":
+        patterns += STYLESHEET_PATTERNS
+    patterns += EXTRA_PATTERNS
+    return patterns
+
+def chrome_prefs(profile=None):
+    """
+    Chrome preferences for a profile; images are disabled browser-wide in "lean"
+
+    Returns:
+        dict: Preferences for Options.add_experimental_option("prefs", ...)
+    """
+    if _profile(profile) == "lean":
+        return {"profile.managed_default_content_settings.images": 2}
+    return {}
+
+def apply_to_tab(driver, profile=None):
+    """
+    Install the blocked URL patterns on the driver's current tab
+
+    Network.setBlockedURLs only affects the tab it is sent to, so this has to
+    be called for every tab a scrape opens (see driver_pool.open_tab).
+
+    Returns:
+        bool: True if the patterns were installed
+    """
+    patterns = blocked_url_patterns(profile)
+    if not patterns:
+        return False
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        return True
+    except Exception as e:
+        logger.warning(f"Error installing resource blocking: {str(e)}")
+        return False
+
+_PAGE_STATS_SCRIPT = """
+var nav = performance.getEntriesByType('navigation')[0];
+var resources = performance.getEntriesByType('resource');
+var transferred = 0;
+for (var i = 0; i < resources.length; i++) {
+    transferred += resources[i].transferSize || 0;
+}
+return {
+    dom_content_loaded_ms: nav ? nav.domContentLoadedEventEnd : null,
+    load_ms: nav ? nav.loadEventEnd : null,
+    resources: resources.length,
+    transferred_bytes: transferred + (nav ? nav.transferSize || 0 : 0)
+};
+"""
+
+def measure_page(driver):
+    """
+    Load statistics of the current page
+
+    Returns:
+        dict: dom_content_loaded_ms, load_ms, resources, transferred_bytes and,
+        when the DevTools Performance domain is available, js_heap_bytes and dom_nodes
+    """
+    stats = driver.execute_script(_PAGE_STATS_SCRIPT) or {}
+    try:
+        driver.execute_cdp_cmd("Performance.enable", {})
+        metrics = driver.execute_cdp_cmd("Performance.getMetrics", {}).get("metrics", [])
+        values = {metric["name"]: metric["value"] for metric in metrics}
+        stats["js_heap_bytes"] = int(values.get("JSHeapUsedSize", 0))
+        stats["dom_nodes"] = int(values.get("Nodes", 0))
+    except Exception as e:
+        logger.debug(f"Performance metrics unavailable: {str(e)}")
+    return stats
+
+def compare_profiles(url, profiles=PROFILES, runs=1):
+    """
+    Load a page in a fresh browser per profile and report its load statistics
+
+    Args:
+        url (str): Page to load (e.g. an LTK profile feed)
+        profiles (tuple): Profiles to compare
+        runs (int): Loads per profile; the statistics of the last one are kept
+
+    Returns:
+        dict: Profile name mapped to measure_page() output plus wall_ms
+    """
+    # Imported here: driver_pool imports this module for its Chrome options
+    try:
+        from . import driver_pool
+    except ImportError:
+        import driver_pool
+
+    results = {}
+    for profile in profiles:
+        user_data_dir = tempfile.mkdtemp(prefix="chrome_user_data_")
+        driver = driver_pool.create_chrome_driver(driver_pool.build_chrome_options(user_data_dir, profile=profile))
+        try:
+            apply_to_tab(driver, profile)
+            for _ in range(runs):
+                driver.get("about:blank")
+                driver.delete_all_cookies()
+                start = time.monotonic()
+                driver.get(url)
+                wall_ms = (time.monotonic() - start) * 1000
+            stats = measure_page(driver)
+            stats["wall_ms"] = round(wall_ms)
+            results[profile] = stats
+        finally:
+            driver.quit()
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+    return results
+
+# Run standalone to measure the profiles against a live page
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python resource_blocking.py <url> [runs]")
+        sys.exit(1)
+
+    results = compare_profiles(sys.argv[1], runs=int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    columns = ["wall_ms", "dom_content_loaded_ms", "load_ms", "resources", "transferred_bytes", "js_heap_bytes", "dom_nodes"]
+    print(f"{'profile':<10}" + "".join(f"{column:>24}" for column in columns))
+    for profile, stats in results.items():
+        print(f"{profile:<10}" + "".join(f"{str(stats.get(column, '-')):>24}" for column in columns))
@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A file only ever appears under its final name once it is complete. Until then
+# its bytes live in <name>.part and what is needed to resume them in <name>.part.json.
+# zip_stream skips these suffixes (and ITEM_LOG_NAME) when archiving a task.
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+# Per output directory record of the posts whose files are all on disk
+ITEM_LOG_NAME = ".ltk_items.json"
+
+def part_path(path):
+    return path + PART_SUFFIX
+
+def state_path(path):
+    return path + STATE_SUFFIX
+
+def is_complete(path):
+    """Whether a finished (non-empty) file is already at its final name"""
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+def load_state(path):
+    """
+    Read the resume state saved for a partial file
+
+    Returns:
+        dict: The state, or None if there is none (or it is unreadable)
+    """
+    try:
+        with open(state_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_state(path, state):
+    """Atomically replace the resume state of a partial file"""
+    staging = f"{state_path(path)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(staging, 'w') as f:
+        json.dump(state, f)
+    os.replace(staging, state_path(path))
+
+def discard(path):
+    """Drop the partial file and resume state of path"""
+    for leftover in (part_path(path), state_path(path)):
+        try:
+            os.remove(leftover)
+        except FileNotFoundError:
+            pass
+
+def finish(path):
+    """
+    Move a completed partial file to its final name and drop its resume state
+
+    An existing file at path is replaced, not written through, so a file
+    hardlinked to a media cache object is never modified.
+    """
+    os.replace(part_path(path), path)
+    try:
+        os.remove(state_path(path))
+    except FileNotFoundError:
+        pass
+
+def fingerprint(urls):
+    """
+    Identify a list of segment URLs independently of per-view query tokens
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha1()
+    for url in urls:
+        parts = urlsplit(url)
+        digest.update(urlunsplit((parts.scheme, parts.netloc, parts.path, '', '')).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+class ItemLog:
+    """
+    Record of the posts handed out for download into an output directory
+
+    Each post key (its URL, or its feed position) keeps the index it was
+    given, so a retried download writes to the same file names (resuming
+    their partial files), and the names of its files once it is done, so
+    posts whose files are all still on disk are skipped.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, ITEM_LOG_NAME)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self._items = json.load(f)
+        except (OSError, ValueError):
+            self._items = {}
+
+    def completed(self):
+        """
+        Keys of the finished posts whose files all still exist
+
+        Returns:
+            set: Post keys
+        """
+        with self._lock:
+            return {
+                key for key, item in self._items.items()
+                if item.get('files') and all(
+                    is_complete(os.path.join(self.output_dir, name)) for name in item['files']
+                )
+            }
+
+    def index_for(self, key):
+        """Index a post was given by an earlier attempt, or None"""
+        with self._lock:
+            item = self._items.get(key)
+            return item['index'] if item else None
+
+    def next_index(self):
+        """First index not given to any recorded post"""
+        with self._lock:
+            return max((item['index'] for item in self._items.values()), default=-1) + 1
+
+    def assign(self, key, index):
+        """Record that a post is being downloaded under index"""
+        with self._lock:
+            self._items[key] = {'index': index, 'files': []}
+            self._save()
+
+    def record(self, key, paths):
+        """Record the files a finished post produced"""
+        with self._lock:
+            item = self._items.setdefault(key, {'index': None})
+            item['files'] = [os.path.basename(path) for path in paths]
+            self._save()
+
+    def _save(self):
+        staging = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(staging, 'w') as f:
+                json.dump(self._items, f)
+            os.replace(staging, self.path)
+        except OSError as e:
+            logger.warning(f"Error saving item log {self.path}: {str(e)}")
@@ -0,0 +1,115 @@
+import os
+import json
+import base64
+import shutil
+import subprocess
+
+import pytest
+
+from backend.download_script import blob_transfer
+
+# A page holding one blob, driven the way chromedriver runs scripts: the script
+# becomes the body of a plain function, and async scripts get a callback as their
+# last argument (a script that never calls it times out)
+_PAGE = r"""
+const readline = require('readline');
+globalThis.window = globalThis;
+const blobs = {'blob:https://www.shopltk.com/1': new Blob([Buffer.from(process.argv[1], 'base64')], {type: 'video/mp4'})};
+globalThis.fetch = async (url) => {
+    if (!(url in blobs)) {
+        throw new TypeError('Failed to fetch');
+    }
+    return {blob: async () => blobs[url]};
+};
+globalThis.FileReader = class {
+    readAsDataURL(blob) {
+        blob.arrayBuffer().then((buffer) => {
+            this.error = null;
+            this.result = 'data:' + blob.type + ';base64,' + Buffer.from(buffer).toString('base64');
+            this.onloadend();
+        });
+    }
+};
+const send = (message) => process.stdout.write(JSON.stringify(message) + '\n');
+readline.createInterface({input: process.stdin}).on('line', (line) => {
+    const call = JSON.parse(line);
+    try {
+        const fn = new Function(call.script);
+        if (!call.async) {
+            send({value: fn.apply(window, call.args) ?? null});
+            return;
+        }
+        const timer = setTimeout(() => send({error: 'script timeout'}), 2000);
+        fn.apply(window, call.args.concat([(value) => {
+            clearTimeout(timer);
+            send({value: value ?? null});
+        }]));
+    } catch (e) {
+        send({error: String(e)});
+    }
+});
+"""
+
+BLOB_URL = "blob:https://www.shopltk.com/1"
+
+class NodePageDriver:
+    """Stand-in for a WebDriver whose scripts run in a node process"""
+
+    def __init__(self, data):
+        self._process = subprocess.Popen(
+            ["node", "-e", _PAGE, base64.b64encode(data).decode()],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+
+    def _call(self, script, args, is_async):
+        self._process.stdin.write(json.dumps({"script": script, "args": list(args), "async": is_async}) + "\n")
+        self._process.stdin.flush()
+        reply = json.loads(self._process.stdout.readline())
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply["value"]
+
+    def execute_script(self, script, *args):
+        return self._call(script, args, False)
+
+    def execute_async_script(self, script, *args):
+        return self._call(script, args, True)
+
+    def quit(self):
+        self._process.stdin.close()
+        self._process.wait(5)
+
+@pytest.fixture
+def page():
+    if shutil.which("node") is None:
+        pytest.skip("node is needed to run the page scripts")
+    drivers = []
+
+    def open_page(data):
+        drivers.append(NodePageDriver(data))
+        return drivers[-1]
+
+    yield open_page
+    for driver in drivers:
+        driver.quit()
+
+def test_blob_is_copied_in_slices(page, tmp_path):
+    data = os.urandom(2500)
+    driver = page(data)
+    target = str(tmp_path / "video.mp4")
+
+    assert blob_transfer.save_blob(driver, BLOB_URL, target, chunk_size=1000) == len(data)
+
+    with open(target, "rb") as f:
+        assert f.read() == data
+    # The page lets go of the blob once it has been read
+    assert driver.execute_script("return Object.keys(window.__ltkBlobs).length;") == 0
+
+def test_unreadable_blob_raises(page, tmp_path):
+    driver = page(b"data")
+    with pytest.raises(blob_transfer.BlobUnavailable, match="Failed to fetch"):
+        blob_transfer.save_blob(driver, "blob:https://www.shopltk.com/revoked", str(tmp_path / "video.mp4"))
+
+def test_reading_a_released_blob_reports_it(page):
+    driver = page(b"data")
+    assert driver.execute_async_script(blob_transfer._READ_SCRIPT, "missing", 0, 4) == {"error": "blob released"}
@@ -0,0 +1,206 @@
+import os
+import time
+
+import pytest
+
+from backend.download_script import download_video_from_url as dv
+from backend.download_script import media_cache, resume
+
+PROFILE = "https://www.shopltk.com/explore/creator"
+
+def post(n, **fields):
+    href = f"https://www.shopltk.com/explore/creator/posts/{n}"
+    return dict({"key": href, "href": href, "is_video": False, "images": [], "video_srcs": []}, **fields)
+
+def keys(posts):
+    return [p["key"].rsplit("/", 1)[1] for p in posts]
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = media_cache.MediaCache(root=str(tmp_path / "cache"))
+    monkeypatch.setattr(media_cache, "get_cache", lambda: cache)
+    return cache
+
+def test_manifest_round_trip_keeps_only_linked_posts(cache):
+    listed = [post(1, index=0, debug={"html": "..."}), dict(post(2), href=None, key="#5"), post(3)]
+    dv.store_profile_manifest(PROFILE, listed, [])
+
+    posts, stored_at = dv.load_profile_manifest(PROFILE)
+    assert keys(posts) == ["1", "3"]
+    assert stored_at is not None
+    # Only the manifest fields are kept, plus when the post was seen
+    assert set(posts[0]) == set(dv.MANIFEST_FIELDS)
+
+def test_overlapping_listing_is_merged_ahead_of_the_manifest(cache):
+    old = dv.store_profile_manifest(PROFILE, [post(n) for n in (3, 4, 5, 6)], [])
+    merged = dv.store_profile_manifest(PROFILE, [post(n) for n in (1, 2, 3)], old)
+
+    assert keys(merged) == ["1", "2", "3", "4", "5", "6"]
+    assert keys(dv.load_profile_manifest(PROFILE)[0]) == keys(merged)
+    # Posts carried over keep the time they were last seen
+    assert merged[4]["seen_at"] == old[1]["seen_at"]
+
+def test_listing_that_misses_the_manifest_replaces_it(cache):
+    old = dv.store_profile_manifest(PROFILE, [post(n) for n in (3, 4)], [])
+    assert keys(dv.store_profile_manifest(PROFILE, [post(n) for n in (10, 11)], old)) == ["10", "11"]
+
+def test_stale_manifest_posts_are_dropped_on_load(cache):
+    old = time.time() - dv.PROFILE_MAX_AGE - 60
+    cache.store_profile(media_cache.media_key("profile", PROFILE),
+                        [dict(post(1), seen_at=old), dict(post(2), seen_at=time.time())])
+    posts, _ = dv.load_profile_manifest(PROFILE)
+    assert keys(posts) == ["2"]
+
+def test_no_manifest_without_a_cache(monkeypatch):
+    monkeypatch.setattr(media_cache, "get_cache", lambda: None)
+    assert dv.load_profile_manifest(PROFILE) == ([], None)
+    assert keys(dv.store_profile_manifest(PROFILE, [post(1)], [])) == ["1"]
+
+def feed(monkeypatch, posts):
+    """Make iter_feed_posts yield posts, recording how many were scraped"""
+    scraped = []
+
+    def iter_feed_posts(driver, referer_url, seen_keys):
+        for p in posts:
+            if p["key"] in seen_keys:
+                continue
+            seen_keys.add(p["key"])
+            scraped.append(p)
+            yield dict(p)
+
+    monkeypatch.setattr(dv, "iter_feed_posts", iter_feed_posts)
+    return scraped
+
+def test_feed_switches_to_the_manifest_after_the_overlap(monkeypatch):
+    scraped = feed(monkeypatch, [post(n) for n in range(1, 20)])
+    manifest = [post(n) for n in range(3, 12)]
+
+    posts = list(dv.iter_profile_posts(None, PROFILE, set(), manifest, wanted=8))
+
+    # Posts 3, 4 and 5 match the manifest, which supplies the rest
+    assert keys(scraped) == ["1", "2", "3", "4", "5"]
+    assert keys(posts) == [str(n) for n in range(1, 12)]
+
+def test_feed_keeps_scrolling_when_the_manifest_runs_short(monkeypatch):
+    scraped = feed(monkeypatch, [post(n) for n in range(1, 20)])
+    manifest = [post(n) for n in range(3, 7)]
+
+    posts = list(dv.iter_profile_posts(None, PROFILE, set(), manifest, wanted=10))
+
+    assert len(scraped) == 19
+    assert keys(posts) == [str(n) for n in range(1, 20)]
+
+class _FeedPool:
+    size = 2
+
+    def acquire(self, timeout=None, cancel_event=None):
+        return _FeedDriver()
+
+    def release(self, driver, discard=False):
+        pass
+
+class _FeedDriver:
+    def get(self, url):
+        pass
+
+def test_failed_posts_are_retried_on_the_next_pass(monkeypatch, tmp_path):
+    feed(monkeypatch, [post(n) for n in range(1, 4)])
+    monkeypatch.setattr(media_cache, "get_cache", lambda: None)
+    monkeypatch.setattr(dv.driver_pool, "get_pool", lambda: _FeedPool())
+    monkeypatch.setattr(dv.page_waits, "wait_for_stable_count", lambda driver, selector, timeout: 0)
+    attempts = []
+
+    def process_image_post(p, output_dir, referer_url, index):
+        attempts.append(p["key"])
+        if p["key"].endswith("/2") and attempts.count(p["key"]) == 1:
+            raise ConnectionError("image fetch failed")
+        path = str(tmp_path / f"image_{index}_0.jpg")
+        with open(path, "wb") as f:
+            f.write(b"x")
+        dv.progress.file_saved(path)
+
+    monkeypatch.setattr(dv, "process_image_post", process_image_post)
+    dv.download_video_from_url(PROFILE, str(tmp_path), max_items=3)
+
+    # Only the failed post is fetched again, and under the index it had
+    assert sorted(keys([{"key": key} for key in attempts])) == ["1", "2", "2", "3"]
+    assert resume.ItemLog(str(tmp_path)).completed() == {post(n)["key"] for n in range(1, 4)}
+    assert sorted(name for name in os.listdir(str(tmp_path)) if name.endswith(".jpg")) == \
+        ["image_0_0.jpg", "image_1_0.jpg", "image_2_0.jpg"]
+
+def test_fresh_manifest_reports_the_posts_it_serves(cache, monkeypatch, tmp_path):
+    dv.store_profile_manifest(PROFILE, [post(n) for n in range(1, 6)], [])
+    processed = []
+    monkeypatch.setattr(dv, "process_image_post", lambda p, output_dir, referer_url, index: processed.append(p["key"]))
+    events = []
+
+    with dv.progress.bind(lambda event_type, data: events.append((event_type, data))):
+        dv.download_video_from_url(PROFILE, str(tmp_path / "out"), max_items=3)
+
+    assert keys([{"key": key} for key in sorted(processed)]) == ["1", "2", "3"]
+    discovered = [data["count"] for event_type, data in events if event_type == "posts_discovered"]
+    assert discovered == [3]
+
+def test_indexes_are_assigned_before_posts_are_described(tmp_path):
+    item_log = resume.ItemLog(str(tmp_path))
+    posts = list(dv.assign_indexes(iter([post(1), post(2)]), item_log))
+    assert [p["index"] for p in posts] == [0, 1]
+    # A retry gives the same post its old index
+    assert next(dv.assign_indexes(iter([post(2)]), item_log))["index"] == 1
+
+class _Video:
+    def __init__(self, src):
+        self.src = src
+
+    def get_attribute(self, name):
+        return self.src if name in ("src", "currentSrc") else None
+
+    def find_elements(self, by, value):
+        return []
+
+class _PostDriver:
+    """A driver whose post tab shows one <video> fed from a MediaSource blob"""
+
+    def __init__(self):
+        self.window_handles = ["feed", "post"]
+        self.switch_to = self
+        self.video = _Video("blob:https://www.shopltk.com/1")
+
+    def window(self, handle):
+        pass
+
+    def find_elements(self, by, value):
+        return [self.video]
+
+    def close(self):
+        self.window_handles.pop()
+
+@pytest.fixture
+def media_stream_blob(monkeypatch):
+    """Blobs that can't be read (MediaSource), whose playlist downloads are recorded"""
+    downloads = []
+
+    def save_blob(driver, blob_url, path, chunk_size=None):
+        raise dv.blob_transfer.BlobUnavailable("Failed to fetch")
+
+    monkeypatch.setattr(media_cache, "get_cache", lambda: None)
+    monkeypatch.setattr(dv.blob_transfer, "save_blob", save_blob)
+    monkeypatch.setattr(dv.blob_transfer, "media_source_urls", lambda driver: ["https://stream.mux.com/abc.m3u8"])
+    monkeypatch.setattr(dv.ltk_m3u8_downloader, "download_m3u8_to_mp4",
+                        lambda url, filename: downloads.append((url, filename)) or True)
+    return downloads
+
+def test_blob_video_falls_back_to_its_playlist(media_stream_blob, tmp_path):
+    target = str(tmp_path / "video.mp4")
+    assert dv.download_blob_video(None, _Video("blob:https://www.shopltk.com/1"), target)
+    assert media_stream_blob == [("https://stream.mux.com/abc.m3u8", target)]
+
+def test_feed_video_posts_use_the_blob_fallback(media_stream_blob, monkeypatch, tmp_path):
+    # Network capture finds nothing, so the post's <video> is read directly
+    monkeypatch.setattr(dv.ltk_network_capture, "capture_video_urls_in_session", lambda driver, url: [])
+    driver = _PostDriver()
+
+    dv.process_video_post(driver, post(1, is_video=True), str(tmp_path), PROFILE, 0)
+
+    assert media_stream_blob == [("https://stream.mux.com/abc.m3u8", str(tmp_path / "video_0_0.mp4"))]
+    assert driver.window_handles == ["feed"]
@@ -0,0 +1,127 @@
+import threading
+from urllib.parse import urlsplit
+
+import pytest
+
+from backend.download_script import cdp_capture, driver_pool
+
+class FakeDriver:
+    """Tabs and a cookie jar with WebDriver's per-document cookie semantics"""
+
+    cdp = True
+
+    def __init__(self):
+        self.window_handles = ["main"]
+        self.switch_to = self
+        self.url = "about:blank"
+        self.cookies = {}
+        self.log_reads = 0
+        self.quit_called = False
+
+    def window(self, handle):
+        pass
+
+    def close(self):
+        self.window_handles.pop()
+
+    def get(self, url):
+        self.url = url
+
+    def execute_script(self, script, *args):
+        if script.startswith("window.open("):
+            self.window_handles.append(f"tab{len(self.window_handles)}")
+        return 1
+
+    def add_cookie(self, name):
+        self.cookies.setdefault(urlsplit(self.url).netloc, set()).add(name)
+
+    def delete_all_cookies(self):
+        # Only the cookies the current document can see
+        self.cookies.pop(urlsplit(self.url).netloc, None)
+
+    def execute_cdp_cmd(self, cmd, params):
+        if not self.cdp:
+            raise RuntimeError("CDP unavailable")
+        if cmd == "Network.clearBrowserCookies":
+            self.cookies.clear()
+        return {}
+
+    def get_log(self, log_type):
+        self.log_reads += 1
+        return []
+
+    def quit(self):
+        self.quit_called = True
+
+class FakeDriverPool(driver_pool.DriverPool):
+    def __init__(self, driver_class=FakeDriver, **kwargs):
+        super().__init__(**kwargs)
+        self.driver_class = driver_class
+
+    def _launch(self):
+        return driver_pool.PooledDriver(self.driver_class(), None)
+
+def browse(driver):
+    driver.get("https://www.shopltk.com/explore/creator")
+    driver.add_cookie("session")
+    driver.execute_script("window.open('about:blank');")
+    driver.get("https://stream.mux.com/abc.m3u8")
+    driver.add_cookie("mux")
+
+def test_cookies_do_not_carry_over_to_the_next_lease():
+    pool = FakeDriverPool(size=1)
+    with pool.lease() as driver:
+        browse(driver)
+    with pool.lease() as leased:
+        assert leased is driver
+        assert leased.cookies == {}
+        assert leased.window_handles == ["main"]
+        assert leased.url == "about:blank"
+
+def test_without_cdp_the_current_sites_cookies_are_still_deleted():
+    class NoCdpDriver(FakeDriver):
+        cdp = False
+
+    pool = FakeDriverPool(driver_class=NoCdpDriver, size=1)
+    with pool.lease() as driver:
+        driver.get("https://www.shopltk.com/explore/creator")
+        driver.add_cookie("session")
+    assert driver.cookies == {}
+
+@pytest.mark.parametrize("cdp", [True, False])
+def test_performance_log_is_only_kept_without_cdp_capture(cdp, monkeypatch):
+    monkeypatch.setattr(cdp_capture, "PERFORMANCE_LOG_ENABLED", not cdp)
+    capabilities = driver_pool.build_chrome_options("/tmp/profile").to_capabilities()
+    assert ("goog:loggingPrefs" in capabilities) is not cdp
+
+    pool = FakeDriverPool(size=1)
+    with pool.lease() as driver:
+        pass
+    # Only a log Chrome is keeping needs draining
+    assert driver.log_reads == (0 if cdp else 1)
+
+def test_drivers_are_recycled_after_max_uses():
+    pool = FakeDriverPool(size=1, max_uses=2)
+    with pool.lease() as first:
+        pass
+    with pool.lease() as second:
+        assert second is first
+    assert first.quit_called
+    with pool.lease() as third:
+        assert third is not first
+
+def test_lease_wait_ends_when_the_job_is_cancelled():
+    pool = FakeDriverPool(size=1)
+    cancel = threading.Event()
+    held = pool.acquire()
+    threading.Timer(0.1, cancel.set).start()
+    with pytest.raises(driver_pool.DriverPoolCancelled):
+        pool.acquire(cancel_event=cancel)
+    pool.release(held)
+
+def test_acquire_times_out_without_a_cancel_token():
+    pool = FakeDriverPool(size=1)
+    held = pool.acquire()
+    with pytest.raises(driver_pool.DriverPoolTimeout):
+        pool.acquire(timeout=0.05)
+    pool.release(held)
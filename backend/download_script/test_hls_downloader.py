@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import asyncio
+import contextvars
+
+import pytest
+
+from backend.download_script import ffmpeg_runner, hls_downloader, resume
+
+# Stand-in for ffmpeg's remux: copies stdin to the output file as it arrives
+FAKE_FFMPEG = """#!{python}
+import os, sys
+with open(sys.argv[-1], 'wb') as out:
+    while True:
+        data = os.read(0, 65536)
+        if not data:
+            break
+        out.write(data)
+        out.flush()
+"""
+
+MASTER = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=1000000,RESOLUTION=270x480
+480.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=6000000,RESOLUTION=608x1080
+1080.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=404x720
+720.m3u8
+"""
+
+@pytest.fixture
+def variants():
+    return hls_downloader.parse_master_playlist(MASTER, "https://stream.mux.com/abc.m3u8?token=t")
+
+def policy(max_height=0, max_bandwidth=0, min_height=None, prefer="highest"):
+    return hls_downloader.variant_policy(max_height=max_height, max_bandwidth=max_bandwidth,
+                                         min_height=min_height, prefer=prefer)
+
+def pick(variants, **kwargs):
+    return hls_downloader.select_variant(variants, policy(**kwargs))["height"]
+
+def test_master_playlist_variants(variants):
+    assert [v["height"] for v in variants] == [480, 1080, 720]
+    assert variants[1]["uri"] == "https://stream.mux.com/1080.m3u8"
+    assert variants[1]["bandwidth"] == 6000000
+
+def test_highest_rendition_within_the_caps(variants):
+    assert pick(variants) == 1080
+    assert pick(variants, max_height=720) == 720
+    assert pick(variants, max_bandwidth=2000000) == 480
+    assert pick(variants, max_height=1080, max_bandwidth=3000000) == 720
+
+def test_smallest_acceptable_rendition(variants):
+    assert pick(variants, prefer="smallest") == 480
+    assert pick(variants, prefer="smallest", min_height=600) == 720
+    # Nothing tall enough within the caps: the tallest that fits
+    assert pick(variants, prefer="smallest", min_height=1000, max_height=720) == 720
+
+def test_nothing_within_the_caps_takes_the_smallest(variants):
+    assert pick(variants, max_height=360) == 480
+    assert pick(variants, max_bandwidth=500000) == 480
+
+def test_renditions_without_resolution_pass_height_limits():
+    variants = hls_downloader.parse_master_playlist(
+        "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\na.m3u8\n"
+        "#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=608x1080\nb.m3u8\n",
+        "https://example.com/master.m3u8"
+    )
+    assert hls_downloader.select_variant(variants, policy(max_height=720))["uri"] == "https://example.com/a.m3u8"
+
+def test_unknown_preference_is_rejected():
+    with pytest.raises(ValueError):
+        hls_downloader.variant_policy(prefer="median")
+
+def test_policy_key_only_tags_non_default_policies():
+    assert hls_downloader.policy_key(policy()) == ""
+    assert hls_downloader.policy_key(policy(max_height=720)) == "@h720;bw0;highest"
+    assert hls_downloader.policy_key(policy(prefer="smallest", min_height=480)) == "@h0;bw0;smallest;min480"
+
+def test_bound_policy_follows_copied_contexts(variants):
+    with hls_downloader.use_variant_policy(policy(max_height=720)):
+        assert hls_downloader.select_variant(variants)["height"] == 720
+        # Work handed to executors runs in a copy of the context
+        assert contextvars.copy_context().run(lambda: hls_downloader.select_variant(variants)["height"]) == 720
+    assert hls_downloader.current_variant_policy() == hls_downloader.variant_policy()
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    if os.name != "posix":
+        pytest.skip("the fake ffmpeg is a script")
+    binary = tmp_path / "ffmpeg"
+    binary.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    binary.chmod(0o755)
+    monkeypatch.setattr(ffmpeg_runner, "_probed", True)
+    monkeypatch.setattr(ffmpeg_runner, "_binary", str(binary))
+    monkeypatch.setattr(ffmpeg_runner, "_version", "fake ffmpeg")
+
+def segment_source(segments, output_file, fail=False):
+    """Segments for spool_segments; the last one waits until the remux has written output"""
+    def remuxed_bytes():
+        part = resume.part_path(output_file)
+        return os.path.getsize(part) if os.path.exists(part) else 0
+
+    async def iter_segments(client, urls, concurrency):
+        for index in range(len(segments) - len(urls), len(segments)):
+            if index == len(segments) - 1:
+                deadline = time.monotonic() + 5
+                while not remuxed_bytes():
+                    assert time.monotonic() < deadline, "the remux did not start before the last segment"
+                    await asyncio.sleep(0.01)
+                if fail:
+                    raise ConnectionError("segment fetch failed")
+            yield segments[index]
+    return iter_segments
+
+def test_ts_remux_overlaps_the_download(fake_ffmpeg, tmp_path, monkeypatch):
+    segments = [os.urandom(3000) for _ in range(5)]
+    output_file = str(tmp_path / "video.mp4")
+    monkeypatch.setattr(hls_downloader, "iter_segments", segment_source(segments, output_file))
+
+    urls = [f"https://stream.mux.com/{index}.ts" for index in range(len(segments))]
+    asyncio.run(hls_downloader.remux_ts(None, urls, output_file, concurrency=2))
+
+    with open(output_file, "rb") as f:
+        assert f.read() == b"".join(segments)
+    # The spool goes as soon as the remux succeeded
+    assert sorted(os.listdir(str(tmp_path))) == ["ffmpeg", "video.mp4"]
+
+def test_failed_spool_stops_the_remux_and_keeps_the_checkpoint(fake_ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.setattr(hls_downloader, "CHECKPOINT_EVERY", 2)
+    segments = [os.urandom(3000) for _ in range(5)]
+    output_file = str(tmp_path / "video.mp4")
+    monkeypatch.setattr(hls_downloader, "iter_segments", segment_source(segments, output_file, fail=True))
+
+    urls = [f"https://stream.mux.com/{index}.ts" for index in range(len(segments))]
+    with pytest.raises(ConnectionError):
+        asyncio.run(hls_downloader.remux_ts(None, urls, output_file, concurrency=2))
+
+    # No truncated video, and a retry resumes the spool after the last checkpoint
+    assert not os.path.exists(output_file)
+    assert resume.load_state(output_file + ".ts")["segments"] == 4
+
+    monkeypatch.setattr(hls_downloader, "iter_segments", segment_source(segments, output_file))
+    asyncio.run(hls_downloader.remux_ts(None, urls, output_file, concurrency=2))
+    with open(output_file, "rb") as f:
+        assert f.read() == b"".join(segments)
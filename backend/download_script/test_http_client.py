@@ -0,0 +1,221 @@
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.download_script import http_client, resume
+
+class RangeServer:
+    """
+    Local origin for one resource, honouring Range and If-Range like a CDN
+
+    Args:
+        body (bytes): The resource
+        etag (str): Its ETag header
+        ranges (bool): Whether Range requests are answered with 206
+        cut_after (int): Drop the connection after this many bytes of the first response
+    """
+
+    def __init__(self, body, etag='"v1"', ranges=True, cut_after=None):
+        self.body = body
+        self.etag = etag
+        self.ranges = ranges
+        self.cut_after = cut_after
+        self.requests = []
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/video.mp4"
+
+    def handle(self, handler):
+        with self._lock:
+            self.requests.append(dict(handler.headers))
+            first = len(self.requests) == 1
+        status, start, end = 200, 0, len(self.body) - 1
+        byte_range = re.fullmatch(r"bytes=(\d+)-(\d*)", handler.headers.get("Range", ""))
+        if_range = handler.headers.get("If-Range")
+        if self.ranges and byte_range and (if_range is None or if_range == self.etag):
+            status, start = 206, int(byte_range.group(1))
+            end = min(int(byte_range.group(2) or end), end)
+
+        handler.send_response(status)
+        handler.send_header("Content-Length", str(end - start + 1))
+        handler.send_header("ETag", self.etag)
+        if self.ranges:
+            handler.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{len(self.body)}")
+        handler.end_headers()
+
+        data = self.body[start:end + 1]
+        if first and self.cut_after is not None:
+            data = data[:self.cut_after]
+            handler.close_connection = True
+        handler.wfile.write(data)
+        with self._lock:
+            self.bytes_served += len(data)
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(body, **kwargs):
+        servers.append(RangeServer(body, **kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(http_client, "backoff_delay", lambda attempt, response=None: 0)
+
+BODY = os.urandom(200_000)
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def leave_partial(filename, url, data, etag):
+    """What an interrupted download_to_file leaves behind"""
+    with open(resume.part_path(filename), "wb") as f:
+        f.write(data)
+    resume.save_state(filename, {"url": url, "etag": etag, "last_modified": None})
+
+def test_download_resumes_after_a_dropped_connection(serve, tmp_path):
+    server = serve(BODY, cut_after=50_000)
+    target = str(tmp_path / "video.mp4")
+    http_client.download_to_file(server.url, target, chunk_size=8192)
+
+    assert read(target) == BODY
+    # The retry continues from what reached the partial file (whole chunks only)
+    offset = int(re.fullmatch(r"bytes=(\d+)-", server.requests[1]["Range"]).group(1))
+    assert 50_000 - 8192 < offset <= 50_000
+    assert server.requests[1]["If-Range"] == '"v1"'
+    assert server.bytes_served == 50_000 + len(BODY) - offset
+    # The partial file and its state are gone once the file is complete
+    assert not os.path.exists(resume.part_path(target))
+    assert resume.load_state(target) is None
+
+def test_partial_file_is_continued_when_the_etag_matches(serve, tmp_path):
+    server = serve(BODY)
+    target = str(tmp_path / "video.mp4")
+    leave_partial(target, server.url, BODY[:80_000], '"v1"')
+
+    http_client.download_to_file(server.url, target)
+
+    assert read(target) == BODY
+    assert server.bytes_served == len(BODY) - 80_000
+
+def test_partial_file_is_replaced_when_the_resource_changed(serve, tmp_path):
+    server = serve(BODY, etag='"v2"')
+    target = str(tmp_path / "video.mp4")
+    leave_partial(target, server.url, b"stale bytes from the old version", '"v1"')
+
+    http_client.download_to_file(server.url, target)
+
+    # If-Range failed, so the server sent the whole new file, which was not appended
+    assert server.requests[0]["If-Range"] == '"v1"'
+    assert read(target) == BODY
+
+def test_partial_file_of_another_url_is_not_resumed(serve, tmp_path):
+    server = serve(BODY)
+    target = str(tmp_path / "video.mp4")
+    leave_partial(target, server.url + "?other", BODY[:80_000], '"v1"')
+
+    http_client.download_to_file(server.url, target)
+
+    assert "Range" not in server.requests[0]
+    assert read(target) == BODY
+
+def test_weak_etags_are_not_used_to_resume(tmp_path):
+    assert http_client._strong_etag('W/"v1"') is None
+    assert http_client._strong_etag('"v1"') == '"v1"'
+
+    target = str(tmp_path / "video.mp4")
+    leave_partial(target, "http://example.com/video.mp4", b"x" * 100, None)
+    headers, offset = http_client._resume_headers("http://example.com/video.mp4", target, {"Referer": "r"})
+    assert offset == 0
+    assert "Range" not in headers
+    assert headers["Accept-Encoding"] == "identity"
+
+def test_split_ranges_cover_the_file_once():
+    ranges = http_client.split_ranges(10, 3)
+    assert ranges == [[0, 3, 0], [4, 7, 4], [8, 9, 8]]
+    assert http_client.split_ranges(2, 4) == [[0, 0, 0], [1, 1, 1]]
+
+def test_segmented_download_writes_each_range_in_place(serve, tmp_path):
+    server = serve(BODY)
+    target = str(tmp_path / "video.mp4")
+    http_client.download_segmented(server.url, target, connections=4, min_size=1)
+
+    assert read(target) == BODY
+    ranges = sorted(request["Range"] for request in server.requests)
+    # One probe for the first byte, then a range per connection
+    assert ranges == ["bytes=0-0", "bytes=0-49999", "bytes=100000-149999", "bytes=150000-199999", "bytes=50000-99999"]
+    assert all(request["If-Range"] == '"v1"' for request in server.requests if request["Range"] != "bytes=0-0")
+    assert resume.load_state(target) is None
+
+def test_segmented_download_resumes_unfinished_ranges(serve, tmp_path):
+    server = serve(BODY)
+    target = str(tmp_path / "video.mp4")
+    # An earlier attempt finished the first range and half of the second
+    with open(resume.part_path(target), "wb") as f:
+        f.write(BODY[:150_000])
+        f.truncate(len(BODY))
+    resume.save_state(target, {"url": server.url, "size": len(BODY), "validator": '"v1"',
+                               "ranges": [[0, 99_999, 100_000], [100_000, 199_999, 150_000]]})
+
+    http_client.download_segmented(server.url, target, connections=2, min_size=1)
+
+    assert read(target) == BODY
+    assert [request["Range"] for request in server.requests] == ["bytes=0-0", "bytes=150000-199999"]
+
+def test_segmented_download_restarts_when_the_resource_changed(serve, tmp_path):
+    server = serve(BODY, etag='"v2"')
+    target = str(tmp_path / "video.mp4")
+    with open(resume.part_path(target), "wb") as f:
+        f.write(b"\0" * len(BODY))
+    resume.save_state(target, {"url": server.url, "size": len(BODY), "validator": '"v1"',
+                               "ranges": [[0, 199_999, 150_000]]})
+
+    http_client.download_segmented(server.url, target, connections=2, min_size=1)
+
+    assert read(target) == BODY
+
+def test_segmented_download_falls_back_without_range_support(serve, tmp_path):
+    server = serve(BODY, ranges=False)
+    target = str(tmp_path / "video.mp4")
+    http_client.download_segmented(server.url, target, connections=4, min_size=1)
+
+    assert read(target) == BODY
+    # The probe got the whole file back, so one plain download followed it
+    assert len(server.requests) == 2
+
+def test_small_files_are_not_split(serve, tmp_path):
+    server = serve(BODY)
+    target = str(tmp_path / "video.mp4")
+    http_client.download_segmented(server.url, target, connections=4, min_size=len(BODY) + 1)
+
+    assert read(target) == BODY
+    assert [request.get("Range") for request in server.requests] == ["bytes=0-0", None]
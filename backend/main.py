@@ -3,15 +3,18 @@ import os
 import shutil
 import tempfile
 import sys
-from typing import List
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from contextlib import nullcontext
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, HttpUrl
 import uuid
 import logging
 import asyncio
 import time
+import json
+from starlette.concurrency import run_in_threadpool
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +26,36 @@ backend_dir = os.path.dirname(current_dir)  # Go up one level if necessary
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 
+# Import the job scheduler
+try:
+    from backend.scheduler import JobScheduler, QueueFullError
+except ImportError:
+    from scheduler import JobScheduler, QueueFullError
+
+# Import the task store
+try:
+    from backend.task_store import create_task_store, remove_task_files, TaskReaper
+except ImportError:
+    from task_store import create_task_store, remove_task_files, TaskReaper
+
+# Import the streaming zip writer
+try:
+    from backend.zip_stream import is_internal_file, iter_task_entries, iter_zip, list_files
+except ImportError:
+    from zip_stream import is_internal_file, iter_task_entries, iter_zip, list_files
+
+# Import the batch planner and runner
+try:
+    from backend import batch
+except ImportError:
+    import batch
+
+# Import the progress event hooks and the metrics used by the download scripts
+try:
+    from backend.download_script import metrics, progress
+except ImportError:
+    from download_script import metrics, progress
+
 # Import your existing download script
 try:
     # Try both import paths to be safe
@@ -30,14 +63,22 @@ try:
         from backend.download_script.ltk_network_capture import capture_video_urls
         from backend.download_script.ltk_m3u8_downloader import download_m3u8_to_mp4
         from backend.download_script.download_video_from_url import download_video_from_url
+        from backend.download_script import driver_pool, ffmpeg_runner, hls_downloader, http_client
         logger.info("Successfully imported download scripts using 'backend.' prefix")
     except ImportError:
         from download_script.ltk_network_capture import capture_video_urls
         from download_script.ltk_m3u8_downloader import download_m3u8_to_mp4
         from download_script.download_video_from_url import download_video_from_url
+        from download_script import driver_pool, ffmpeg_runner, hls_downloader, http_client
         logger.info("Successfully imported download scripts without prefix")
 except ImportError as e:
     logger.error(f"Error importing download scripts: {e}")
+    # No Chrome driver pool, ffmpeg executor, HLS variant selection or HTTP client without the download scripts
+    driver_pool = None
+    ffmpeg_runner = None
+    hls_downloader = None
+    http_client = None
+    
     # Define placeholder functions if imports fail
     def capture_video_urls(url, timeout=30):
         logger.warning("Using placeholder capture_video_urls function")
@@ -50,7 +91,7 @@ except ImportError as e:
             f.write(f"Dummy video file for {m3u8_url}")
         return True
         
-    def download_video_from_url(video_url, output_dir, max_items=10):
+    def download_video_from_url(video_url, output_dir, max_items=10, is_direct_post=False, cancel_event=None):
         logger.warning("Using placeholder download_video_from_url function")
         # Create a dummy file
         os.makedirs(output_dir, exist_ok=True)
@@ -59,16 +100,27 @@ except ImportError as e:
             f.write(f"Dummy video file for {video_url}")
         # Note: The real function doesn't return anything
 
+def bind_variant_policy(policy):
+    """Apply an HLS rendition policy to the video downloads inside this block"""
+    if hls_downloader is None or policy is None:
+        return nullcontext()
+    return hls_downloader.use_variant_policy(policy)
+
 # Actual download function that will be used
-async def download_media(url: str, count: int, target_dir: str, url_type: str = "profile") -> List[str]:
+def download_media(url: str, count: int, target_dir: str, url_type: str = "profile", cancel_event=None,
+                   variant_policy: dict = None) -> List[str]:
     """
     Download media from the given URL and save to target_dir.
     
+    This blocks for the whole scrape, so it must only run on a scheduler worker thread.
+    
     Args:
         url: The URL to download from
         count: Maximum number of items to download
         target_dir: Directory to save downloaded files
         url_type: Type of URL - "profile" or "post"
+        cancel_event: Event that is set when the job is cancelled or times out
+        variant_policy: HLS rendition policy for the videos (default: the LTK_HLS_* settings)
     
     Returns:
         List of downloaded file paths
@@ -79,21 +131,22 @@ async def download_media(url: str, count: int, target_dir: str, url_type: str =
     os.makedirs(target_dir, exist_ok=True)
     
     try:
-        if url_type == "post":
-            # For direct post URLs, we only download the first media item
-            logger.info(f"Processing direct post URL: {url}")
-            # Use the download_video_from_url function with is_direct_post=True
-            download_video_from_url(url, target_dir, max_items=1, is_direct_post=True)
-        else:
-            # For profile URLs, use the existing bulk download functionality
-            logger.info(f"Using download_video_from_url to download from profile {url} with max_items={count}")
-            download_video_from_url(url, target_dir, max_items=count)
+        with bind_variant_policy(variant_policy):
+            if url_type == "post":
+                # For direct post URLs, we only download the first media item
+                logger.info(f"Processing direct post URL: {url}")
+                # Use the download_video_from_url function with is_direct_post=True
+                download_video_from_url(url, target_dir, max_items=1, is_direct_post=True, cancel_event=cancel_event)
+            else:
+                # For profile URLs, use the existing bulk download functionality
+                logger.info(f"Using download_video_from_url to download from profile {url} with max_items={count}")
+                download_video_from_url(url, target_dir, max_items=count, cancel_event=cancel_event)
         
         # Get a list of all downloaded files
         downloaded_files = []
         for file in os.listdir(target_dir):
             file_path = os.path.join(target_dir, file)
-            if os.path.isfile(file_path):
+            if os.path.isfile(file_path) and not is_internal_file(file):
                 downloaded_files.append(file_path)
         
         logger.info(f"Found {len(downloaded_files)} downloaded files")
@@ -119,7 +172,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class DownloadRequest(BaseModel):
+@app.on_event("startup")
+def start_driver_pool():
+    """Pre-launch the shared Chrome driver pool so tasks don't pay for cold starts"""
+    if driver_pool is not None:
+        pool = driver_pool.start_pool()
+        logger.info(f"Started Chrome driver pool (size={pool.size}, max_uses={pool.max_uses})")
+
+# Bounded pool of download workers; the API event loop never runs a scrape itself
+scheduler = JobScheduler()
+metrics.QUEUE_DEPTH.set_function(scheduler.queue_depth)
+metrics.RUNNING_JOBS.set_function(scheduler.running_count)
+
+@app.on_event("startup")
+def start_scheduler():
+    scheduler.start()
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    scheduler.shutdown()
+
+@app.on_event("shutdown")
+def stop_driver_pool():
+    """Quit every pooled Chrome driver"""
+    if driver_pool is not None:
+        driver_pool.shutdown_pool()
+        logger.info("Stopped Chrome driver pool")
+
+@app.on_event("shutdown")
+def stop_ffmpeg():
+    """Kill ffmpeg children of downloads that are still remuxing"""
+    if ffmpeg_runner is not None:
+        ffmpeg_runner.shutdown()
+
+@app.on_event("shutdown")
+def close_http_client():
+    """Close the pooled keep-alive connections of the shared HTTP client"""
+    if http_client is not None:
+        http_client.close_client()
+
+class VariantOptions(BaseModel):
+    # Which HLS rendition of each video to download; unset fields use the LTK_HLS_* defaults
+    maxHeight: Optional[int] = None  # Tallest acceptable rendition in pixels, e.g. 720
+    maxBandwidth: Optional[int] = None  # Highest acceptable bitrate in bits/s
+    minHeight: Optional[int] = None  # With variant="smallest", the shortest acceptable rendition
+    variant: Optional[str] = None  # "highest" (best within the caps) or "smallest" (cheapest acceptable)
+
+class DownloadRequest(VariantOptions):
     url: HttpUrl
     count: int = 10  # Default to 10 items
     urlType: str = "profile"  # Default to profile URL, can be "profile" or "post"
@@ -128,148 +227,495 @@ class DownloadResponse(BaseModel):
     task_id: str
     message: str
 
-# Store download tasks
-download_tasks = {}
+class BatchItem(BaseModel):
+    url: HttpUrl
+    count: int = 10
+    urlType: str = "profile"
+
+class BatchRequest(VariantOptions):
+    items: List[BatchItem]
+    archive: str = "combined"  # "combined" (one zip, a folder per URL) or "per_url" (a zip per URL)
+
+# Store download tasks (SQLite in WAL mode by default, behind an in-memory LRU/TTL cache)
+# so they survive restarts and are shared between uvicorn workers
+task_store = create_task_store()
+
+# Expire finished tasks and delete orphaned ltk_download_* dirs and zips
+task_reaper = TaskReaper(task_store, is_active=lambda task_id: scheduler.get(task_id) is not None)
+
+@app.on_event("startup")
+def start_task_reaper():
+    task_reaper.start()
+
+@app.on_event("shutdown")
+def stop_task_reaper():
+    task_reaper.stop()
+
+def request_variant_policy(request: VariantOptions):
+    """
+    The HLS rendition policy asked for by a request
+    
+    Raises:
+        HTTPException: 400 for an unknown variant preference
+    """
+    if hls_downloader is None:
+        return None
+    try:
+        return hls_downloader.variant_policy(
+            max_height=request.maxHeight,
+            max_bandwidth=request.maxBandwidth,
+            min_height=request.minHeight,
+            prefer=request.variant
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def coalescing_key(request: DownloadRequest, variant_policy: dict = None) -> str:
+    """Requests with the same key are served by one download task"""
+    return json.dumps([str(request.url), request.count, request.urlType, variant_policy], sort_keys=True)
 
 @app.post("/api/download", response_model=DownloadResponse)
-async def start_download(request: DownloadRequest, background_tasks: BackgroundTasks):
+def start_download(request: DownloadRequest):
     """
-    Start a download task in the background
+    Queue a download task on the job scheduler
+    
+    An identical request (same url, count and urlType) made while an earlier one
+    is still running, or waiting to be fetched, shares that task instead of
+    starting another scrape.
     """
+    variant_policy = request_variant_policy(request)
+    
     # Generate a unique task ID
     task_id = str(uuid.uuid4())
-    
-    # Create a temporary directory for this task
     temp_dir = os.path.join(tempfile.gettempdir(), f"ltk_download_{task_id}")
-    os.makedirs(temp_dir, exist_ok=True)
     
-    # Store task info
-    download_tasks[task_id] = {
+    # Store task info, or join the live task for the same request
+    task_id, created = task_store.create_or_attach(task_id, {
         "status": "processing",
         "url": str(request.url),
         "count": request.count,
         "urlType": request.urlType,
+        "variant_policy": variant_policy,
         "temp_dir": temp_dir,
-        "start_time": time.time(),
-        "download_path": None
-    }
+        "start_time": time.time()
+    }, coalescing_key(request, variant_policy))
+    if not created:
+        logger.info(f"Attached request for {request.url} to existing task {task_id}")
+        return {"task_id": task_id, "message": "Download already in progress"}
     
-    # Start the download process in the background
-    background_tasks.add_task(
-        process_download, 
-        task_id=task_id, 
-        url=str(request.url), 
-        count=request.count,
-        temp_dir=temp_dir,
-        url_type=request.urlType
-    )
+    # Create a temporary directory for this task
+    os.makedirs(temp_dir, exist_ok=True)
+    
+    # Hand the download to a worker thread; refuse it if too many are already waiting
+    try:
+        scheduler.submit(
+            task_id,
+            process_download,
+            task_id=task_id,
+            url=str(request.url),
+            count=request.count,
+            temp_dir=temp_dir,
+            url_type=request.urlType,
+            variant_policy=variant_policy
+        )
+    except QueueFullError as e:
+        logger.warning(f"Rejecting download task {task_id}: {e}")
+        # Requests that attached in the meantime see the task fail
+        set_task_status(task_id, "failed", error="Too many downloads in progress")
+        if task_store.release(task_id) == 0:
+            task_store.delete(task_id)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=429, detail="Too many downloads in progress. Please try again later.")
     
     return {"task_id": task_id, "message": "Download started"}
 
-async def process_download(task_id: str, url: str, count: int, temp_dir: str, url_type: str = "profile"):
+@app.post("/api/batch", response_model=DownloadResponse)
+def start_batch(request: BatchRequest):
+    """
+    Queue one task that downloads many profiles or posts
+    
+    The URLs are scraped by a single scheduler job, a few at a time, through the
+    shared Chrome pool and HTTP client; media reached from more than one URL
+    comes from the media cache after the first download. The results are one
+    zip with a folder per URL (archive="combined", fetched from
+    /api/download/{task_id}) or a zip per URL (archive="per_url", listed by
+    /api/batch/{task_id}).
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="A batch needs at least one URL")
+    if len(request.items) > batch.MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch takes at most {batch.MAX_BATCH_ITEMS} URLs")
+    if request.archive not in batch.ARCHIVE_MODES:
+        raise HTTPException(status_code=400, detail=f"archive must be one of {', '.join(batch.ARCHIVE_MODES)}")
+    
+    variant_policy = request_variant_policy(request)
+    items = batch.plan_items([
+        {"url": str(item.url), "count": item.count, "urlType": item.urlType} for item in request.items
+    ])
+    task_id = str(uuid.uuid4())
+    temp_dir = os.path.join(tempfile.gettempdir(), f"ltk_download_{task_id}")
+    key = json.dumps(["batch", request.archive, variant_policy,
+                      [[item["url"], item["count"], item["urlType"]] for item in items]], sort_keys=True)
+    
+    task_id, created = task_store.create_or_attach(task_id, {
+        "status": "processing",
+        "batch": True,
+        "archive": request.archive,
+        "items": items,
+        "fetched": [],
+        "variant_policy": variant_policy,
+        "temp_dir": temp_dir,
+        "start_time": time.time()
+    }, key)
+    if not created:
+        logger.info(f"Attached batch request to existing task {task_id}")
+        return {"task_id": task_id, "message": "Download already in progress"}
+    
+    os.makedirs(temp_dir, exist_ok=True)
+    
+    try:
+        scheduler.submit(task_id, process_batch, task_id=task_id, items=items, temp_dir=temp_dir,
+                         variant_policy=variant_policy)
+    except QueueFullError as e:
+        logger.warning(f"Rejecting batch task {task_id}: {e}")
+        set_task_status(task_id, "failed", error="Too many downloads in progress")
+        if task_store.release(task_id) == 0:
+            task_store.delete(task_id)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=429, detail="Too many downloads in progress. Please try again later.")
+    
+    return {"task_id": task_id, "message": f"Batch of {len(items)} downloads started"}
+
+# Statuses after which a task produces no more events
+FINAL_STATUSES = ("completed", "failed")
+
+def record_event(task_id: str, event_type: str, **data):
+    """Append a progress event to the task's event log"""
+    task_store.append_event(task_id, {"type": event_type, **data})
+
+def set_task_status(task_id: str, status: str, error: str = None):
+    """Update a task's status and publish the change on its event stream"""
+    fields = {"status": status}
+    if error:
+        fields["error"] = error
+    task_store.update(task_id, **fields)
+    
+    if status == "completed":
+        record_event(task_id, "zip_ready", status=status)
+    elif status == "failed":
+        record_event(task_id, "failed", status=status, error=error)
+    else:
+        record_event(task_id, "status", status=status)
+
+@metrics.timed("task")
+def process_download(task_id: str, url: str, count: int, temp_dir: str, url_type: str = "profile",
+                     variant_policy: dict = None, cancel_event=None):
     """
-    Process a download task in the background
+    Process a download task on a scheduler worker thread
     """
     try:
         logger.info(f"Processing download task {task_id} for URL: {url}")
         
         # Update task status
-        download_tasks[task_id]["status"] = "downloading"
+        set_task_status(task_id, "downloading")
         
-        # Download the media
-        downloaded_files = await download_media(url, count, temp_dir, url_type)
+        # Download the media, recording the pipeline's progress events for the event stream
+        with progress.bind(lambda event_type, data: record_event(task_id, event_type, **data)):
+            downloaded_files = download_media(url, count, temp_dir, url_type, cancel_event=cancel_event,
+                                              variant_policy=variant_policy)
+        
+        if cancel_event is not None and cancel_event.is_set():
+            reason = getattr(cancel_event, "reason", None) or "cancelled"
+            logger.warning(f"Download task {task_id} stopped: {reason}")
+            set_task_status(task_id, "failed", error=f"Download {reason}")
+            return
         
         if not downloaded_files or len(downloaded_files) == 0:
             logger.warning(f"No files were downloaded for task {task_id}")
-            download_tasks[task_id]["status"] = "failed"
-            download_tasks[task_id]["error"] = "No files were downloaded"
+            set_task_status(task_id, "failed", error="No files were downloaded")
             return
         
-        # Create a zip file of all downloaded files
-        zip_path = os.path.join(tempfile.gettempdir(), f"ltk_download_{task_id}.zip")
-        
-        # Create the zip file
-        shutil.make_archive(
-            os.path.splitext(zip_path)[0],  # Remove .zip extension for make_archive
-            'zip',
-            temp_dir
-        )
-        
-        # Update task status
-        download_tasks[task_id]["status"] = "completed"
-        download_tasks[task_id]["download_path"] = zip_path
+        # No archive is built here: get_download streams the zip straight from temp_dir
+        set_task_status(task_id, "completed")
         
         logger.info(f"Download task {task_id} completed successfully")
     except Exception as e:
         logger.error(f"Error processing download task {task_id}: {e}")
-        download_tasks[task_id]["status"] = "failed"
-        download_tasks[task_id]["error"] = str(e)
+        set_task_status(task_id, "failed", error=str(e))
+    finally:
+        task = task_store.get(task_id)
+        metrics.TASKS.inc(status=task["status"] if task else "failed")
+
+@metrics.timed("batch")
+def process_batch(task_id: str, items: list, temp_dir: str, variant_policy: dict = None, cancel_event=None):
+    """
+    Process a batch task on a scheduler worker thread
+    
+    Progress events of each URL carry a "source" field with its folder name;
+    batch_item events report every item's status with the aggregate counts.
+    """
+    def download_item(url, count, target_dir, url_type, cancel_event=None):
+        source = os.path.basename(target_dir)
+        with progress.bind(lambda event_type, data: record_event(task_id, event_type, source=source, **data)):
+            return download_media(url, count, target_dir, url_type, cancel_event=cancel_event,
+                                  variant_policy=variant_policy)
+    
+    def publish(items, item):
+        task_store.update(task_id, items=items)
+        record_event(task_id, "batch_item", index=item["index"], url=item["url"], item_status=item["status"],
+                     files=item["files"], error=item.get("error"), batch=batch.summarize(items))
+    
+    try:
+        logger.info(f"Processing batch task {task_id} with {len(items)} URLs")
+        set_task_status(task_id, "downloading")
+        
+        batch.run_batch(items, temp_dir, download_item, batch.ItemTracker(items, publish), cancel_event=cancel_event)
+        
+        if cancel_event is not None and cancel_event.is_set():
+            reason = getattr(cancel_event, "reason", None) or "cancelled"
+            logger.warning(f"Batch task {task_id} stopped: {reason}")
+            set_task_status(task_id, "failed", error=f"Download {reason}")
+            return
+        
+        # A batch with some failed URLs still completes; the failures are listed per item
+        summary = batch.summarize(items)
+        if summary["files"] == 0:
+            set_task_status(task_id, "failed", error="No files were downloaded")
+            return
+        
+        set_task_status(task_id, "completed")
+        logger.info(f"Batch task {task_id} completed: {summary}")
+    except Exception as e:
+        logger.error(f"Error processing batch task {task_id}: {e}")
+        set_task_status(task_id, "failed", error=str(e))
+    finally:
+        task = task_store.get(task_id)
+        metrics.TASKS.inc(status=task["status"] if task else "failed")
+
+@app.delete("/api/download/{task_id}")
+def cancel_download(task_id: str):
+    """Cancel a queued or running download task"""
+    logger.info(f"Cancel request for task {task_id}")
+    task = task_store.get(task_id)
+    if task is None:
+        logger.warning(f"Task {task_id} not found")
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    # A task shared by identical requests keeps running for the others
+    if task.get("refs", 1) > 1 and task["status"] not in FINAL_STATUSES:
+        remaining = task_store.release(task_id)
+        logger.info(f"Detached a request from task {task_id}; {remaining} still waiting on it")
+        return {"task_id": task_id, "message": "Download cancelled"}
+    
+    if not scheduler.cancel(task_id):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Task is not running in this worker. Current status: {task['status']}"
+        )
+    
+    set_task_status(task_id, "failed", error="Download cancelled")
+    return {"task_id": task_id, "message": "Download cancelled"}
 
 @app.get("/api/download/{task_id}/status")
-async def check_download_status(task_id: str):
+def check_download_status(task_id: str):
     """Check the status of a download task"""
     logger.info(f"Checking status for task {task_id}")
-    if task_id not in download_tasks:
+    task = task_store.get(task_id)
+    if task is None:
         logger.warning(f"Task {task_id} not found")
         raise HTTPException(status_code=404, detail="Task not found")
     
-    return {"status": download_tasks[task_id]["status"]}
+    response = {"status": task["status"]}
+    if task.get("error"):
+        response["error"] = task["error"]
+    if task.get("batch"):
+        response["batch"] = batch.summarize(task["items"])
+    return response
+
+@app.get("/api/download/{task_id}/events")
+async def stream_download_events(task_id: str, request: Request):
+    """
+    Stream a task's progress as Server-Sent Events
+    
+    Events: status, posts_discovered, item_started, item_finished, item_failed,
+    file_saved, zip_ready and failed. Clients that reconnect with Last-Event-ID
+    resume after the last event they saw. The stream ends once the task has
+    finished and its final event has been sent.
+    """
+    task = await run_in_threadpool(task_store.get, task_id)
+    if task is None:
+        logger.warning(f"Task {task_id} not found")
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    try:
+        last_event_id = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        last_event_id = 0
+    
+    async def event_stream():
+        nonlocal last_event_id
+        # Tell the client the current state straight away
+        snapshot = {"type": "status", "status": task["status"]}
+        if task.get("error"):
+            snapshot["error"] = task["error"]
+        yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+        
+        idle_since = time.time()
+        while not await request.is_disconnected():
+            events = await run_in_threadpool(task_store.events_since, task_id, last_event_id)
+            for event_id, event in events:
+                last_event_id = event_id
+                yield f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            
+            if events:
+                idle_since = time.time()
+                if events[-1][1].get("status") in FINAL_STATUSES:
+                    break
+            else:
+                current = await run_in_threadpool(task_store.get, task_id)
+                if current is None:
+                    break
+                if current["status"] in FINAL_STATUSES:
+                    # Finished without its final event reaching us (e.g. it was
+                    # written in between the two reads); send it from the task state
+                    final = {"type": "zip_ready" if current["status"] == "completed" else "failed",
+                             "status": current["status"], "error": current.get("error")}
+                    yield f"event: {final['type']}\ndata: {json.dumps(final)}\n\n"
+                    break
+                # Comment line as a heartbeat, so proxies don't close an idle stream
+                if time.time() - idle_since > 15:
+                    yield ": keep-alive\n\n"
+                    idle_since = time.time()
+            
+            await asyncio.sleep(0.5)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/api/download/{task_id}")
-async def get_download(task_id: str):
-    """Get the downloaded zip file"""
+def get_download(task_id: str):
+    """
+    Get the downloaded zip file
+    
+    A single download can be fetched while it is still running: the zip
+    starts with the files saved so far and grows as posts finish, ending
+    when the task completes (or breaking off if it fails).
+    """
     logger.info(f"Download request for task {task_id}")
-    if task_id not in download_tasks:
+    task = task_store.get(task_id)
+    if task is None:
         logger.warning(f"Task {task_id} not found")
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = download_tasks[task_id]
-    
-    if task["status"] != "completed":
+    # A batch's layout (shared media, per-URL folders) is only known once it has finished
+    if task["status"] == "failed" or (task.get("batch") and task["status"] != "completed"):
         logger.warning(f"Download not ready for task {task_id}. Status: {task['status']}")
         raise HTTPException(
             status_code=400, 
             detail=f"Download not ready. Current status: {task['status']}"
         )
     
-    zip_path = task["download_path"]
-    logger.info(f"Serving zip file from {zip_path}")
-    
-    # Schedule cleanup for after the file is served
-    # (not removing right away to allow the file to be downloaded)
-    def cleanup():
-        try:
-            # Check if the task still exists in the dictionary
-            if task_id in download_tasks:
-                # Check if the zip file exists before trying to delete it
-                if os.path.exists(zip_path):
-                    os.remove(zip_path)
-                    logger.info(f"Deleted zip file: {zip_path}")
-                else:
-                    logger.info(f"Zip file already deleted: {zip_path}")
-                
-                # Check if the directory exists before trying to delete it
-                if os.path.exists(task["temp_dir"]):
-                    shutil.rmtree(task["temp_dir"], ignore_errors=True)
-                    logger.info(f"Deleted directory: {task['temp_dir']}")
-                else:
-                    logger.info(f"Directory already deleted: {task['temp_dir']}")
-                
-                # Remove the task from the dictionary
-                download_tasks.pop(task_id, None)
-                logger.info(f"Cleaned up resources for task {task_id}")
-            else:
-                logger.info(f"Task {task_id} already cleaned up")
-        except Exception as e:
-            logger.error(f"Error during cleanup for task {task_id}: {e}")
+    temp_dir = task["temp_dir"]
+    logger.info(f"Streaming zip of {temp_dir}")
     
+    # Schedule cleanup for after the zip is streamed
+    # (not removing right away to allow the files to be read)
     background_tasks = BackgroundTasks()
-    background_tasks.add_task(cleanup)
+    background_tasks.add_task(release_task, task_id, temp_dir)
+    
+    # A batch gets a folder per URL, with media shared between URLs stored once
+    if task.get("batch"):
+        entries = batch.iter_batch_entries(temp_dir, task["items"], list_files)
+    else:
+        entries = iter_task_entries(task_store, task_id, temp_dir)
     
-    return FileResponse(
-        zip_path, 
+    # Build the zip on the fly (STORED for media) and send it as a chunked response
+    return StreamingResponse(
+        metrics.timed_iter(iter_zip(entries), "zip", task_id=task_id),
         media_type="application/zip",
-        filename="downloaded_media.zip",
+        headers={"Content-Disposition": 'attachment; filename="downloaded_media.zip"'},
+        background=background_tasks
+    )
+
+def release_task(task_id: str, temp_dir: str):
+    """Drop one request's hold on a fetched task; the last one deletes its files"""
+    try:
+        # Check if the task still exists in the store
+        if task_store.get(task_id) is not None:
+            # Identical requests share the task; the last one to fetch it cleans up
+            remaining = task_store.release(task_id)
+            if remaining > 0:
+                logger.info(f"Keeping files of task {task_id} for {remaining} more requests")
+                return
+            
+            # Delete the temp dir (and any leftover zip) if they still exist
+            remove_task_files(task_id, temp_dir)
+            
+            # Remove the task from the store
+            task_store.delete(task_id)
+            logger.info(f"Cleaned up resources for task {task_id}")
+        else:
+            logger.info(f"Task {task_id} already cleaned up")
+    except Exception as e:
+        logger.error(f"Error during cleanup for task {task_id}: {e}")
+
+def get_batch_task(task_id: str):
+    task = task_store.get(task_id)
+    if task is None or not task.get("batch"):
+        logger.warning(f"Batch task {task_id} not found")
+        raise HTTPException(status_code=404, detail="Batch task not found")
+    return task
+
+@app.get("/api/batch/{task_id}")
+def get_batch_manifest(task_id: str):
+    """List a batch's URLs with their status, file counts and per-URL archive links"""
+    task = get_batch_task(task_id)
+    items = []
+    for item in task["items"]:
+        entry = {key: item.get(key) for key in ("index", "url", "urlType", "count", "status", "files", "error")}
+        if task["status"] == "completed" and item["status"] == "completed":
+            entry["download_url"] = f"/api/batch/{task_id}/items/{item['index']}"
+        items.append(entry)
+    
+    response = {"task_id": task_id, "status": task["status"], "archive": task["archive"],
+                "batch": batch.summarize(task["items"]), "items": items}
+    if task["status"] == "completed":
+        response["download_url"] = f"/api/download/{task_id}"
+    return response
+
+@app.get("/api/batch/{task_id}/items/{index}")
+def get_batch_item(task_id: str, index: int):
+    """Get the zip of one URL of a completed batch"""
+    task = get_batch_task(task_id)
+    if task["status"] != "completed":
+        raise HTTPException(status_code=400, detail=f"Download not ready. Current status: {task['status']}")
+    if not 0 <= index < len(task["items"]) or task["items"][index]["status"] != "completed":
+        raise HTTPException(status_code=404, detail="Batch item not found or not downloaded")
+    
+    item = task["items"][index]
+    item_dir = os.path.join(task["temp_dir"], item["dir"])
+    
+    def mark_fetched():
+        # Once every downloaded URL has been fetched the batch is released like a
+        # single download; a fetch lost to a concurrent update leaves it to the reaper
+        current = task_store.get(task_id)
+        if current is None:
+            return
+        fetched = sorted(set(current.get("fetched", [])) | {index})
+        task_store.update(task_id, fetched=fetched)
+        if all(item["index"] in fetched for item in current["items"] if item["status"] == "completed"):
+            release_task(task_id, current["temp_dir"])
+    
+    background_tasks = BackgroundTasks()
+    background_tasks.add_task(mark_fetched)
+    
+    return StreamingResponse(
+        metrics.timed_iter(iter_zip(list_files(item_dir)), "zip", task_id=task_id, item=index),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{item["dir"]}.zip"'},
         background=background_tasks
     )
 
@@ -278,10 +724,19 @@ async def get_download(task_id: str):
 def read_root():
     return {"message": "Media Downloader API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Stage timings, counters and gauges in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/health")
 def health_check():
     """Health check endpoint for Docker healthcheck"""
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "queued": scheduler.queue_depth(),
+        "running": scheduler.running_count()
+    }
 
 if __name__ == "__main__":
     import uvicorn
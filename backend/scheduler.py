@@ -0,0 +1,191 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Scheduler configuration (overridable through the environment)
+DEFAULT_WORKERS = int(os.environ.get("LTK_WORKERS", "2"))
+DEFAULT_MAX_QUEUE = int(os.environ.get("LTK_MAX_QUEUE", "20"))
+DEFAULT_JOB_TIMEOUT = float(os.environ.get("LTK_JOB_TIMEOUT", "1800"))
+
+class QueueFullError(Exception):
+    pass
+
+class CancelToken(threading.Event):
+    """
+    Event handed to every job so it can stop cooperatively
+
+    Jobs run on plain threads, which can't be killed, so cancellation and
+    timeouts set this token and the job checks it between units of work.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.reason = None
+
+    def cancel(self, reason="cancelled"):
+        if not self.is_set():
+            self.reason = reason
+            self.set()
+
+class Job:
+    def __init__(self, job_id, fn, args, kwargs, timeout):
+        self.id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.cancel_token = CancelToken()
+        self.status = "queued"
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+class JobScheduler:
+    """
+    FIFO job queue served by a fixed number of worker threads
+
+    submit() refuses new jobs once max_queue jobs are waiting, so the API can
+    push back instead of piling up work. Each job is called as
+    fn(*args, cancel_event=<CancelToken>, **kwargs); cancel() and the per-job
+    timeout both fire that token.
+    """
+
+    def __init__(self, workers=None, max_queue=None, job_timeout=None):
+        self.workers = max(1, workers or DEFAULT_WORKERS)
+        self.max_queue = max(1, max_queue or DEFAULT_MAX_QUEUE)
+        self.job_timeout = job_timeout or DEFAULT_JOB_TIMEOUT
+
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Start the worker threads and the timeout watchdog"""
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"download-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        watchdog = threading.Thread(target=self._watchdog, name="download-watchdog", daemon=True)
+        watchdog.start()
+        self._threads.append(watchdog)
+        logger.info(f"Job scheduler started with {self.workers} workers (max queue {self.max_queue})")
+
+    def shutdown(self, wait=False):
+        """Cancel every queued and running job and stop the workers"""
+        self._stopping.set()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel_token.cancel("shutting down")
+
+        # Wake up idle workers
+        for _ in range(self.workers):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+        logger.info("Job scheduler stopped")
+
+    def submit(self, job_id, fn, *args, timeout=None, **kwargs):
+        """
+        Queue a job
+
+        Args:
+            job_id (str): Unique job identifier
+            fn (callable): Function to run on a worker thread
+            timeout (float): Wall-clock limit for the job once it starts (default: job_timeout)
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            QueueFullError: If max_queue jobs are already waiting
+        """
+        job = Job(job_id, fn, args, kwargs, timeout or self.job_timeout)
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(f"Download queue is full ({self.max_queue} jobs waiting)")
+            self._jobs[job_id] = job
+        logger.info(f"Queued job {job_id} (queue depth {self.queue_depth()})")
+        return job
+
+    def cancel(self, job_id, reason="cancelled"):
+        """
+        Cancel a queued or running job
+
+        Returns:
+            bool: True if the job was found and not already finished
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancel_token.cancel(reason)
+        logger.info(f"Cancellation requested for job {job_id} ({reason})")
+        return True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def running_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == "running")
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            job = self._queue.get()
+            if job is None:
+                break
+
+            try:
+                if job.cancel_token.is_set():
+                    # Cancelled while still waiting in the queue
+                    job.status = "cancelled"
+                    continue
+
+                job.status = "running"
+                job.started_at = time.time()
+                try:
+                    job.fn(*job.args, cancel_event=job.cancel_token, **job.kwargs)
+                    job.status = "cancelled" if job.cancel_token.is_set() else "completed"
+                except Exception as e:
+                    logger.error(f"Job {job.id} failed: {e}")
+                    job.status = "failed"
+                    job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self._jobs.pop(job.id, None)
+                self._queue.task_done()
+
+    def _watchdog(self):
+        while not self._stopping.wait(1):
+            now = time.time()
+            with self._lock:
+                running = [job for job in self._jobs.values() if job.status == "running"]
+            for job in running:
+                if job.started_at and now - job.started_at > job.timeout:
+                    logger.warning(f"Job {job.id} exceeded its {job.timeout:.0f}s timeout")
+                    job.cancel_token.cancel("timed out")
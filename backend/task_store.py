@@ -0,0 +1,510 @@
+import os
+import time
+import json
+import shutil
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Task store configuration (overridable through the environment)
+DEFAULT_BACKEND = os.environ.get("LTK_TASK_STORE", "sqlite")
+DEFAULT_DB_PATH = os.environ.get("LTK_TASK_DB", os.path.join(tempfile.gettempdir(), "ltk_tasks.db"))
+DEFAULT_TTL = float(os.environ.get("LTK_TASK_TTL", "3600"))
+DEFAULT_CACHE_SIZE = int(os.environ.get("LTK_TASK_CACHE_SIZE", "1024"))
+DEFAULT_CACHE_TTL = float(os.environ.get("LTK_TASK_CACHE_TTL", "1.0"))
+DEFAULT_REAPER_INTERVAL = float(os.environ.get("LTK_REAPER_INTERVAL", "300"))
+
+# Prefix of the per-task temp dirs and zips created by the API
+TASK_DIR_PREFIX = "ltk_download_"
+
+class TaskStore:
+    """
+    Interface for download task state
+
+    Tasks are plain JSON-serialisable dicts. Every write pushes the task's
+    expiry ttl seconds into the future; expired() lists the ids that have not
+    been touched since. Each task also has an append-only log of progress
+    events, read back incrementally with events_since().
+
+    Tasks created with create_or_attach() carry a coalescing key and a
+    reference count ("refs"): identical requests share the live task with
+    that key, and release() tells the last holder when it may clean up.
+    """
+
+    def create(self, task_id, task):
+        raise NotImplementedError
+
+    def get(self, task_id):
+        raise NotImplementedError
+
+    def update(self, task_id, **fields):
+        raise NotImplementedError
+
+    def delete(self, task_id):
+        raise NotImplementedError
+
+    def expired(self, now=None):
+        raise NotImplementedError
+
+    def ids(self):
+        raise NotImplementedError
+
+    def append_event(self, task_id, event):
+        raise NotImplementedError
+
+    def events_since(self, task_id, after_id=0):
+        raise NotImplementedError
+
+    def create_or_attach(self, task_id, task, key):
+        """
+        Create a task, or take a reference to the live task with the same key
+
+        A task is live while it is still processing or downloading.
+
+        Returns:
+            tuple: (id of the task to use, True if it was created)
+        """
+        raise NotImplementedError
+
+    def release(self, task_id):
+        """
+        Drop one reference to a task
+
+        Releasing the last reference also drops the task's coalescing key, in
+        the same step, so requests arriving while its files are being removed
+        start a new task instead of joining one that is about to be deleted.
+
+        Returns:
+            int: References left (0 if the task is gone)
+        """
+        raise NotImplementedError
+
+# Statuses of a task that identical requests may still share
+JOINABLE_STATUSES = ("processing", "downloading")
+
+def _joinable(task):
+    """
+    Whether a request can share an existing task
+
+    Only running tasks are shared: a finished task's files belong to the
+    requests already holding it and go away once they have fetched them.
+    """
+    return task is not None and task.get("status") in JOINABLE_STATUSES
+
+class MemoryTaskStore(TaskStore):
+    """Process-local store; only safe with a single uvicorn worker"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or DEFAULT_TTL
+        self._tasks = {}
+        self._expires = {}
+        self._events = {}
+        self._keys = {}
+        self._next_event_id = 1
+        self._lock = threading.Lock()
+
+    def create(self, task_id, task):
+        with self._lock:
+            self._tasks[task_id] = dict(task)
+            self._expires[task_id] = time.time() + self.ttl
+
+    def get(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task) if task is not None else None
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            task.update(fields)
+            self._expires[task_id] = time.time() + self.ttl
+            return dict(task)
+
+    def delete(self, task_id):
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            self._expires.pop(task_id, None)
+            self._events.pop(task_id, None)
+            if task is not None and self._keys.get(task.get("key")) == task_id:
+                del self._keys[task["key"]]
+
+    def expired(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            return [task_id for task_id, expires_at in self._expires.items() if expires_at <= now]
+
+    def ids(self):
+        with self._lock:
+            return list(self._tasks)
+
+    def append_event(self, task_id, event):
+        with self._lock:
+            event_id = self._next_event_id
+            self._next_event_id += 1
+            self._events.setdefault(task_id, []).append((event_id, dict(event)))
+            return event_id
+
+    def events_since(self, task_id, after_id=0):
+        with self._lock:
+            return [(event_id, dict(event)) for event_id, event in self._events.get(task_id, []) if event_id > after_id]
+
+    def create_or_attach(self, task_id, task, key):
+        with self._lock:
+            existing_id = self._keys.get(key)
+            existing = self._tasks.get(existing_id)
+            if _joinable(existing):
+                existing["refs"] = existing.get("refs", 1) + 1
+                self._expires[existing_id] = time.time() + self.ttl
+                return existing_id, False
+
+            self._tasks[task_id] = dict(task, key=key, refs=1)
+            self._expires[task_id] = time.time() + self.ttl
+            self._keys[key] = task_id
+            return task_id, True
+
+    def release(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return 0
+            task["refs"] = max(0, task.get("refs", 1) - 1)
+            if task["refs"] == 0 and self._keys.get(task.get("key")) == task_id:
+                del self._keys[task["key"]]
+            return task["refs"]
+
+class SQLiteTaskStore(TaskStore):
+    """
+    Task store backed by a SQLite database in WAL mode
+
+    WAL lets several uvicorn worker processes read while one writes, so any
+    worker can answer status and download requests for any task.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or DEFAULT_DB_PATH
+        self.ttl = ttl or DEFAULT_TTL
+        self._local = threading.local()
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_expires_at ON tasks (expires_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS task_events ("
+                " event_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " task_id TEXT NOT NULL,"
+                " data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS task_events_task_id ON task_events (task_id, event_id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS task_keys ("
+                " key TEXT PRIMARY KEY,"
+                " task_id TEXT NOT NULL)"
+            )
+        logger.info(f"Using SQLite task store at {self.path}")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, task_id, task):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO tasks (task_id, data, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+            (task_id, json.dumps(task), now, now + self.ttl)
+        )
+
+    def get(self, task_id):
+        row = self._connection().execute(
+            "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id, **fields):
+        conn = self._connection()
+        # Read-modify-write under a write lock so concurrent updates don't clobber each other
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            task = json.loads(row[0])
+            task.update(fields)
+            now = time.time()
+            conn.execute(
+                "UPDATE tasks SET data = ?, updated_at = ?, expires_at = ? WHERE task_id = ?",
+                (json.dumps(task), now, now + self.ttl, task_id)
+            )
+            conn.execute("COMMIT")
+            return task
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, task_id):
+        conn = self._connection()
+        conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        conn.execute("DELETE FROM task_events WHERE task_id = ?", (task_id,))
+        conn.execute("DELETE FROM task_keys WHERE task_id = ?", (task_id,))
+
+    def expired(self, now=None):
+        now = now or time.time()
+        rows = self._connection().execute(
+            "SELECT task_id FROM tasks WHERE expires_at <= ?", (now,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def ids(self):
+        return [row[0] for row in self._connection().execute("SELECT task_id FROM tasks").fetchall()]
+
+    def append_event(self, task_id, event):
+        cursor = self._connection().execute(
+            "INSERT INTO task_events (task_id, data) VALUES (?, ?)", (task_id, json.dumps(event))
+        )
+        return cursor.lastrowid
+
+    def events_since(self, task_id, after_id=0):
+        rows = self._connection().execute(
+            "SELECT event_id, data FROM task_events WHERE task_id = ? AND event_id > ? ORDER BY event_id",
+            (task_id, after_id)
+        ).fetchall()
+        return [(event_id, json.loads(data)) for event_id, data in rows]
+
+    def create_or_attach(self, task_id, task, key):
+        conn = self._connection()
+        # The lookup and the insert (or the reference) happen under one write lock,
+        # so concurrent identical requests in any worker process end up on one task
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT t.task_id, t.data FROM task_keys k JOIN tasks t ON t.task_id = k.task_id WHERE k.key = ?",
+                (key,)
+            ).fetchone()
+            if row is not None and _joinable(json.loads(row[1])):
+                existing = json.loads(row[1])
+                existing["refs"] = existing.get("refs", 1) + 1
+                conn.execute(
+                    "UPDATE tasks SET data = ?, updated_at = ?, expires_at = ? WHERE task_id = ?",
+                    (json.dumps(existing), now, now + self.ttl, row[0])
+                )
+                conn.execute("COMMIT")
+                return row[0], False
+
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, data, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                (task_id, json.dumps(dict(task, key=key, refs=1)), now, now + self.ttl)
+            )
+            conn.execute("INSERT OR REPLACE INTO task_keys (key, task_id) VALUES (?, ?)", (key, task_id))
+            conn.execute("COMMIT")
+            return task_id, True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, task_id):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return 0
+            task = json.loads(row[0])
+            task["refs"] = max(0, task.get("refs", 1) - 1)
+            conn.execute("UPDATE tasks SET data = ? WHERE task_id = ?", (json.dumps(task), task_id))
+            if task["refs"] == 0:
+                conn.execute("DELETE FROM task_keys WHERE task_id = ?", (task_id,))
+            conn.execute("COMMIT")
+            return task["refs"]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+class CachedTaskStore(TaskStore):
+    """
+    LRU cache with a short TTL in front of another store
+
+    Reads are served from memory for cache_ttl seconds, which absorbs the
+    status polling traffic; writes always go through to the backing store. The
+    TTL is kept short so changes made by other worker processes show up quickly.
+    """
+
+    def __init__(self, backend, max_entries=None, cache_ttl=None):
+        self.backend = backend
+        self.max_entries = max_entries or DEFAULT_CACHE_SIZE
+        self.cache_ttl = DEFAULT_CACHE_TTL if cache_ttl is None else cache_ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, task_id, task):
+        with self._lock:
+            if task is None:
+                self._cache.pop(task_id, None)
+                return
+            self._cache[task_id] = (dict(task), time.time())
+            self._cache.move_to_end(task_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def create(self, task_id, task):
+        self.backend.create(task_id, task)
+        self._remember(task_id, task)
+
+    def get(self, task_id):
+        with self._lock:
+            entry = self._cache.get(task_id)
+            if entry is not None and time.time() - entry[1] < self.cache_ttl:
+                self._cache.move_to_end(task_id)
+                return dict(entry[0])
+
+        task = self.backend.get(task_id)
+        self._remember(task_id, task)
+        return task
+
+    def update(self, task_id, **fields):
+        task = self.backend.update(task_id, **fields)
+        self._remember(task_id, task)
+        return task
+
+    def delete(self, task_id):
+        self.backend.delete(task_id)
+        self._remember(task_id, None)
+
+    def expired(self, now=None):
+        return self.backend.expired(now)
+
+    def ids(self):
+        return self.backend.ids()
+
+    # Events are a log that is read incrementally; they are never cached
+    def append_event(self, task_id, event):
+        return self.backend.append_event(task_id, event)
+
+    def events_since(self, task_id, after_id=0):
+        return self.backend.events_since(task_id, after_id)
+
+    def create_or_attach(self, task_id, task, key):
+        used_id, created = self.backend.create_or_attach(task_id, task, key)
+        self._remember(used_id, None)
+        return used_id, created
+
+    def release(self, task_id):
+        refs = self.backend.release(task_id)
+        self._remember(task_id, None)
+        return refs
+
+def create_task_store(backend=None):
+    """
+    Build the task store selected by LTK_TASK_STORE ("sqlite" or "memory")
+
+    Returns:
+        TaskStore: The store, wrapped in an in-memory cache
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == "memory":
+        return CachedTaskStore(MemoryTaskStore())
+    if backend == "sqlite":
+        return CachedTaskStore(SQLiteTaskStore())
+    raise ValueError(f"Unknown task store backend: {backend}")
+
+def remove_task_files(task_id, temp_dir=None):
+    """Delete a task's temp dir and any zip left next to it"""
+    temp_root = tempfile.gettempdir()
+    temp_dir = temp_dir or os.path.join(temp_root, f"{TASK_DIR_PREFIX}{task_id}")
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        logger.info(f"Deleted directory: {temp_dir}")
+
+    zip_path = os.path.join(temp_root, f"{TASK_DIR_PREFIX}{task_id}.zip")
+    if os.path.exists(zip_path):
+        os.remove(zip_path)
+        logger.info(f"Deleted zip file: {zip_path}")
+
+class TaskReaper:
+    """
+    Background thread that expires tasks and deletes orphaned task files
+
+    Each pass removes tasks whose TTL has passed (with their temp dirs), then
+    any ltk_download_* dir or zip in the temp dir that no task refers to and
+    that hasn't been modified for a full TTL.
+    """
+
+    def __init__(self, store, interval=None, ttl=None, is_active=None):
+        self.store = store
+        self.interval = interval or DEFAULT_REAPER_INTERVAL
+        self.ttl = ttl or DEFAULT_TTL
+        # Optional callback telling the reaper a task is still being worked on locally
+        self.is_active = is_active or (lambda task_id: False)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="task-reaper", daemon=True)
+        self._thread.start()
+        logger.info(f"Task reaper started (interval {self.interval:.0f}s, TTL {self.ttl:.0f}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Error reaping tasks: {e}")
+
+    def reap(self):
+        """Run a single reaper pass"""
+        now = time.time()
+
+        for task_id in self.store.expired(now):
+            if self.is_active(task_id):
+                continue
+            task = self.store.get(task_id) or {}
+            remove_task_files(task_id, task.get("temp_dir"))
+            self.store.delete(task_id)
+            logger.info(f"Expired task {task_id}")
+
+        known = set(self.store.ids())
+        temp_root = tempfile.gettempdir()
+        for name in os.listdir(temp_root):
+            if not name.startswith(TASK_DIR_PREFIX):
+                continue
+            task_id = name[len(TASK_DIR_PREFIX):]
+            if task_id.endswith(".zip"):
+                task_id = task_id[:-4]
+            if task_id in known or self.is_active(task_id):
+                continue
+
+            path = os.path.join(temp_root, name)
+            try:
+                if now - os.path.getmtime(path) < self.ttl:
+                    continue
+            except OSError:
+                continue
+            remove_task_files(task_id)
+            logger.info(f"Removed orphaned task files: {path}")
@@ -0,0 +1,88 @@
+import time
+import threading
+
+import pytest
+
+from backend.scheduler import JobScheduler, QueueFullError
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.01)
+
+@pytest.fixture
+def scheduler():
+    scheduler = JobScheduler(workers=1, max_queue=2)
+    yield scheduler
+    scheduler.shutdown(wait=True)
+
+def test_submit_refuses_jobs_beyond_max_queue(scheduler):
+    # Not started, so nothing leaves the queue
+    scheduler.submit("a", lambda cancel_event: None)
+    scheduler.submit("b", lambda cancel_event: None)
+    with pytest.raises(QueueFullError):
+        scheduler.submit("c", lambda cancel_event: None)
+    assert scheduler.queue_depth() == 2
+    assert scheduler.get("c") is None
+
+def test_job_runs_with_its_cancel_token(scheduler):
+    calls = []
+    scheduler.start()
+    job = scheduler.submit("a", lambda value, cancel_event, extra: calls.append((value, cancel_event, extra)),
+                           1, extra=2)
+    wait_until(lambda: job.finished_at is not None)
+    assert job.status == "completed"
+    assert calls == [(1, job.cancel_token, 2)]
+    # Finished jobs are forgotten, freeing their slot
+    assert scheduler.get("a") is None
+
+def test_cancel_stops_a_running_job(scheduler):
+    started = threading.Event()
+
+    def job_fn(cancel_event):
+        started.set()
+        cancel_event.wait(5)
+
+    scheduler.start()
+    job = scheduler.submit("a", job_fn)
+    assert started.wait(5)
+    assert scheduler.running_count() == 1
+    assert scheduler.cancel("a")
+    wait_until(lambda: job.finished_at is not None)
+    assert job.status == "cancelled"
+    assert job.cancel_token.reason == "cancelled"
+
+def test_job_cancelled_in_the_queue_never_runs(scheduler):
+    release = threading.Event()
+    ran = []
+    scheduler.start()
+    first = scheduler.submit("a", lambda cancel_event: release.wait(5))
+    wait_until(lambda: first.status == "running")
+    second = scheduler.submit("b", lambda cancel_event: ran.append(True))
+    scheduler.cancel("b")
+    release.set()
+    wait_until(lambda: second.finished_at is not None)
+    assert second.status == "cancelled"
+    assert ran == []
+
+def test_failing_job_records_its_error(scheduler):
+    def job_fn(cancel_event):
+        raise RuntimeError("boom")
+
+    scheduler.start()
+    job = scheduler.submit("a", job_fn)
+    wait_until(lambda: job.finished_at is not None)
+    assert job.status == "failed"
+    assert job.error == "boom"
+
+def test_watchdog_cancels_jobs_past_their_timeout(scheduler):
+    scheduler.start()
+    job = scheduler.submit("a", lambda cancel_event: cancel_event.wait(10), timeout=0.1)
+    wait_until(lambda: job.finished_at is not None, timeout=5)
+    assert job.status == "cancelled"
+    assert job.cancel_token.reason == "timed out"
+
+def test_cancel_unknown_job(scheduler):
+    assert not scheduler.cancel("missing")
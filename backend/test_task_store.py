@@ -0,0 +1,162 @@
+import os
+import time
+import tempfile
+import threading
+
+import pytest
+
+from backend.task_store import MemoryTaskStore, SQLiteTaskStore, TaskReaper, TASK_DIR_PREFIX
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(ttl=60):
+        if request.param == "memory":
+            return MemoryTaskStore(ttl=ttl)
+        return SQLiteTaskStore(path=str(tmp_path / "tasks.db"), ttl=ttl)
+    return make
+
+@pytest.fixture
+def temp_root(tmp_path, monkeypatch):
+    """Point the task files (and the reaper's scan) at a private temp dir"""
+    root = tmp_path / "tmp"
+    root.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(root))
+    return root
+
+def task_dir(root, task_id, age=0):
+    path = root / f"{TASK_DIR_PREFIX}{task_id}"
+    path.mkdir()
+    (path / "image_0_0.jpg").write_bytes(b"x")
+    if age:
+        stamp = time.time() - age
+        os.utime(str(path), (stamp, stamp))
+    return path
+
+def test_tasks_expire_ttl_after_their_last_write(make_store):
+    store = make_store(ttl=1)
+    store.create("a", {"status": "processing"})
+    assert store.expired() == []
+    assert store.expired(now=time.time() + 1.5) == ["a"]
+
+    # A write pushes the expiry out again
+    time.sleep(0.6)
+    store.update("a", status="completed")
+    assert store.expired(now=time.time() + 0.6) == []
+    assert store.get("a") == {"status": "completed"}
+
+def test_delete_drops_the_task_and_its_events(make_store):
+    store = make_store()
+    store.create("a", {"status": "processing"})
+    store.append_event("a", {"type": "item_finished"})
+    store.delete("a")
+    assert store.get("a") is None
+    assert store.events_since("a") == []
+    assert store.expired(now=time.time() + 120) == []
+
+def test_reaper_removes_expired_tasks_and_their_files(make_store, temp_root):
+    store = make_store(ttl=0.1)
+    path = task_dir(temp_root, "old")
+    store.create("old", {"status": "completed", "temp_dir": str(path)})
+    store.create("busy", {"status": "processing"})
+    time.sleep(0.2)
+
+    TaskReaper(store, ttl=60, is_active=lambda task_id: task_id == "busy").reap()
+
+    assert store.get("old") is None
+    assert not path.exists()
+    # Tasks still being worked on locally are left alone
+    assert store.get("busy") is not None
+
+def test_reaper_removes_orphaned_files_once_stale(make_store, temp_root):
+    store = make_store(ttl=60)
+    known = task_dir(temp_root, "known", age=120)
+    store.create("known", {"status": "completed", "temp_dir": str(known)})
+    stale = task_dir(temp_root, "stale", age=120)
+    stale_zip = temp_root / f"{TASK_DIR_PREFIX}stale.zip"
+    stale_zip.write_bytes(b"PK")
+    fresh = task_dir(temp_root, "fresh")
+    unrelated = temp_root / "something_else"
+    unrelated.mkdir()
+
+    TaskReaper(store, ttl=60).reap()
+
+    assert not stale.exists()
+    assert not stale_zip.exists()
+    assert known.exists()
+    assert fresh.exists()
+    assert unrelated.exists()
+
+def test_identical_requests_share_one_task(make_store):
+    store = make_store()
+    first, created = store.create_or_attach("a", {"status": "processing"}, "key")
+    assert (first, created) == ("a", True)
+    second, created = store.create_or_attach("b", {"status": "processing"}, "key")
+    assert (second, created) == ("a", False)
+    assert store.get("b") is None
+    assert store.get("a")["refs"] == 2
+
+    other, created = store.create_or_attach("c", {"status": "processing"}, "other key")
+    assert (other, created) == ("c", True)
+
+def test_release_counts_down_to_the_last_holder(make_store):
+    store = make_store()
+    for task_id in ("a", "b", "c"):
+        store.create_or_attach(task_id, {"status": "processing"}, "key")
+    assert store.get("a")["refs"] == 3
+    assert store.release("a") == 2
+    assert store.release("a") == 1
+    assert store.release("a") == 0
+    # Never below zero, and nothing to release once the task is gone
+    assert store.release("a") == 0
+    store.delete("a")
+    assert store.release("a") == 0
+
+def test_failed_or_deleted_tasks_are_not_joined(make_store):
+    store = make_store()
+    store.create_or_attach("a", {"status": "processing"}, "key")
+    store.update("a", status="failed")
+    assert store.create_or_attach("b", {"status": "processing"}, "key") == ("b", True)
+
+    store.delete("b")
+    assert store.create_or_attach("c", {"status": "processing"}, "key") == ("c", True)
+    assert store.get("c")["refs"] == 1
+
+def test_only_running_tasks_are_joined(make_store):
+    store = make_store()
+    store.create_or_attach("a", {"status": "processing"}, "key")
+    store.update("a", status="downloading")
+    assert store.create_or_attach("b", {"status": "processing"}, "key") == ("a", False)
+
+    # Finished, possibly fetched already: a new request gets a new task
+    store.update("a", status="completed")
+    assert store.create_or_attach("c", {"status": "processing"}, "key") == ("c", True)
+    assert store.get("a")["refs"] == 2
+
+def test_released_task_is_not_joined_before_it_is_deleted(make_store):
+    store = make_store()
+    store.create_or_attach("a", {"status": "downloading"}, "key")
+    assert store.release("a") == 0
+    # The last holder is still cleaning up; a new request must not attach to it
+    assert store.create_or_attach("b", {"status": "processing"}, "key") == ("b", True)
+    store.delete("a")
+    assert store.create_or_attach("c", {"status": "processing"}, "key") == ("b", False)
+
+def test_concurrent_identical_requests_end_up_on_one_task(make_store):
+    store = make_store()
+    results = []
+    lock = threading.Lock()
+
+    def request(task_id):
+        used = store.create_or_attach(task_id, {"status": "processing"}, "key")
+        with lock:
+            results.append(used)
+
+    threads = [threading.Thread(target=request, args=(f"t{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({task_id for task_id, _ in results}) == 1
+    assert sum(created for _, created in results) == 1
+    assert store.get(results[0][0])["refs"] == 8
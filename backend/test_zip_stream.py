@@ -0,0 +1,104 @@
+import io
+import os
+import zipfile
+import threading
+
+import pytest
+
+from backend.task_store import MemoryTaskStore
+from backend.zip_stream import IncompleteArchive, iter_task_entries, iter_zip, list_files
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def test_list_files_skips_partial_downloads_and_bookkeeping(tmp_path):
+    for name in ("b.jpg", "a.mp4", "sub/c.txt", "video.mp4.part", "video.mp4.part.json", ".ltk_items.json", "x.tmp"):
+        write(str(tmp_path / name), b"x")
+    assert [arcname for _, arcname in list_files(str(tmp_path))] == ["a.mp4", "b.jpg", os.path.join("sub", "c.txt")]
+
+def test_iter_zip_streams_a_valid_archive(tmp_path):
+    files = {
+        "image_0_0.jpg": os.urandom(5000),
+        "video_1_0.mp4": os.urandom(20000),
+        "sub/notes.txt": b"hello " * 1000,
+    }
+    for name, data in files.items():
+        write(str(tmp_path / name), data)
+
+    chunks = list(iter_zip(list_files(str(tmp_path)), chunk_size=4096))
+    # Bytes are produced while the files are read, not all at the end
+    assert len(chunks) > 2
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == sorted(files)
+        for name, data in files.items():
+            assert archive.read(name) == data
+        # Media is stored as is; other files are deflated
+        assert archive.getinfo("video_1_0.mp4").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("image_0_0.jpg").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("sub/notes.txt").compress_type == zipfile.ZIP_DEFLATED
+
+def test_iter_zip_skips_files_that_vanished(tmp_path):
+    write(str(tmp_path / "kept.jpg"), b"data")
+    entries = [(str(tmp_path / "gone.jpg"), "gone.jpg"), (str(tmp_path / "kept.jpg"), "kept.jpg")]
+    with zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(entries)))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["kept.jpg"]
+
+def test_iter_zip_of_nothing_is_an_empty_archive():
+    with zipfile.ZipFile(io.BytesIO(b"".join(iter_zip([])))) as archive:
+        assert archive.namelist() == []
+
+def save(store, tmp_path, name, data=b"x"):
+    write(str(tmp_path / name), data)
+    store.append_event("t", {"type": "file_saved", "file": name, "bytes": len(data)})
+
+def test_task_entries_follow_files_as_they_are_saved(tmp_path):
+    store = MemoryTaskStore()
+    store.create("t", {"status": "downloading"})
+    save(store, tmp_path, "image_0_0.jpg")
+    # Still being written, not announced yet
+    write(str(tmp_path / "video_1_0.mp4.part"), b"partial")
+    entries = iter_task_entries(store, "t", str(tmp_path), poll_interval=0.01)
+
+    assert next(entries)[1] == "image_0_0.jpg"
+
+    def finish():
+        os.rename(str(tmp_path / "video_1_0.mp4.part"), str(tmp_path / "video_1_0.mp4"))
+        store.append_event("t", {"type": "file_saved", "file": "video_1_0.mp4"})
+        write(str(tmp_path / "image_2_0.jpg"), b"unannounced")
+        store.update("t", status="completed")
+
+    threading.Timer(0.05, finish).start()
+    assert [arcname for _, arcname in entries] == ["video_1_0.mp4", "image_2_0.jpg"]
+
+def test_zip_of_a_running_task_is_valid_once_it_completes(tmp_path):
+    store = MemoryTaskStore()
+    store.create("t", {"status": "downloading"})
+    save(store, tmp_path, "image_0_0.jpg", b"first")
+    chunks = iter_zip(iter_task_entries(store, "t", str(tmp_path), poll_interval=0.01))
+
+    # The first file is sent before the task has finished
+    first = next(chunks)
+    assert b"first" in first
+    save(store, tmp_path, "image_1_0.jpg", b"second")
+    store.update("t", status="completed")
+
+    with zipfile.ZipFile(io.BytesIO(first + b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.read("image_0_0.jpg") == b"first"
+        assert archive.read("image_1_0.jpg") == b"second"
+
+def test_task_entries_break_off_when_the_task_fails(tmp_path):
+    store = MemoryTaskStore()
+    store.create("t", {"status": "downloading"})
+    save(store, tmp_path, "image_0_0.jpg")
+    entries = iter_task_entries(store, "t", str(tmp_path), poll_interval=0.01)
+
+    assert next(entries)[1] == "image_0_0.jpg"
+    store.update("t", status="failed", error="Download cancelled")
+    with pytest.raises(IncompleteArchive, match="Download cancelled"):
+        next(entries)
@@ -0,0 +1,180 @@
+import os
+import time
+import zipfile
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Read size for copying files into the archive
+CHUNK_SIZE = 1024 * 1024
+
+# Formats that are already compressed; deflating them only burns CPU
+STORED_EXTENSIONS = {
+    '.mp4', '.m4v', '.mov', '.webm', '.ts',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif',
+    '.zip', '.gz',
+}
+
+# Partial downloads and resume bookkeeping left in task directories by the
+# downloaders (see download_script/resume.py); never part of the results
+INTERNAL_SUFFIXES = ('.part', '.part.json', '.tmp')
+INTERNAL_NAMES = {'.ltk_items.json'}
+
+def is_internal_file(filename):
+    """Whether a file in a task directory is a partial download or bookkeeping"""
+    return filename in INTERNAL_NAMES or filename.endswith(INTERNAL_SUFFIXES)
+
+# How often a zip of a running task looks for newly saved files
+FOLLOW_INTERVAL = 0.5
+
+class IncompleteArchive(Exception):
+    """The task being zipped failed or vanished before all its files were saved"""
+
+class _StreamBuffer:
+    """
+    Write-only, non-seekable file object that collects what ZipFile writes
+
+    Because it can't seek, ZipFile writes sizes and CRCs in data descriptors
+    after each entry instead of patching local headers, so the archive can be
+    sent as it is produced.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def list_files(root_dir):
+    """
+    List the files under root_dir as (path, arcname) pairs, in a stable order,
+    leaving out partial downloads and resume bookkeeping
+
+    Args:
+        root_dir (str): Directory to archive
+
+    Returns:
+        list: (absolute path, archive name relative to root_dir) tuples
+    """
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if is_internal_file(filename):
+                continue
+            path = os.path.join(dirpath, filename)
+            entries.append((path, os.path.relpath(path, root_dir)))
+    return entries
+
+def iter_task_entries(task_store, task_id, root_dir, poll_interval=FOLLOW_INTERVAL):
+    """
+    Follow a running task, yielding its files as they are saved
+
+    A file is yielded once its file_saved event shows up in the task's event
+    log, so the zip of a download can be sent while later posts are still
+    being fetched. When the task completes, files that were never announced
+    are added as well.
+
+    Args:
+        task_store (TaskStore): Store holding the task and its events
+        task_id (str): Task to follow
+        root_dir (str): The task's download directory
+        poll_interval (float): Seconds between looks at the event log
+
+    Yields:
+        tuple: (absolute path, archive name relative to root_dir)
+
+    Raises:
+        IncompleteArchive: If the task fails or is deleted first, so the
+                           client never takes a partial zip for a whole one
+    """
+    sent = set()
+    last_event_id = 0
+    while True:
+        # Status first: once it reads completed, the events read next include every file
+        task = task_store.get(task_id)
+        saved = set()
+        for event_id, event in task_store.events_since(task_id, last_event_id):
+            last_event_id = event_id
+            if event.get("type") == "file_saved":
+                saved.add(event.get("file"))
+
+        finished = task is not None and task.get("status") == "completed"
+        if saved or finished:
+            entries = [entry for entry in list_files(root_dir) if entry[0] not in sent]
+            announced = [entry for entry in entries if os.path.basename(entry[0]) in saved]
+            rest = [entry for entry in entries if finished and entry not in announced]
+            for path, arcname in announced + rest:
+                sent.add(path)
+                yield path, arcname
+
+        if finished:
+            return
+        if task is None or task.get("status") == "failed":
+            error = task.get("error") if task else "task deleted"
+            raise IncompleteArchive(f"Task {task_id} stopped before its zip was complete: {error}")
+        time.sleep(poll_interval)
+
+def iter_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    Generate a ZIP archive of the given files chunk by chunk
+
+    Nothing is written to disk: each file is read and its bytes are yielded as
+    soon as they are part of the archive. Already-compressed media is STORED,
+    everything else is DEFLATED.
+
+    Args:
+        entries (iterable): (path, arcname) pairs; may be a generator that
+                            yields files as they become available
+        chunk_size (int): Read size for the source files
+
+    Yields:
+        bytes: Consecutive pieces of the ZIP file
+    """
+    buffer = _StreamBuffer()
+
+    with zipfile.ZipFile(buffer, mode='w', allowZip64=True) as archive:
+        for path, arcname in entries:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            except OSError as e:
+                logger.warning(f"Skipping {path} in zip stream: {e}")
+                continue
+
+            extension = os.path.splitext(arcname)[1].lower()
+            zinfo.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+            with open(path, 'rb') as source, archive.open(zinfo, mode='w', force_zip64=zinfo.file_size > 0x7FFFFFFF) as dest:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+
+            data = buffer.drain()
+            if data:
+                yield data
+
+    # Central directory, written when the archive is closed
+    data = buffer.drain()
+    if data:
+        yield data
@@ -18,6 +18,7 @@ export default function Home() {
   const [taskId, setTaskId] = useState(null);
   const [status, setStatus] = useState(null);
   const [pollingInterval, setPollingInterval] = useState(null);
+  const [eventSource, setEventSource] = useState(null);
   const [useDirectApi, setUseDirectApi] = useState(false);
   const [retryCount, setRetryCount] = useState(0);
   const [downloadReady, setDownloadReady] = useState(false);
@@ -36,6 +37,15 @@ export default function Home() {
     };
   }, [pollingInterval]);
 
+  // Close the progress event stream on unmount
+  useEffect(() => {
+    return () => {
+      if (eventSource) {
+        eventSource.close();
+      }
+    };
+  }, [eventSource]);
+
   // Simulate progress while waiting for API response
   useEffect(() => {
     let progressInterval;
@@ -151,8 +161,8 @@ export default function Home() {
       setTaskId(data.task_id);
       setStatus('processing');
       
-      // Poll for status
-      startPolling(data.task_id);
+      // Follow progress over the event stream (falls back to polling)
+      startEventStream(data.task_id);
     } catch (err) {
       console.error('Error starting download:', err);
       
@@ -176,6 +186,78 @@ export default function Home() {
     }
   };
 
+  const startEventStream = (id) => {
+    // Browsers without EventSource keep using the status endpoint
+    if (typeof window === 'undefined' || !window.EventSource) {
+      startPolling(id);
+      return;
+    }
+
+    if (eventSource) {
+      eventSource.close();
+    }
+
+    const eventsUrl = `${API_URL}/api/download/${id}/events`;
+    console.log(`Opening progress event stream at: ${eventsUrl}`);
+    const source = new EventSource(eventsUrl);
+    let totalPosts = 0;
+    let finishedPosts = 0;
+    let finished = false;
+
+    const finish = () => {
+      finished = true;
+      source.close();
+      setEventSource(null);
+    };
+
+    source.addEventListener('status', (e) => {
+      const data = JSON.parse(e.data);
+      setStatus(data.status);
+    });
+
+    source.addEventListener('posts_discovered', (e) => {
+      totalPosts = JSON.parse(e.data).count || 0;
+    });
+
+    source.addEventListener('item_finished', () => {
+      finishedPosts += 1;
+      if (totalPosts > 0) {
+        // Real progress, kept below 100% until the zip is ready
+        setLoadingProgress(prev => Math.max(prev, Math.min(95, (finishedPosts / totalPosts) * 95)));
+      }
+    });
+
+    source.addEventListener('zip_ready', () => {
+      finish();
+      setStatus('completed');
+      const downloadUrl = `${API_URL}/api/download/${id}`;
+      console.log(`Download ready at: ${downloadUrl}`);
+      setDownloadReady(true);
+      setDownloadUrl(downloadUrl);
+    });
+
+    source.addEventListener('failed', (e) => {
+      finish();
+      const data = JSON.parse(e.data);
+      setStatus('failed');
+      if (data.error) {
+        setError(`Download failed: ${data.error}`);
+      }
+    });
+
+    source.onerror = () => {
+      if (finished) return;
+      // EventSource reconnects by itself; only give up when it has closed the stream
+      if (source.readyState === EventSource.CLOSED) {
+        console.warn('Progress event stream closed. Falling back to status polling.');
+        finish();
+        startPolling(id);
+      }
+    };
+
+    setEventSource(source);
+  };
+
   const startPolling = (id) => {
     console.log(`Starting polling for task ${id}`);
     